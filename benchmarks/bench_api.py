@@ -0,0 +1,290 @@
+"""
+Prueba de carga reproducible de la API con Mercado Pago y SMTP simulados (ver stub_app.py).
+
+Siembra un catálogo sintético en un directorio temporal, levanta la app y la carga
+con clientes concurrentes (un proceso por cliente) sobre los endpoints críticos:
+
+    GET  /api/products             catálogo completo (cacheado por worker)
+    POST /api/calculate_shipping   cálculo puro
+    POST /api/create_preference    validación del carrito + reservas + MP (simulado)
+    POST /api/webhook              firma HMAC + bandeja durable (el worker luego
+                                   consulta el pago, descuenta stock y encola emails)
+
+Modos:
+    inprocess   uvicorn en un hilo de este proceso (un solo event loop, sin gunicorn)
+    gunicorn    gunicorn + UvicornWorker con --workers N, como en producción (Dockerfile)
+    both        los dos, uno después del otro, con la misma semilla
+
+Uso:
+    python benchmarks/bench_api.py --mode both --products 2000 --clients 16 --seconds 20
+    python benchmarks/bench_api.py --mode gunicorn --requests 5000 --output resultado.json
+Imprime (y opcionalmente guarda) un JSON con p50/p95/p99, RPS y errores por endpoint.
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stub_app import WEBHOOK_SECRET, prepare_workdir
+
+# Peso de cada endpoint en la mezcla de tráfico (navegar es mucho más común que pagar)
+DEFAULT_MIX = {
+    "products": 50,
+    "calculate_shipping": 25,
+    "create_preference": 15,
+    "webhook": 10,
+}
+ZIP_CODES = ["4400", "1425", "5500", "8300", "9410", "3000"]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(base_url, timeout=30.0):
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/api/products/listing?limit=1", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"La app no respondió en {timeout:.0f}s ({base_url})")
+
+
+def signed_webhook(payment_id):
+    """Body y headers de una notificación de MP firmada como lo hace Mercado Pago."""
+    request_id = f"bench-{payment_id}"
+    ts = str(int(time.time() * 1000))
+    manifest = f"id:{payment_id};request-id:{request_id};ts:{ts};"
+    v1 = hmac.new(WEBHOOK_SECRET.encode(), manifest.encode(), "sha256").hexdigest()
+    headers = {"x-signature": f"ts={ts},v1={v1}", "x-request-id": request_id}
+    return {"type": "payment", "action": "payment.created", "data": {"id": payment_id}}, headers
+
+
+def _client(client_id, base_url, product_ids, mix, deadline, max_requests, seed, run_id, queue):
+    import requests
+    rng = random.Random(seed * 1000 + client_id)
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    latencies = {e: [] for e in endpoints}
+    errors = {e: 0 for e in endpoints}
+    status_codes = {e: {} for e in endpoints}
+
+    session = requests.Session()
+    sent = 0
+    while time.time() < deadline and (max_requests is None or sent < max_requests):
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == "products":
+            args = ("GET", f"{base_url}/api/products"), {}
+        elif endpoint == "calculate_shipping":
+            args = ("POST", f"{base_url}/api/calculate_shipping"), {"json": {"zip_code": rng.choice(ZIP_CODES)}}
+        elif endpoint == "create_preference":
+            items = [
+                {"id": pid, "quantity": rng.randint(1, 2), "variant": "pack"}
+                for pid in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 3)))
+            ]
+            args = ("POST", f"{base_url}/api/create_preference"), {"json": {"items": items, "zip_code": rng.choice(ZIP_CODES)}}
+        else:
+            body, headers = signed_webhook(f"{run_id}{client_id:03d}{sent:07d}")
+            args = ("POST", f"{base_url}/api/webhook"), {"json": body, "headers": headers}
+
+        t0 = time.perf_counter()
+        try:
+            response = session.request(*args[0], timeout=30, **args[1])
+            elapsed = time.perf_counter() - t0
+            code = str(response.status_code)
+            status_codes[endpoint][code] = status_codes[endpoint].get(code, 0) + 1
+            if response.status_code >= 400:
+                errors[endpoint] += 1
+            else:
+                latencies[endpoint].append(elapsed)
+        except requests.RequestException:
+            errors[endpoint] += 1
+        sent += 1
+    queue.put({"latencies": latencies, "errors": errors, "status_codes": status_codes})
+
+
+def run_load(base_url, product_ids, clients, seconds, total_requests, mix, seed):
+    """Lanza `clients` procesos contra base_url y agrega los resultados por endpoint."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    max_requests = -(-total_requests // clients) if total_requests else None
+    # Con --requests el tope real es la cantidad; el deadline queda como red de seguridad
+    deadline = time.time() + (seconds if not total_requests else 3600)
+    run_id = str(int(time.time()))
+    procs = [
+        ctx.Process(target=_client, args=(i, base_url, product_ids, mix, deadline, max_requests, seed, run_id, queue))
+        for i in range(clients)
+    ]
+    started = time.time()
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    duration = time.time() - started
+
+    report = {}
+    for endpoint in mix:
+        latencies = [x for r in results for x in r["latencies"][endpoint]]
+        errors = sum(r["errors"][endpoint] for r in results)
+        codes = {}
+        for r in results:
+            for code, n in r["status_codes"][endpoint].items():
+                codes[code] = codes.get(code, 0) + n
+        report[endpoint] = {
+            "requests": len(latencies) + errors,
+            "errors": errors,
+            "status_codes": codes,
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        }
+    total_ok = sum(len(r["latencies"][e]) for r in results for e in mix)
+    return {"duration_s": round(duration, 2), "total_rps": round(total_ok / duration, 1), "endpoints": report}
+
+
+def _server_env(workdir, args):
+    env = dict(os.environ)
+    env["BENCH_WORKDIR"] = workdir
+    env["BENCH_MP_LATENCY_MS"] = str(args.mp_latency_ms)
+    env["BENCH_SMTP_LATENCY_MS"] = str(args.smtp_latency_ms)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def serve_inprocess(workdir, args):
+    """uvicorn en un hilo de este proceso. Devuelve (base_url, función para detenerlo)."""
+    import uvicorn
+    from benchmarks.stub_app import load_app
+
+    # Sin BENCH_WORKDIR en el entorno: los clientes (procesos spawn) lo heredarían e importarían la app
+    os.environ["BENCH_MP_LATENCY_MS"] = str(args.mp_latency_ms)
+    os.environ["BENCH_SMTP_LATENCY_MS"] = str(args.smtp_latency_ms)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(load_app(workdir), host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=15)
+    return f"http://127.0.0.1:{port}", stop
+
+
+def serve_gunicorn(workdir, args):
+    """gunicorn con UvicornWorker en un subproceso. Devuelve (base_url, función para detenerlo)."""
+    port = free_port()
+    cmd = [
+        sys.executable, "-m", "gunicorn", "-k", "uvicorn.workers.UvicornWorker",
+        "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}",
+        "--chdir", workdir, "--log-level", "warning", "benchmarks.stub_app:app",
+    ]
+    proc = subprocess.Popen(cmd, env=_server_env(workdir, args))
+
+    def stop():
+        proc.terminate()
+        try:
+            proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return f"http://127.0.0.1:{port}", stop
+
+
+def run_mode(mode, args, mix):
+    workdir = tempfile.mkdtemp(prefix=f"bench-api-{mode}-")
+    prepare_workdir(workdir, args.products, seed=args.seed)
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, "tienda.db")) as conn:
+        product_ids = [row[0] for row in conn.execute("SELECT id FROM product")]
+
+    if mode == "inprocess":
+        base_url, stop = serve_inprocess(workdir, args)
+    else:
+        base_url, stop = serve_gunicorn(workdir, args)
+    try:
+        wait_until_ready(base_url)
+        if args.warmup:
+            run_load(base_url, product_ids, args.clients, args.warmup, None, mix, args.seed + 1)
+        result = run_load(base_url, product_ids, args.clients, args.seconds, args.requests, mix, args.seed)
+    finally:
+        stop()
+    result["workdir"] = workdir
+    if mode == "gunicorn":
+        result["workers"] = args.workers
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "gunicorn", "both"], default="both")
+    parser.add_argument("--products", type=int, default=1000, help="Tamaño del catálogo sintético")
+    parser.add_argument("--clients", type=int, default=8, help="Clientes concurrentes (un proceso cada uno)")
+    parser.add_argument("--seconds", type=float, default=15, help="Duración de la medición")
+    parser.add_argument("--requests", type=int, default=None, help="Cantidad total de requests (en lugar de --seconds)")
+    parser.add_argument("--warmup", type=float, default=2, help="Segundos de calentamiento sin medir (0 para omitir)")
+    parser.add_argument("--workers", type=int, default=2, help="Workers de gunicorn")
+    parser.add_argument("--mp-latency-ms", type=float, default=80, help="Latencia simulada de Mercado Pago")
+    parser.add_argument("--smtp-latency-ms", type=float, default=30, help="Latencia simulada del SMTP")
+    parser.add_argument("--mix", default=None, help='Pesos por endpoint, p. ej. "products=70,webhook=30"')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Guardar el JSON también en este archivo")
+    args = parser.parse_args(argv)
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = {}
+        for part in args.mix.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in DEFAULT_MIX:
+                parser.error(f"Endpoint desconocido en --mix: {name}")
+            mix[name.strip()] = float(weight or 1)
+
+    modes = ["inprocess", "gunicorn"] if args.mode == "both" else [args.mode]
+    report = {
+        "config": {
+            "products": args.products, "clients": args.clients, "seconds": args.seconds,
+            "requests": args.requests, "mp_latency_ms": args.mp_latency_ms,
+            "smtp_latency_ms": args.smtp_latency_ms, "mix": mix, "seed": args.seed,
+        },
+        "results": {},
+    }
+    # gunicorn primero: el modo inprocess importa main en este proceso y cambia el cwd
+    for mode in sorted(modes, key=lambda m: m != "gunicorn"):
+        report["results"][mode] = run_mode(mode, args, mix)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Benchmark de concurrencia de SQLite: latencia de lectura del catálogo mientras
+hay escrituras concurrentes de checkout (descuento de stock + registro de compra).
+
+Compara el engine "legacy" (rollback journal, sin PRAGMAs) contra el engine
+ajustado de database.py (WAL, synchronous=NORMAL, cache, mmap, temp_store).
+
+Uso:
+    python benchmarks/bench_sqlite_concurrency.py --readers 8 --writers 2 --seconds 5
+Imprime un JSON con p50/p95/p99 de lectura y escrituras por segundo por modo.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from database import make_sqlite_engine
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(engine, products):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE product (id INTEGER PRIMARY KEY, name VARCHAR, price FLOAT, stock INTEGER, "
+            "is_active BOOLEAN, notas_de_cata VARCHAR)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE purchaserecord (id INTEGER PRIMARY KEY, items VARCHAR, total_paid FLOAT)"
+        ))
+        conn.execute(
+            text("INSERT INTO product (name, price, stock, is_active, notas_de_cata) VALUES (:n, :p, :s, 1, :d)"),
+            [{"n": f"Vino {i}", "p": 1000.0 + i, "s": 10_000, "d": "x" * 500} for i in range(products)],
+        )
+
+
+def _reader(url, tuned, products, deadline, queue):
+    engine = make_sqlite_engine(url, tuned=tuned)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT * FROM product WHERE is_active = 1")).fetchall()
+        except Exception:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - t0) * 1000)
+    engine.dispose()
+    queue.put(("read", latencies, errors))
+
+
+def _writer(url, tuned, products, deadline, hold_ms, queue):
+    engine = make_sqlite_engine(url, tuned=tuned)
+    latencies, errors = [], 0
+    rnd = random.Random()
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                for _ in range(3):
+                    conn.execute(
+                        text("UPDATE product SET stock = max(0, stock - 1) WHERE id = :id"),
+                        {"id": rnd.randint(1, products)},
+                    )
+                conn.execute(
+                    text("INSERT INTO purchaserecord (items, total_paid) VALUES (:i, :t)"),
+                    {"i": json.dumps([{"id": 1, "qty": 1}]), "t": 1000.0},
+                )
+                # Simula el tiempo que una transacción de checkout mantiene el lock
+                time.sleep(hold_ms / 1000.0)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - t0) * 1000)
+    engine.dispose()
+    queue.put(("write", latencies, errors))
+
+
+def run_mode(mode, args):
+    # Cada lector/escritor es un proceso aparte, como los workers de gunicorn
+    tuned = mode == "tuned"
+    tmpdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    engine = make_sqlite_engine(url, tuned=tuned)
+    seed(engine, args.products)
+    engine.dispose()
+
+    queue = multiprocessing.Queue()
+    deadline = time.time() + 0.5 + args.seconds
+    procs = [
+        multiprocessing.Process(target=_reader, args=(url, tuned, args.products, deadline, queue))
+        for _ in range(args.readers)
+    ]
+    procs += [
+        multiprocessing.Process(target=_writer, args=(url, tuned, args.products, deadline, args.write_hold_ms, queue))
+        for _ in range(args.writers)
+    ]
+    for p in procs:
+        p.start()
+    read_latencies, write_latencies, errors = [], [], 0
+    for _ in procs:
+        kind, latencies, errs = queue.get()
+        (read_latencies if kind == "read" else write_latencies).extend(latencies)
+        errors += errs
+    for p in procs:
+        p.join()
+
+    return {
+        "mode": mode,
+        "reads": len(read_latencies),
+        "reads_per_sec": round(len(read_latencies) / args.seconds, 1),
+        "read_p50_ms": round(percentile(read_latencies, 50) or 0, 3),
+        "read_p95_ms": round(percentile(read_latencies, 95) or 0, 3),
+        "read_p99_ms": round(percentile(read_latencies, 99) or 0, 3),
+        "read_max_ms": round(max(read_latencies) if read_latencies else 0, 3),
+        "writes": len(write_latencies),
+        "writes_per_sec": round(len(write_latencies) / args.seconds, 1),
+        "write_p50_ms": round(statistics.median(write_latencies), 3) if write_latencies else None,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-hold-ms", type=float, default=5.0)
+    parser.add_argument("--modes", default="legacy,tuned")
+    args = parser.parse_args()
+
+    results = [run_mode(mode, args) for mode in args.modes.split(",")]
+    print(json.dumps({"benchmark": "sqlite_concurrency", "params": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+La app real (main.app) con los servicios externos simulados, para benchmarks.
+
+- mercadopago.SDK se reemplaza por FakeMercadoPagoSDK (latencia configurable).
+- El despachador SMTP se reemplaza por FakeSMTPDispatcher (no abre conexiones).
+- WhatsApp queda sin credenciales, así que las alertas se omiten.
+- Las bases, static/ y .cache/ viven en un directorio de trabajo propio
+  (nunca se tocan tienda.db ni compras.db del repo).
+
+Uso directo con gunicorn (lo hace bench_api.py --mode gunicorn):
+    BENCH_WORKDIR=/tmp/bench PYTHONPATH=. gunicorn -k uvicorn.workers.UvicornWorker \\
+        --chdir /tmp/bench benchmarks.stub_app:app
+
+Variables:
+    BENCH_WORKDIR            directorio de trabajo (obligatorio; se siembra con prepare_workdir)
+    BENCH_MP_LATENCY_MS      latencia simulada de la API de Mercado Pago (default 80)
+    BENCH_SMTP_LATENCY_MS    latencia simulada de un envío SMTP (default 30)
+"""
+import os
+import sys
+import time
+import uuid
+import random
+from concurrent.futures import Future
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+WEBHOOK_SECRET = "bench-webhook-secret"
+ADMIN_TOKEN = "bench-admin"
+
+# Valores fijos para que un .env local (con credenciales reales) no se cuele en el benchmark:
+# load_dotenv no pisa variables ya definidas.
+STUB_ENV = {
+    "MERCADOPAGO_ACCESS_TOKEN": "TEST-bench",
+    "MERCADOPAGO_WEBHOOK_SECRET": WEBHOOK_SECRET,
+    "ADMIN_PASSWORD": ADMIN_TOKEN,
+    "MAIL_USERNAME": "bench@example.com",
+    "MAIL_PASSWORD": "bench",
+    "SMTP_HOST": "127.0.0.1",
+    "SMTP_PORT": "1",
+    "WHATSAPP_API_TOKEN": "",
+    "WHATSAPP_PHONE_NUMBER_ID": "",
+    "ADMIN_WHATSAPP_NUMBER": "",
+    "WHATSAPP_TEMPLATE_NAME": "",
+    "WHATSAPP_API_BASE_URL": "http://127.0.0.1:1",
+    "FRONTEND_URL": "http://localhost:5173",
+    "API_PUBLIC_URL": "http://127.0.0.1:8000",
+}
+
+
+def _latency(env_name: str, default_ms: float) -> float:
+    return float(os.getenv(env_name, str(default_ms))) / 1000.0
+
+
+class _FakePreference:
+    def create(self, preference_data):
+        time.sleep(_latency("BENCH_MP_LATENCY_MS", 80))
+        return {"status": 201, "response": {"id": f"bench-{uuid.uuid4().hex}", "init_point": "https://example.com"}}
+
+
+class _FakePayment:
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+
+    def get(self, payment_id):
+        time.sleep(_latency("BENCH_MP_LATENCY_MS", 80))
+        product_id = random.choice(self.product_ids) if self.product_ids else 1
+        return {
+            "status": 200,
+            "response": {
+                "id": payment_id,
+                "status": "approved",
+                "external_reference": None,
+                "transaction_amount": 12000.0,
+                "metadata": {"name": "Bench", "last_name": "Client", "email": "client@example.com", "address": "Calle 123"},
+                "additional_info": {"items": [
+                    {"id": f"PACK|{product_id}", "title": f"Vino {product_id}", "quantity": 1, "unit_price": 12000.0},
+                ]},
+            },
+        }
+
+
+class FakeMercadoPagoSDK:
+    """Responde como mercadopago.SDK para preference().create y payment().get."""
+
+    product_ids = []
+
+    def __init__(self, access_token=None):
+        self._preference = _FakePreference()
+        self._payment = _FakePayment(self.product_ids)
+
+    def preference(self):
+        return self._preference
+
+    def payment(self):
+        return self._payment
+
+
+class FakeSMTPDispatcher:
+    """Misma interfaz que mailer.SMTPDispatcher, sin red."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def submit(self, msg):
+        future = Future()
+        future.set_result(self.send(msg))
+        return future
+
+    def send(self, msg, timeout=None):
+        time.sleep(_latency("BENCH_SMTP_LATENCY_MS", 30))
+        self.sent += 1
+        return {}
+
+    def pending(self):
+        return 0
+
+    def stop(self, timeout=10.0):
+        pass
+
+
+def prepare_workdir(workdir: str, products: int, seed: int = 42):
+    """Crea el directorio de trabajo y siembra un catálogo sintético de `products` vinos."""
+    os.makedirs(workdir, exist_ok=True)
+    for name in ("tienda.db", "compras.db"):
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(workdir, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Sin importar database: sus engines resuelven "tienda.db" contra el cwd al importarse
+    # y apuntarían a las bases del repo
+    from sqlalchemy import insert
+    from sqlmodel import create_engine
+    import models
+    from migrations import migrate_all
+
+    rng = random.Random(seed)
+    regions = ["Salta", "Mendoza", "San Juan", "Neuquén", "Río Negro", "Catamarca"]
+    varietals = ["Malbec", "Cabernet Sauvignon", "Tannat", "Syrah", "Torrontés", "Criolla Chica", "Petit Verdot"]
+    rows = []
+    for i in range(products):
+        marca = f"Bodega {i % 40}"
+        price = float(rng.randrange(40, 200) * 1000)
+        rows.append({
+            "name": f"{rng.choice(varietals)} {i}",
+            "description": "Vino sintético para benchmark",
+            "long_description": "Lorem ipsum " * 20,
+            "price": price,
+            "category": marca,
+            "stock": 1_000_000,
+            "is_active": True,
+            "images": [f"/static/products/bench-{i}.webp"],
+            "image_variants": None,
+            "additional_info": {},
+            # Stock enorme: el benchmark mide latencia, no agotamiento
+            "pack_info": {"pack_name": "Caja x6 Botellas", "pack_price": price * 6, "pack_stock": 1_000_000},
+            "pack_stock": 1_000_000,
+            "pack_reserved": 0,
+            "marca": marca,
+            "region": rng.choice(regions),
+            "cosecha": str(rng.randrange(2015, 2025)),
+            "notas_de_cata": "Aromas de frutos rojos y especias. " * 5,
+        })
+
+    migrate_all(os.path.join(workdir, "tienda.db"), os.path.join(workdir, "compras.db"))
+    tienda = create_engine(f"sqlite:///{os.path.join(workdir, 'tienda.db')}")
+    try:
+        with tienda.begin() as conn:
+            for start in range(0, len(rows), 500):
+                conn.execute(insert(models.Product), rows[start:start + 500])
+    finally:
+        tienda.dispose()
+
+    for directory in ("static/products", "static/fichas", "private/comprobantes"):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+
+
+def load_app(workdir: str = None):
+    """Importa main con los stubs instalados, usando workdir (o BENCH_WORKDIR) como cwd."""
+    workdir = workdir or os.getenv("BENCH_WORKDIR")
+    if not workdir:
+        raise RuntimeError("Definir BENCH_WORKDIR (directorio sembrado con prepare_workdir)")
+    if "database" in sys.modules:
+        raise RuntimeError("database ya estaba importado: sus engines apuntarían a las bases del cwd anterior")
+    os.chdir(workdir)
+    for key, value in STUB_ENV.items():
+        os.environ[key] = value
+    os.environ["CACHE_DIR"] = os.path.join(workdir, ".cache")
+    os.environ["DATA_DIR"] = workdir
+
+    import mercadopago
+    mercadopago.SDK = FakeMercadoPagoSDK
+
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, "tienda.db")) as conn:
+        FakeMercadoPagoSDK.product_ids = [row[0] for row in conn.execute("SELECT id FROM product")]
+
+    import mailer
+    mailer.set_dispatcher(FakeSMTPDispatcher())
+
+    import main
+    return main.app
+
+
+if os.getenv("BENCH_WORKDIR"):
+    app = load_app()
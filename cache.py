@@ -0,0 +1,123 @@
+# cache.py
+import os
+import gzip
+import json
+import hashlib
+import mmap
+import struct
+import time
+import fcntl
+import threading
+
+from metrics import metrics
+
+# Directorio donde viven los contadores compartidos entre workers de gunicorn
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+_COUNTER_FORMAT = "<Q"
+_COUNTER_SIZE = struct.calcsize(_COUNTER_FORMAT)
+
+
+class SharedVersion:
+    """
+    Contador de versión de 8 bytes en un archivo mapeado en memoria (mmap).
+    Todos los workers mapean el mismo archivo: leer la versión es una lectura de
+    memoria (sin syscalls) y cualquier escritura se ve al instante en los demás.
+    """
+
+    def __init__(self, name: str, directory: str = None):
+        directory = directory or CACHE_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.version")
+        self._lock = threading.Lock()
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Inicializar el archivo con ceros si es nuevo (bajo lock para no pisar a otro worker)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < _COUNTER_SIZE:
+                    os.ftruncate(fd, _COUNTER_SIZE)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mmap = mmap.mmap(fd, _COUNTER_SIZE)
+        finally:
+            os.close(fd)
+
+    def get(self) -> int:
+        return struct.unpack_from(_COUNTER_FORMAT, self._mmap, 0)[0]
+
+    def bump(self) -> int:
+        # flock sobre el archivo para que dos workers no pierdan incrementos
+        with self._lock, open(self.path, "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                new_version = self.get() + 1
+                struct.pack_into(_COUNTER_FORMAT, self._mmap, 0, new_version)
+                return new_version
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CatalogPayload:
+    """
+    Respuesta del catálogo ya serializada: JSON en bytes, su versión gzip y un
+    ETag fuerte. Se arma una sola vez por versión del catálogo.
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        # Cada codificación es una representación distinta: necesita su propio ETag fuerte
+        self.gzip_etag = f'"{digest}-gzip"'
+
+    def matches(self, if_none_match: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return self.etag in candidates or self.gzip_etag in candidates
+
+
+class CatalogCache:
+    """
+    Caché del catálogo por worker, validada contra una versión compartida.
+    Una escritura en cualquier worker incrementa la versión e invalida la caché
+    de todos los workers en la siguiente lectura.
+    """
+
+    def __init__(self, name: str = "catalog", ttl: float = 3600):
+        self.name = name
+        self.ttl = ttl
+        self.version = SharedVersion(name)
+        self._data = None
+        self._data_version = -1
+        self._timestamp = 0.0
+
+    def get(self):
+        data = self._lookup()
+        metrics.inc("cache_requests_total", cache=self.name, result="miss" if data is None else "hit")
+        return data
+
+    def _lookup(self):
+        if self._data is None:
+            return None
+        if self._data_version != self.version.get():
+            return None
+        if (time.time() - self._timestamp) >= self.ttl:
+            return None
+        return self._data
+
+    def set(self, data, version: int = None):
+        # La versión se toma ANTES de consultar la base para no cachear datos
+        # que ya fueron invalidados por una escritura concurrente
+        self._data = data
+        self._data_version = self.version.get() if version is None else version
+        self._timestamp = time.time()
+
+    def invalidate(self):
+        self._data = None
+        self.version.bump()
@@ -1,21 +1,116 @@
 # database.py
-from sqlmodel import create_engine, SQLModel
+import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+
+from metrics import instrument_engine
+from profiler import profile_engine
+
+# PRAGMAs aplicados a cada conexión nueva.
+# WAL permite que los lectores no se bloqueen mientras hay una escritura en curso
+# (descuentos de stock, registro de compras) y synchronous=NORMAL es seguro en WAL.
+# cache_size negativo = KiB por conexión; mmap_size se comparte vía el page cache del SO.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE_KIB", "8192")) * -1,
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+# Pool acotado: con 2 workers de gunicorn y 2 bases no conviene abrir decenas de conexiones
+SQLITE_POOL_OPTIONS = {
+    "pool_size": int(os.getenv("SQLITE_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("SQLITE_MAX_OVERFLOW", "5")),
+    "pool_timeout": 30,
+    "pool_pre_ping": False,
+}
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas=None):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in (pragmas or SQLITE_PRAGMAS).items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def make_sqlite_engine(url: str, tuned: bool = True, **kwargs):
+    """Crea un engine de SQLite con los PRAGMAs y el pool configurados en cada conexión."""
+    options = dict(SQLITE_POOL_OPTIONS) if tuned else {}
+    options.update(kwargs)
+    new_engine = create_engine(
+        url,
+        echo=False,
+        connect_args={"check_same_thread": False, "timeout": 15},
+        **options,
+    )
+    if tuned:
+        @event.listens_for(new_engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            apply_sqlite_pragmas(dbapi_connection)
+    return new_engine
+
+def make_async_sqlite_engine(url: str, **kwargs):
+    """
+    Engine async (aiosqlite) con los mismos PRAGMAs y pool que make_sqlite_engine.
+    aiosqlite corre cada conexión en su propio hilo: la consulta no ocupa un lugar
+    del threadpool de Starlette ni bloquea el event loop.
+    """
+    options = dict(SQLITE_POOL_OPTIONS)
+    options.update(kwargs)
+    new_engine = create_async_engine(url, echo=False, connect_args={"timeout": 15}, **options)
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection)
+    return new_engine
+
+# Directorio de las bases. En Docker se monta como volumen el directorio entero
+# (no los .db sueltos): en WAL cada base tiene además sus archivos -wal y -shm,
+# que también tienen que persistir y ser compartidos por todos los workers.
+DATA_DIR = os.getenv("DATA_DIR", ".")
+TIENDA_DB_PATH = os.path.join(DATA_DIR, "tienda.db")
+COMPRAS_DB_PATH = os.path.join(DATA_DIR, "compras.db")
 
 # Base de datos de catálogo y productos
-DATABASE_URL = "sqlite:///tienda.db"
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False, "timeout": 15})
+DATABASE_URL = f"sqlite:///{TIENDA_DB_PATH}"
+engine = make_sqlite_engine(DATABASE_URL)
+instrument_engine(engine, "tienda")
+profile_engine(engine, "tienda")
 
 # Base de datos independiente para el registro de compras
-COMPRAS_DATABASE_URL = "sqlite:///compras.db"
-engine_compras = create_engine(COMPRAS_DATABASE_URL, echo=False, connect_args={"check_same_thread": False, "timeout": 15})
+COMPRAS_DATABASE_URL = f"sqlite:///{COMPRAS_DB_PATH}"
+engine_compras = make_sqlite_engine(COMPRAS_DATABASE_URL)
+instrument_engine(engine_compras, "compras")
+profile_engine(engine_compras, "compras")
+
+# Camino async para los endpoints de lectura con mucho tráfico (mismas bases, otro pool).
+# Los hooks de métricas y del perfilador se enganchan al sync_engine subyacente.
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{TIENDA_DB_PATH}"
+async_engine = make_async_sqlite_engine(ASYNC_DATABASE_URL)
+instrument_engine(async_engine.sync_engine, "tienda")
+profile_engine(async_engine.sync_engine, "tienda")
+
+ASYNC_COMPRAS_DATABASE_URL = f"sqlite+aiosqlite:///{COMPRAS_DB_PATH}"
+async_engine_compras = make_async_sqlite_engine(ASYNC_COMPRAS_DATABASE_URL)
+instrument_engine(async_engine_compras.sync_engine, "compras")
+profile_engine(async_engine_compras.sync_engine, "compras")
+
+def dispose_engines():
+    # Cerrar todas las conexiones hace que SQLite haga checkpoint del WAL al archivo principal
+    engine.dispose()
+    engine_compras.dispose()
+
+async def dispose_async_engines():
+    await async_engine.dispose()
+    await async_engine_compras.dispose()
 
 def create_db_and_tables():
-    import models  # Nos aseguramos de registrar los modelos en la metadata
-    
-    # Inicializa solo las tablas correspondientes en cada base de datos
-    # tienda.db: productos y pagos procesados
+    # Crea y actualiza el esquema de las dos bases con las migraciones versionadas (ver migrations.py).
+    # tienda.db: productos, reservas de stock, pagos procesados, bandeja de webhooks, outbox de notificaciones y archivos subidos
     # compras.db: historial de compras
-    tienda_tables = [models.Product.__table__, models.ProcessedPayment.__table__]
-    compras_tables = [models.PurchaseRecord.__table__]
-    SQLModel.metadata.create_all(engine, tables=tienda_tables)
-    SQLModel.metadata.create_all(engine_compras, tables=compras_tables)
\ No newline at end of file
+    # Una vez migradas es una consulta por base; con varios workers solo uno aplica cambios.
+    from migrations import migrate_all
+    os.makedirs(DATA_DIR, exist_ok=True)
+    migrate_all(tienda_path=TIENDA_DB_PATH, compras_path=COMPRAS_DB_PATH)
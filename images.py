@@ -0,0 +1,274 @@
+# images.py
+"""
+Pipeline de imágenes de productos.
+
+Cada imagen subida se normaliza una sola vez y se guarda como un juego fijo de
+variantes WebP (thumb, card, detail) con nombre derivado del hash del contenido:
+
+    static/products/<hash>-thumb.webp
+    static/products/<hash>-card.webp
+    static/products/<hash>-detail.webp
+    static/products/<hash>.json        <- metadatos (anchos/altos/bytes) de las variantes
+
+Product.images sigue guardando una ruta por imagen (la variante "detail"), y
+Product.image_variants lleva la metadata de todas las variantes para que el
+frontend elija el tamaño (src/srcset/sizes).
+
+Backfill de imágenes existentes:
+    python images.py backfill [--dry-run]
+"""
+import io
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps
+
+PRODUCTS_DIR = os.path.join("static", "products")
+PRODUCTS_URL = "/static/products"
+
+# Lado mayor de cada variante, en píxeles (las botellas son verticales: manda el alto)
+IMAGE_VARIANTS = {
+    "thumb": 160,
+    "card": 480,
+    "detail": 1200,
+}
+PRIMARY_VARIANT = "detail"
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "82"))
+MAX_SOURCE_PIXELS = 50_000_000  # Evita "bombas de descompresión" al abrir la imagen
+
+_VARIANT_RE = re.compile(r"^([0-9a-f]{32})-(%s)\.webp$" % "|".join(IMAGE_VARIANTS))
+
+Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def variant_filename(digest: str, variant: str) -> str:
+    return f"{digest}-{variant}.webp"
+
+
+def _metadata_path(digest: str, directory: str) -> str:
+    return os.path.join(directory, f"{digest}.json")
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_content_hash(path: str) -> str:
+    return file_sha256(path)[:32]
+
+
+def _load_source(source) -> Image.Image:
+    try:
+        image = Image.open(source)
+        image.load()
+    except Image.DecompressionBombError:
+        raise InvalidImage("La imagen es demasiado grande")
+    except Exception:
+        raise InvalidImage("No se pudo leer la imagen (formato no soportado o archivo dañado)")
+    # Aplicar la rotación de EXIF antes de descartar los metadatos
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+def _write_atomic(path: str, payload: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def process_image(source, directory: str = PRODUCTS_DIR, url_prefix: str = PRODUCTS_URL, digest: Optional[str] = None) -> Dict:
+    """
+    Genera las variantes WebP de una imagen y devuelve su metadata.
+    source son los bytes de la imagen o la ruta a un archivo (p. ej. el temporal de uploads.py,
+    que ya trae el SHA-256 calculado: se pasa como digest para no volver a leerlo).
+    Es idempotente: si el mismo contenido ya fue procesado se reutilizan los archivos sin decodificar nada.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        digest = digest or content_hash(source)
+        source = io.BytesIO(source)
+    else:
+        digest = digest or file_content_hash(source)
+    digest = digest[:32]
+    os.makedirs(directory, exist_ok=True)
+
+    existing = load_metadata(digest, directory, url_prefix)
+    if existing is not None:
+        return existing
+
+    source = _load_source(source)
+    variants = {}
+    for name, max_side in IMAGE_VARIANTS.items():
+        resized = source.copy()
+        # thumbnail() conserva la proporción y nunca agranda
+        resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        # Sin exif/icc: WebP solo guarda metadatos si se pasan explícitamente
+        resized.save(buffer, "WEBP", quality=WEBP_QUALITY, method=6)
+        encoded = buffer.getvalue()
+        filename = variant_filename(digest, name)
+        _write_atomic(os.path.join(directory, filename), encoded)
+        variants[name] = {"width": resized.width, "height": resized.height, "bytes": len(encoded)}
+
+    _write_atomic(_metadata_path(digest, directory), json.dumps({"hash": digest, "variants": variants}).encode("utf-8"))
+    return _with_urls(digest, variants, url_prefix)
+
+
+def _with_urls(digest: str, variants: Dict, url_prefix: str) -> Dict:
+    described = {}
+    for name, info in variants.items():
+        described[name] = dict(info, url=f"{url_prefix}/{variant_filename(digest, name)}")
+    ordered = sorted(described.values(), key=lambda v: v["width"])
+    return {
+        "hash": digest,
+        "src": described[PRIMARY_VARIANT]["url"],
+        "variants": described,
+        "srcset": ", ".join(f"{v['url']} {v['width']}w" for v in ordered),
+    }
+
+
+def load_metadata(digest: str, directory: str = PRODUCTS_DIR, url_prefix: str = PRODUCTS_URL) -> Optional[Dict]:
+    path = _metadata_path(digest, directory)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            variants = json.load(f)["variants"]
+    except (OSError, ValueError, KeyError):
+        return None
+    if not all(os.path.exists(os.path.join(directory, variant_filename(digest, n))) for n in variants):
+        return None
+    return _with_urls(digest, variants, url_prefix)
+
+
+def parse_variant_path(path: str) -> Optional[str]:
+    """Devuelve el hash si la ruta apunta a una variante generada por este módulo."""
+    match = _VARIANT_RE.match(os.path.basename(path or ""))
+    return match.group(1) if match else None
+
+
+def image_files(path: str, directory: str = PRODUCTS_DIR) -> List[str]:
+    """Archivos en disco que corresponden a una ruta de Product.images (todas sus variantes)."""
+    digest = parse_variant_path(path)
+    if digest is None:
+        return [os.path.join(directory, os.path.basename(path))]
+    files = [os.path.join(directory, variant_filename(digest, name)) for name in IMAGE_VARIANTS]
+    return files + [_metadata_path(digest, directory)]
+
+
+def describe_images(images: Optional[List[str]], directory: str = PRODUCTS_DIR) -> List[Dict]:
+    """
+    Arma Product.image_variants a partir de Product.images.
+    Las imágenes antiguas (sin variantes) se describen solo con su ruta original.
+    """
+    described = []
+    for path in images or []:
+        if not path:
+            continue
+        digest = parse_variant_path(path)
+        metadata = load_metadata(digest, directory) if digest else None
+        described.append(metadata or {"hash": None, "src": path, "variants": {}, "srcset": ""})
+    return described
+
+
+def backfill(dry_run: bool = False, directory: str = PRODUCTS_DIR, db_engine=None) -> Dict:
+    """
+    Genera variantes para las imágenes de productos que todavía apuntan al archivo original.
+    Las variantes nuevas se registran en MediaObject y los contadores se recalculan al final,
+    igual que después de una importación (ver media.py).
+    """
+    from sqlmodel import Session, select
+    from models import Product
+    import media
+    if db_engine is None:
+        from database import engine as db_engine
+
+    summary = {"products": 0, "converted": 0, "missing": [], "failed": []}
+    generated = {}  # sha256 del original -> (ruta de la variante principal, bytes de las variantes)
+    with Session(db_engine) as session:
+        for product in session.exec(select(Product)).all():
+            new_images = []
+            changed = False
+            for path in product.images or []:
+                if not path or parse_variant_path(path):
+                    new_images.append(path)
+                    continue
+                source_path = os.path.join(directory, os.path.basename(path))
+                if not os.path.exists(source_path):
+                    summary["missing"].append(path)
+                    new_images.append(path)
+                    continue
+                summary["converted"] += 1
+                changed = True
+                if dry_run:
+                    new_images.append(path)
+                    continue
+                try:
+                    sha256 = file_sha256(source_path)
+                    metadata = process_image(source_path, directory, digest=sha256)
+                    new_images.append(metadata["src"])
+                    generated[sha256] = (metadata["src"], sum(v["bytes"] for v in metadata["variants"].values()))
+                except InvalidImage as e:
+                    summary["converted"] -= 1
+                    summary["failed"].append(f"{path}: {e}")
+                    new_images.append(path)
+
+            variants = describe_images(new_images, directory)
+            if changed or product.image_variants != variants:
+                summary["products"] += 1
+                if not dry_run:
+                    # Los archivos originales se conservan: puede haber clientes con la ruta vieja cacheada
+                    product.images = new_images
+                    product.image_variants = variants
+                    session.add(product)
+        if not dry_run:
+            session.commit()
+            for sha256, (path, size) in generated.items():
+                media.register(session, sha256, "image", path, size)
+            media.recount_references(session)
+            session.commit()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Generar variantes de las imágenes existentes")
+    backfill_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        summary = backfill(dry_run=args.dry_run)
+        print(
+            f"Imágenes convertidas: {summary['converted']} | Productos actualizados: {summary['products']}"
+            + (" (dry-run, sin cambios)" if args.dry_run else "")
+        )
+        for path in summary["missing"]:
+            print(f"  No existe el archivo: {path}")
+        for error in summary["failed"]:
+            print(f"  Error: {error}")
+        if summary["products"] and not args.dry_run:
+            # Que los workers en marcha descarten el catálogo cacheado
+            from cache import SharedVersion
+            SharedVersion("catalog").bump()
+        return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
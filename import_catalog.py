@@ -0,0 +1,200 @@
+# import_catalog.py
+"""
+Importa el catálogo de vinos desde una planilla Excel (.xlsx) o CSV a tienda.db.
+
+Uso:
+    python import_catalog.py data-vinos.xlsx
+    python import_catalog.py catalogo.csv --mode upsert --chunksize 5000
+    python import_catalog.py data-vinos.xlsx --dry-run
+
+El mapeo de columnas se resuelve una sola vez por archivo y la limpieza/casteo
+se hace por columna completa con pandas (sin iterrows).
+"""
+import os
+import sys
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlmodel import Session
+
+from database import engine, create_db_and_tables
+from product_import import ProductImporter, IMPORT_MODES
+import media
+
+DEFAULT_CHUNKSIZE = 2000
+DEFAULT_PACK_NAME = "Caja x6 Botellas"
+
+# Campo del modelo -> fragmento del encabezado en la planilla.
+# Se usan fragmentos porque la codificación de los acentos varía según quién exporte el archivo.
+COLUMN_PATTERNS = {
+    "marca": "Marca",
+    "composicion": "Composici",
+    "cosecha": "Cosecha",
+    "region": "Regi",
+    "elevacion": "Elevaci",
+    "presentacion": "Presentaci",
+    "alcohol": "Alcohol",
+    "acidez": "Acidez",
+    "ph": "pH",
+    "metodo_cosecha": "todo de cosecha",
+    "vinificacion": "Vinificaci",
+    "notas_de_cata": "Notas de cata",
+    "servicio_ideal": "Servicio ideal",
+    "stock": "Stock",
+    "peso_caja": "Peso",
+    "medidas_caja": "Medidas",
+    "price": "Precio",
+}
+TEXT_FIELDS = [f for f in COLUMN_PATTERNS if f not in ("stock", "price")]
+# En upsert la planilla solo pisa lo que trae: imágenes, descripciones, ficha y
+# nombre del pack cargados desde el admin se conservan
+UPDATE_COLUMNS = list(COLUMN_PATTERNS) + ["pack_stock", "pack_info.pack_price", "pack_info.pack_stock"]
+# Fila de la planilla = índice del DataFrame + 2 (encabezado y numeración desde 1)
+FIRST_DATA_ROW = 2
+
+
+def resolve_columns(columns: List[str]) -> Dict[str, str]:
+    """Mapea cada campo del modelo a su columna real. Falla si falta alguna."""
+    mapping, missing = {}, []
+    for field, pattern in COLUMN_PATTERNS.items():
+        match = next((c for c in columns if pattern in str(c)), None)
+        if match is None:
+            missing.append(pattern)
+        else:
+            mapping[field] = match
+    if missing:
+        raise ValueError(f"No se encontraron columnas para: {', '.join(missing)}")
+    return mapping
+
+
+def clean_text(series: pd.Series) -> pd.Series:
+    """Equivalente vectorizado del viejo clean_val: NaN -> "", 2023.0 -> "2023"."""
+    if pd.api.types.is_numeric_dtype(series):
+        numeric = series.astype("float64")
+        integral = numeric.notna() & (numeric % 1 == 0)
+        out = numeric.astype(str)
+        out = out.where(~integral, numeric.fillna(0).astype("int64").astype(str))
+        return out.where(numeric.notna(), "")
+    return series.astype(object).where(series.notna(), "").astype(str).str.strip()
+
+
+def clean_number(series: pd.Series, as_int: bool) -> pd.Series:
+    numeric = pd.to_numeric(series, errors="coerce").fillna(0)
+    return numeric.astype("int64") if as_int else numeric.astype("float64")
+
+
+def read_chunks(path: str, chunksize: int, sheet: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """Bloques de la planilla. El índice es la posición de la fila de datos (contando las vacías)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize)
+        return
+    if ext not in (".xlsx", ".xlsm"):
+        raise ValueError(f"Formato no soportado: {ext} (usar .xlsx o .csv)")
+
+    # openpyxl en modo read_only recorre la hoja en streaming: no carga todo el libro
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h) if h is not None else f"col_{i}" for i, h in enumerate(header)]
+        buffer, positions = [], []
+        for position, row in enumerate(rows):
+            if row is None or all(v is None for v in row):
+                continue
+            buffer.append(row)
+            positions.append(position)
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=header, index=positions)
+                buffer, positions = [], []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header, index=positions)
+    finally:
+        workbook.close()
+
+
+def transform_chunk(df: pd.DataFrame, mapping: Dict[str, str]) -> List[Tuple[int, dict]]:
+    """Convierte un bloque de la planilla en (fila de la planilla, datos de Product), operando por columna."""
+    out = pd.DataFrame(index=df.index)
+    for field in TEXT_FIELDS:
+        out[field] = clean_text(df[mapping[field]])
+    out["stock"] = clean_number(df[mapping["stock"]], as_int=True)
+    out["price"] = clean_number(df[mapping["price"]], as_int=False)
+
+    # Filas sin marca son renglones vacíos o notas al pie
+    out = out[out["marca"] != ""]
+    if out.empty:
+        return []
+
+    out["name"] = np.where(out["composicion"] != "", out["marca"] + " - " + out["composicion"], out["marca"])
+    out["category"] = out["marca"]
+    out["description"] = ""
+    out["long_description"] = ""
+    out["pack_stock"] = out["stock"]
+
+    row_numbers = (out.index + FIRST_DATA_ROW).tolist()
+    records = out.to_dict(orient="records")
+    for record in records:
+        record["images"] = []
+        record["additional_info"] = {}
+        record["pack_info"] = {
+            "pack_name": DEFAULT_PACK_NAME,
+            "pack_price": record["price"],
+            "pack_stock": record["stock"],
+        }
+    return list(zip(row_numbers, records))
+
+
+def import_catalog(path: str, mode: str = "insert", chunksize: int = DEFAULT_CHUNKSIZE,
+                   sheet: Optional[str] = None, dry_run: bool = False) -> dict:
+    create_db_and_tables()
+    mapping = None
+    with Session(engine) as session:
+        importer = ProductImporter(session, mode=mode, update_columns=UPDATE_COLUMNS)
+        for df in read_chunks(path, chunksize, sheet):
+            if mapping is None:
+                mapping = resolve_columns(list(df.columns))
+            importer.add_rows(transform_chunk(df, mapping))
+        # Los productos nuevos o actualizados pueden referenciar imágenes y fichas ya subidas
+        media.recount_references(session)
+        if dry_run:
+            session.rollback()
+        else:
+            session.commit()
+    summary = importer.summary()
+    summary["dry_run"] = dry_run
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Archivo .xlsx o .csv")
+    parser.add_argument("--mode", choices=IMPORT_MODES, default="insert")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--sheet", default=None, help="Hoja del Excel (por defecto la primera)")
+    parser.add_argument("--dry-run", action="store_true", help="Valida sin escribir en la base")
+    args = parser.parse_args(argv)
+
+    summary = import_catalog(args.path, args.mode, args.chunksize, args.sheet, args.dry_run)
+    print(
+        f"Insertados: {summary['inserted']} | Actualizados: {summary['updated']} | "
+        f"Omitidos: {summary['skipped']} | Con error: {len(summary['errors'])}"
+        + (" (dry-run, sin cambios)" if args.dry_run else "")
+    )
+    for error in summary["errors"][:50]:
+        print(f"  Fila {error['row']}: {error['error']}")
+    if summary["inserted"] or summary["updated"]:
+        # Otros workers en marcha se enteran del cambio por la versión compartida del catálogo
+        from cache import SharedVersion
+        SharedVersion("catalog").bump()
+    return 0 if not summary["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
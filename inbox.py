@@ -0,0 +1,191 @@
+# inbox.py
+import time
+import threading
+from typing import Callable, Optional
+from sqlalchemy import update, or_, and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from models import WebhookNotification
+
+
+def enqueue_notification(engine, payment_id: str):
+    """
+    Guarda la notificación en la bandeja. Si ya existía y terminó, se vuelve a
+    encolar: MP avisa otra vez cuando cambia el estado del pago (ej. pending -> approved).
+    Si se está procesando, se incrementa generation y _finish la deja pendiente de nuevo
+    (el worker pudo haber consultado el pago antes del cambio).
+    """
+    with Session(engine) as session:
+        try:
+            session.add(WebhookNotification(payment_id=payment_id, next_attempt_at=time.time()))
+            session.commit()
+            return
+        except IntegrityError:
+            session.rollback()
+
+        session.exec(
+            update(WebhookNotification)
+            .where(WebhookNotification.payment_id == payment_id)
+            .where(WebhookNotification.status.in_(["done", "failed"]))
+            .values(status="pending", attempts=0, next_attempt_at=time.time(), last_error=None)
+        )
+        session.exec(
+            update(WebhookNotification)
+            .where(WebhookNotification.payment_id == payment_id)
+            .where(WebhookNotification.status == "processing")
+            .values(generation=WebhookNotification.generation + 1)
+        )
+        session.commit()
+
+
+def pending_count(engine) -> int:
+    with Session(engine) as session:
+        return session.exec(
+            select(func.count()).select_from(WebhookNotification).where(WebhookNotification.status.in_(["pending", "processing"]))
+        ).one()
+
+
+class WebhookInboxWorker:
+    """
+    Hilo que procesa la bandeja de webhooks fuera del event loop.
+    Cada worker de gunicorn corre el suyo; las filas se reclaman con un UPDATE
+    condicional para que dos procesos nunca tomen la misma notificación.
+    """
+
+    def __init__(
+        self,
+        engine,
+        handler: Callable[[str], None],
+        poll_interval: float = 5.0,
+        max_attempts: int = 8,
+        lock_timeout: float = 120.0,
+        batch_size: int = 10,
+    ):
+        self.engine = engine
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lock_timeout = lock_timeout
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="webhook-inbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.process_due() and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                print(f"Error en bandeja de webhooks: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _due_ids(self):
+        now = time.time()
+        with Session(self.engine) as session:
+            query = (
+                select(WebhookNotification.payment_id)
+                .where(or_(
+                    and_(WebhookNotification.status == "pending", WebhookNotification.next_attempt_at <= now),
+                    # Reclamos abandonados (worker caído a mitad de proceso)
+                    and_(WebhookNotification.status == "processing", WebhookNotification.locked_until < now),
+                ))
+                .order_by(WebhookNotification.next_attempt_at)
+                .limit(self.batch_size)
+            )
+            return session.exec(query).all()
+
+    def _claim(self, payment_id: str) -> Optional[int]:
+        """Reclama la notificación. Devuelve su generation, o None si otro worker la tomó."""
+        now = time.time()
+        with Session(self.engine) as session:
+            result = session.exec(
+                update(WebhookNotification)
+                .where(WebhookNotification.payment_id == payment_id)
+                .where(or_(
+                    WebhookNotification.status == "pending",
+                    and_(WebhookNotification.status == "processing", WebhookNotification.locked_until < now),
+                ))
+                .values(
+                    status="processing",
+                    locked_until=now + self.lock_timeout,
+                    attempts=WebhookNotification.attempts + 1,
+                )
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                return None
+            generation = session.exec(
+                select(WebhookNotification.generation).where(WebhookNotification.payment_id == payment_id)
+            ).one()
+            session.commit()
+            return generation
+
+    def _finish(self, payment_id: str, generation: int, error: Optional[Exception] = None):
+        with Session(self.engine) as session:
+            # Llegó otro aviso durante el proceso: se encola de cero en vez de cerrarla.
+            # El UPDATE abre la transacción de escritura, así que un enqueue no puede
+            # colarse entre este chequeo y el commit.
+            requeued = session.exec(
+                update(WebhookNotification)
+                .where(WebhookNotification.payment_id == payment_id)
+                .where(WebhookNotification.generation != generation)
+                .values(status="pending", attempts=0, next_attempt_at=time.time(), last_error=None, locked_until=0.0)
+            )
+            if requeued.rowcount:
+                session.commit()
+                return
+            notification = session.get(WebhookNotification, payment_id)
+            if not notification:
+                return
+            if error is None:
+                notification.status = "done"
+                notification.last_error = None
+            elif notification.attempts >= self.max_attempts:
+                notification.status = "failed"
+                notification.last_error = str(error)
+                print(f"Webhook {payment_id} descartado tras {notification.attempts} intentos: {error}")
+            else:
+                # Backoff exponencial: 2s, 4s, 8s... con tope de una hora
+                notification.status = "pending"
+                notification.last_error = str(error)
+                notification.next_attempt_at = time.time() + min(2 ** notification.attempts, 3600)
+            notification.locked_until = 0.0
+            session.add(notification)
+            session.commit()
+
+    def process_due(self) -> int:
+        """Procesa las notificaciones vencidas. Devuelve cuántas se reclamaron."""
+        processed = 0
+        for payment_id in self._due_ids():
+            if self._stop.is_set():
+                continue
+            generation = self._claim(payment_id)
+            if generation is None:
+                continue
+            processed += 1
+            try:
+                self.handler(payment_id)
+                self._finish(payment_id, generation)
+            except Exception as e:
+                print(f"Error procesando webhook {payment_id}: {e}")
+                self._finish(payment_id, generation, e)
+        return processed
@@ -0,0 +1,210 @@
+# mailer.py
+import os
+import time
+import queue
+import smtplib
+import threading
+from concurrent.futures import Future
+from typing import Optional
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+# Errores tras los cuales vale la pena reconectar y reintentar el mensaje
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPHeloError, ConnectionError, OSError)
+
+
+def _is_connection_error(e: Exception) -> bool:
+    # SMTPException hereda de OSError: los rechazos del servidor (destinatario, remitente,
+    # datos) son del mensaje y no se reintentan. 421 es el servidor cerrando el canal.
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(e, smtplib.SMTPResponseException):
+        return isinstance(e, smtplib.SMTPHeloError) or e.smtp_code == 421
+    return isinstance(e, _CONNECTION_ERRORS)
+
+
+class SMTPDispatcher:
+    """
+    Despachador de correos con conexiones SMTP persistentes.
+    Los mensajes se encolan y un pequeño pool de hilos los envía en lotes,
+    reutilizando la conexión autenticada (STARTTLS + login una sola vez),
+    con NOOP como keepalive y reconexión automática.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_starttls: Optional[bool] = None,
+        pool_size: int = 1,
+        batch_size: int = 20,
+        keepalive_interval: float = 60.0,
+        max_idle: float = 300.0,
+        timeout: float = 30.0,
+    ):
+        self.host = host or os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.port = port or int(os.getenv("SMTP_PORT", "587"))
+        self.username = username if username is not None else os.getenv("MAIL_USERNAME")
+        self.password = password if password is not None else os.getenv("MAIL_PASSWORD")
+        if use_starttls is None:
+            use_starttls = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+        self.use_starttls = use_starttls
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self.timeout = timeout
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    # --- API pública ---
+    def submit(self, msg) -> Future:
+        """Encola un mensaje y devuelve un Future que se resuelve al enviarse."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((msg, future))
+        return future
+
+    def send(self, msg, timeout: Optional[float] = None):
+        """Envía un mensaje y espera el resultado (lanza la excepción si falla)."""
+        return self.submit(msg).result(timeout or self.timeout * 3)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self, timeout: float = 10.0):
+        with self._lock:
+            self._stopping = True
+            threads = list(self._threads)
+            self._threads = []
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join(timeout)
+        with self._lock:
+            self._stopping = False
+
+    # --- Internos ---
+    def _ensure_started(self):
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("El despachador de correos se está deteniendo")
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.pool_size:
+                t = threading.Thread(target=self._worker, name=f"smtp-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    @staticmethod
+    def _close(server: Optional[smtplib.SMTP]):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _send_one(self, server: Optional[smtplib.SMTP], msg, future: Future) -> Optional[smtplib.SMTP]:
+        """Envía un mensaje reconectando una vez si la conexión se cayó. Devuelve la conexión vigente."""
+        if not future.set_running_or_notify_cancel():
+            return server
+        for attempt in range(2):
+            try:
+                if server is None:
+                    with metrics.timer("external_call_duration_seconds", service="smtp", operation="connect"):
+                        server = self._connect()
+                with metrics.timer("external_call_duration_seconds", service="smtp", operation="send_message"):
+                    result = server.send_message(msg)
+                future.set_result(result)
+                return server
+            except Exception as e:
+                if not _is_connection_error(e):
+                    # Error del mensaje (destinatario rechazado, etc.): la conexión sigue sirviendo
+                    future.set_exception(e)
+                    return server
+                self._close(server)
+                server = None
+                if attempt == 1:
+                    future.set_exception(e)
+        return server
+
+    def _worker(self):
+        server = None
+        last_used = time.monotonic()
+        while True:
+            try:
+                job = self._queue.get(timeout=self.keepalive_interval)
+            except queue.Empty:
+                # Conexión ociosa: keepalive con NOOP o cierre si pasó demasiado tiempo
+                if server is not None:
+                    if time.monotonic() - last_used > self.max_idle or not self._is_alive(server):
+                        self._close(server)
+                        server = None
+                continue
+
+            if job is None:
+                break
+
+            # Tomamos un lote de lo que ya esté encolado para enviarlo por la misma conexión
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    extra = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is None:
+                    self._queue.put(None)
+                    break
+                batch.append(extra)
+
+            for msg, future in batch:
+                server = self._send_one(server, msg, future)
+            last_used = time.monotonic()
+
+        self._close(server)
+
+
+_dispatcher: Optional[SMTPDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> SMTPDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = SMTPDispatcher(pool_size=int(os.getenv("SMTP_POOL_SIZE", "1")))
+        return _dispatcher
+
+
+def set_dispatcher(dispatcher: Optional[SMTPDispatcher]):
+    """Permite reemplazar el despachador (por ejemplo en tests, apuntando a un SMTP local)."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher is not dispatcher:
+            _dispatcher.stop()
+        _dispatcher = dispatcher
@@ -1,64 +1,94 @@
 import os
 import json
-import shutil
-import uuid
 import secrets
 import hashlib
+import base64
 import hmac as hmac_module
-import threading
-import time
 import sqlite3
 import tempfile
+import mimetypes
 import mercadopago
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, Request, HTTPException, UploadFile, File, Form, Header, BackgroundTasks
+from contextlib import asynccontextmanager, closing
+from fastapi import FastAPI, Depends, Request, HTTPException, UploadFile, File, Form, Header
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, RedirectResponse
 from sqlmodel import Session, select, SQLModel
-from sqlalchemy import func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import update, tuple_
 import csv
 import io
-from typing import List, Dict, Any
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 
 from models import Product, Cart, CartItem, ContactForm, ProcessedPayment, PurchaseRecord
-from database import engine, engine_compras, create_db_and_tables
-from notifications import send_emails, send_transfer_email, send_contact_email
+from database import (
+    engine, engine_compras, async_engine, async_engine_compras,
+    create_db_and_tables, dispose_engines, dispose_async_engines,
+    TIENDA_DB_PATH, COMPRAS_DB_PATH,
+)
+from notifications import send_emails, send_transfer_email, send_contact_email, deliver_email, deliver_whatsapp_alert
+from outbox import OutboxWorker
+import outbox
+from mailer import get_dispatcher
+from cache import CatalogCache, CatalogPayload
+from settings_store import SettingsStore
+from stock import (
+    decrement_packs, decrement_units, sync_pack_stock, apply_pack_stock_edit, InsufficientStock,
+    place_holds, release_holds, convert_holds, new_hold_reference, HoldSweeper,
+)
+from product_import import ProductImporter, IMPORT_MODES, IMPORT_BATCH_SIZE
+from inbox import WebhookInboxWorker, enqueue_notification
+import inbox
+from metrics import metrics, MetricsMiddleware, collect as collect_metrics
+import profiler
+from images import process_image, describe_images, InvalidImage
+from static_assets import (
+    AssetManifest, ASSETS_URL, IMMUTABLE_CACHE_CONTROL, hashed_name, parse_asset_path,
+    logical_url, rewrite_product_urls, asset_etag, etag_matches,
+)
+import media
+from uploads import (
+    stream_to_disk, UploadRejected, UploadSizeLimitMiddleware,
+    IMAGE_TYPES, PDF_TYPES, RECEIPT_TYPES, DATABASE_TYPES,
+    MAX_IMAGE_BYTES, MAX_FICHA_BYTES, MAX_RECEIPT_BYTES, MAX_DATABASE_BYTES,
+)
 
 load_dotenv()
 
 # --- CACHE ---
-products_cache = {
-    "data": None,
-    "timestamp": 0
-}
-CACHE_TTL = 300  # 5 minutos
+# La versión del catálogo se comparte entre workers (ver cache.py), por lo que
+# el TTL solo actúa como red de seguridad y puede ser largo.
+CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "3600"))  # 1 hora
+products_cache = CatalogCache("catalog", ttl=CACHE_TTL)
 
 def invalidate_products_cache():
-    global products_cache
-    products_cache["data"] = None
-    products_cache["timestamp"] = 0
+    products_cache.invalidate()
 
 @asynccontextmanager
 async def lifespan(app_instance: FastAPI):
-    try:
-        # Parche de migración: agregar columna si no existe
-        with sqlite3.connect("tienda.db") as conn:
-            try:
-                conn.execute("ALTER TABLE product ADD COLUMN distincion VARCHAR;")
-            except Exception:
-                pass
-            try:
-                conn.execute("ALTER TABLE product ADD COLUMN ficha_tecnica VARCHAR;")
-            except Exception:
-                pass
-            conn.commit()
-    except Exception:
-        pass
-        
+    # Esquema versionado: solo aplica las migraciones pendientes (ver migrations.py)
     create_db_and_tables()
+    webhook_inbox.start()
+    notification_outbox.start()
+    hold_sweeper.start()
+    metrics.start()
+    if profiler.ENABLED:
+        profiler.profiler.start()
     yield
+    hold_sweeper.stop()
+    metrics.stop()
+    if profiler.ENABLED:
+        profiler.profiler.stop()
+    webhook_inbox.stop()
+    notification_outbox.stop()
+    dispose_engines()
+    await dispose_async_engines()
+    get_dispatcher().stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -67,6 +97,48 @@ os.makedirs("static/products", exist_ok=True)
 os.makedirs("static/fichas", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# URLs con hash de contenido para los mismos archivos (ver static_assets.py)
+asset_manifest = AssetManifest("static")
+
+def public_product(record: dict) -> dict:
+    """Producto serializado para el frontend, con las rutas de archivos ya versionadas."""
+    return rewrite_product_urls(record, asset_manifest.url)
+
+@app.api_route("/assets/{asset_path:path}", methods=["GET", "HEAD"])
+def serve_asset(asset_path: str, request: Request):
+    parsed = parse_asset_path(asset_path)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    logical_path, requested_digest = parsed
+    digest = asset_manifest.digest(logical_path)
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    if digest != requested_digest:
+        # El archivo cambió desde que se entregó la URL: redirigir a la versión vigente sin cachear la redirección
+        return RedirectResponse(
+            f"{ASSETS_URL}/{hashed_name(logical_path, digest)}",
+            status_code=307,
+            headers={"Cache-Control": "no-store"},
+        )
+
+    full_path = asset_manifest.path_for(logical_path)
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    # Primero se elige la representación: el If-None-Match se compara con el ETag de esa misma
+    file_path, encoding = asset_manifest.representation(
+        full_path, digest, request.headers.get("accept-encoding", ""), ranged="range" in request.headers
+    )
+    etag = asset_etag(digest, encoding)
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(file_path, media_type=media_type, headers=headers)
+
+# Comprobantes de transferencia: privados, nunca se sirven como estáticos
+RECEIPTS_DIR = os.path.join("private", "comprobantes")
+os.makedirs(RECEIPTS_DIR, exist_ok=True)
+
 mp_access_token = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
 if not mp_access_token:
     raise ValueError("La variable de entorno MERCADOPAGO_ACCESS_TOKEN no está definida.")
@@ -82,52 +154,171 @@ origins = [
     "https://bodegavalledelcondor.com"
 ]
 
+# Tope por endpoint según Content-Length, antes de que se lea el cuerpo (ver uploads.py)
+MAX_IMAGES_PER_UPLOAD = 10
+app.add_middleware(UploadSizeLimitMiddleware, limits={
+    "/api/admin/upload-images": MAX_IMAGE_BYTES * MAX_IMAGES_PER_UPLOAD,
+    "/api/admin/upload-ficha": MAX_FICHA_BYTES,
+    "/api/admin/upload-tienda-db": MAX_DATABASE_BYTES,
+    "/api/create_transfer_order": MAX_RECEIPT_BYTES,
+})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Va al final para quedar por fuera de todos los demás middlewares y medir el request completo
+app.add_middleware(MetricsMiddleware, router=app.router)
+
 def get_session():
     with Session(engine) as session:
         yield session
 
+async def get_async_session():
+    # Para endpoints `async def` de solo lectura: no ocupan un lugar del threadpool
+    async with AsyncSession(async_engine) as session:
+        yield session
+
 # Startup se maneja con lifespan (ver arriba)
 
-@app.get("/api/products", response_model=List[Product])
-def get_products(
-    include_inactive: bool = False,
-    session: Session = Depends(get_session),
-    x_admin_token: str = Header(None)
-):
-    # --- BLOQUEO DE TIENDA ---
+def ensure_store_open(x_admin_token: Optional[str]):
     # Si la tienda está pausada y NO es una request del admin, devolvemos error
-    if not include_inactive and get_store_settings().get("isStorePaused", False):
+    if get_store_settings().get("isStorePaused", False):
         admin_pass = os.getenv("ADMIN_PASSWORD")
         is_admin = admin_pass and x_admin_token and secrets.compare_digest(x_admin_token, admin_pass)
         if not is_admin:
             raise HTTPException(status_code=503, detail="La tienda se encuentra temporalmente pausada.")
 
-    global products_cache
-    current_time = time.time()
-    
-    # Retornar desde caché si es válido y no pedimos inactivos
-    if not include_inactive and products_cache["data"] is not None and (current_time - products_cache["timestamp"]) < CACHE_TTL:
-        return products_cache["data"]
+CATALOG_CACHE_CONTROL = "public, max-age=0, must-revalidate"
 
-    query = select(Product)
-    if not include_inactive:
-        query = query.where(Product.is_active == True)
-    products = session.exec(query).all()
-    
-    # Actualizar caché
+def catalog_response(payload: CatalogPayload, request: Request) -> Response:
+    """Sirve el catálogo pre-serializado, respondiendo 304 si el cliente ya lo tiene."""
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    headers = {
+        "ETag": payload.gzip_etag if use_gzip else payload.etag,
+        "Cache-Control": CATALOG_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=payload.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
+
+def build_catalog_payload(products: List[Product]) -> CatalogPayload:
+    # Serializar, comprimir y resolver los hashes de /assets es CPU y disco: va al threadpool
+    return CatalogPayload([public_product(p.model_dump(mode="json")) for p in products])
+
+@app.get("/api/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    include_inactive: bool = False,
+    session: AsyncSession = Depends(get_async_session),
+    x_admin_token: str = Header(None)
+):
+    # --- BLOQUEO DE TIENDA ---
     if not include_inactive:
-        products_cache["data"] = products
-        products_cache["timestamp"] = current_time
-        
-    return products
+        ensure_store_open(x_admin_token)
+
+    # El listado completo del admin (con inactivos) no se cachea
+    if include_inactive:
+        return (await session.exec(select(Product))).all()
+
+    # Retornar desde caché si es válido: JSON ya serializado y comprimido.
+    # Con caché vigente el request se resuelve en el event loop, sin tocar el threadpool.
+    payload = products_cache.get()
+    if payload is None:
+        cache_version = products_cache.version.get()
+        products = (await session.exec(select(Product).where(Product.is_active == True))).all()
+        payload = await run_in_threadpool(build_catalog_payload, products)
+        products_cache.set(payload, cache_version)
+
+    return catalog_response(payload, request)
+
+# --- LISTADO LIVIANO DEL CATÁLOGO ---
+# Proyección por defecto para la grilla: sin fichas técnicas ni notas de cata
+LISTING_DEFAULT_FIELDS = ["id", "name", "marca", "price", "pack_info", "image"]
+LISTING_MAX_LIMIT = 100
+
+def parse_listing_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return LISTING_DEFAULT_FIELDS
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    valid = set(Product.model_fields) | {"image"}
+    invalid = [f for f in requested if f not in valid]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalid)}")
+    # El id siempre viaja: es el cursor de paginación
+    return ["id"] + [f for f in requested if f != "id"]
+
+@app.get("/api/products/listing")
+def list_products(
+    fields: Optional[str] = None,
+    category: Optional[str] = None,
+    marca: Optional[str] = None,
+    region: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 24,
+    session: Session = Depends(get_session),
+    x_admin_token: str = Header(None)
+):
+    ensure_store_open(x_admin_token)
+
+    selected = parse_listing_fields(fields)
+    limit = max(1, min(limit, LISTING_MAX_LIMIT))
+
+    # "image" es la primera imagen: se lee la columna images y se recorta en Python
+    column_names = [f for f in selected if f != "image"]
+    if "image" in selected and "images" not in column_names:
+        column_names.append("images")
+    columns = [getattr(Product, name) for name in column_names]
+
+    # Filtros y paginación por cursor (id ascendente) resueltos en SQL
+    query = select(*columns).where(Product.is_active == True)
+    if category:
+        query = query.where(Product.category == category)
+    if marca:
+        query = query.where(Product.marca == marca)
+    if region:
+        query = query.where(Product.region == region)
+    if cursor is not None:
+        query = query.where(Product.id > cursor)
+    query = query.order_by(Product.id).limit(limit + 1)
+
+    rows = session.exec(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        record = dict(zip(column_names, row))
+        if "image" in selected:
+            images = record.get("images") or []
+            record["image"] = images[0] if images else None
+            if "images" not in selected:
+                record.pop("images", None)
+        items.append(public_product(record))
+
+    next_cursor = items[-1]["id"] if has_more and items else None
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/api/products/{product_id}", response_model=Product)
+def get_product_detail(
+    product_id: int,
+    session: Session = Depends(get_session),
+    x_admin_token: str = Header(None)
+):
+    ensure_store_open(x_admin_token)
+    product = session.get(Product, product_id)
+    if not product or not product.is_active:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return public_product(product.model_dump(mode="json"))
 
 def calculate_shipping_cost(cp_str: str) -> float:
     if not cp_str: return 0.0
@@ -151,6 +342,7 @@ def calculate_shipping(data: ShippingRequest):
     return {"cost": cost, "message": "Costo de envío a domicilio"}
 
 # --- LÓGICA CENTRAL DE NEGOCIO ---
+@metrics.timed()
 def calculate_cart_totals(cart_items: List[CartItem], zip_code: str, session: Session) -> Dict[str, Any]:
     total_packs = 0
     subtotal = 0.0
@@ -161,8 +353,14 @@ def calculate_cart_totals(cart_items: List[CartItem], zip_code: str, session: Se
         if item.quantity <= 0: continue
         aggregated_items[item.id] = aggregated_items.get(item.id, 0) + item.quantity
     
+    # Una sola consulta IN (...) para todos los productos del carrito
+    products_by_id = {}
+    if aggregated_items:
+        products = session.exec(select(Product).where(Product.id.in_(list(aggregated_items)))).all()
+        products_by_id = {p.id: p for p in products}
+
     for prod_id, qty in aggregated_items.items():
-        product = session.get(Product, prod_id)
+        product = products_by_id.get(prod_id)
         if not product or not product.pack_info:
             raise HTTPException(status_code=400, detail=f"Producto {prod_id} no válido.")
         if not product.is_active:
@@ -171,9 +369,9 @@ def calculate_cart_totals(cart_items: List[CartItem], zip_code: str, session: Se
         total_packs += qty
         pack_price = product.pack_info.get("pack_price", 0.0)
         pack_name = product.pack_info.get("pack_name", product.name)
-        pack_stock = product.pack_info.get("pack_stock", 0)
         
-        if pack_stock < qty:
+        # Disponible = stock físico menos lo retenido por reservas vigentes de otros checkouts
+        if product.pack_stock - product.pack_reserved < qty:
             raise HTTPException(status_code=400, detail=f"Stock insuficiente para {pack_name}.")
             
         validated_items.append({
@@ -205,6 +403,30 @@ def calculate_cart_totals(cart_items: List[CartItem], zip_code: str, session: Se
         "shipping_cost": shipping_cost
     }
 
+# --- RESERVAS DE STOCK EN CHECKOUT ---
+# Mercado Pago: la preferencia vence junto con la reserva
+HOLD_TTL_MP = int(os.getenv("HOLD_TTL_MP_SECONDS", str(30 * 60)))
+# Transferencias: la reserva debe cubrir el tiempo de revisión del admin
+HOLD_TTL_TRANSFER = int(os.getenv("HOLD_TTL_TRANSFER_SECONDS", str(72 * 3600)))
+
+def hold_cart(session: Session, totals: Dict[str, Any], reference: str, ttl: int):
+    quantities = {v_item["product_id"]: v_item["qty"] for v_item in totals["items"]}
+    try:
+        place_holds(session, reference, quantities, ttl)
+        session.commit()
+    except InsufficientStock as e:
+        session.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+def release_cart_hold(reference: Optional[str]):
+    if not reference:
+        return
+    with Session(engine) as session:
+        release_holds(session, reference)
+        session.commit()
+
+hold_sweeper = HoldSweeper(engine, interval=float(os.getenv("HOLD_SWEEP_INTERVAL", "30")))
+
 # --- ENDPOINT MERCADO PAGO ---
 @app.post("/api/create_preference")
 def create_preference(cart: Cart, session: Session = Depends(get_session)):
@@ -248,7 +470,15 @@ def create_preference(cart: Cart, session: Session = Depends(get_session)):
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173").rstrip("/")
     api_public_url = os.getenv("API_PUBLIC_URL", "http://127.0.0.1:8000").rstrip("/")
 
+    # Reservar el stock mientras el cliente paga
+    hold_reference = new_hold_reference()
+    hold_cart(session, totals, hold_reference, HOLD_TTL_MP)
+    hold_expiration = datetime.now(timezone.utc) + timedelta(seconds=HOLD_TTL_MP)
+
     preference_data = {
+        "external_reference": hold_reference,
+        "expires": True,
+        "expiration_date_to": hold_expiration.isoformat(timespec="milliseconds"),
         "items": preference_items,
         "shipments": {"cost": totals["shipping_cost"], "mode": "not_specified"},
         "payer": payer_info,
@@ -266,11 +496,14 @@ def create_preference(cart: Cart, session: Session = Depends(get_session)):
         preference_data["notification_url"] = f"{api_public_url}/api/webhook"
 
     try:
-        preference_response = sdk.preference().create(preference_data)
+        with metrics.timer("external_call_duration_seconds", service="mercadopago", operation="preference.create"):
+            preference_response = sdk.preference().create(preference_data)
         if preference_response and "response" in preference_response and "id" in preference_response["response"]:
             return {"preference_id": preference_response["response"]["id"]}
         raise HTTPException(status_code=500, detail=f"Error MP: {preference_response}")
     except Exception as e:
+        # Sin preferencia no habrá pago: devolvemos el stock reservado
+        release_cart_hold(hold_reference)
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Verificación de Firma del Webhook ---
@@ -306,9 +539,99 @@ def verify_webhook_signature(request: Request, data_id: str) -> bool:
 
     return hmac_module.compare_digest(v1, expected)
 
+# --- PROCESAMIENTO DE PAGOS (fuera del event loop) ---
+def process_payment_notification(payment_id: str):
+    """
+    Procesa una notificación de la bandeja. Se ejecuta en el hilo del
+    WebhookInboxWorker y es idempotente: si falla a mitad de camino, el
+    reintento retoma sin descontar stock ni registrar la compra dos veces.
+    """
+    # 1. Idempotencia: si ya se procesó, no consultamos a MP de nuevo
+    with Session(engine) as session:
+        if session.get(ProcessedPayment, payment_id):
+            with Session(engine_compras) as compras_session:
+                recorded = compras_session.exec(
+                    select(PurchaseRecord.id).where(PurchaseRecord.payment_id == payment_id)
+                ).first()
+            if recorded:
+                return
+
+    # 2. Obtener info del pago desde MP (HTTP bloqueante: por eso corre en un hilo)
+    with metrics.timer("external_call_duration_seconds", service="mercadopago", operation="payment.get"):
+        payment_info = sdk.payment().get(payment_id)
+    if payment_info.get("status") != 200:
+        raise RuntimeError(f"Respuesta inesperada de MP ({payment_info.get('status')}): {payment_info.get('response')}")
+    payment = payment_info.get("response", {})
+    status = payment.get("status")
+
+    # Un pago rechazado o cancelado no libera la reserva: el comprador puede reintentar
+    # con otro medio sobre la misma preferencia. Queda hasta convertirse o vencer (HoldSweeper).
+    if status != "approved":
+        return
+
+    metadata = payment.get("metadata", {})
+    additional_info = payment.get("additional_info") or {}
+    items = additional_info.get("items", [])
+    total_paid = payment.get("transaction_amount", 0)
+
+    # 3. Marcar como procesado y descontar stock en la misma transacción
+    with Session(engine) as session:
+        if not session.get(ProcessedPayment, payment_id):
+            pack_quantities, unit_quantities = {}, {}
+            for item in items:
+                item_id_str = item.get("id", "")
+                quantity = int(item.get("quantity", 0))
+
+                if "|" in item_id_str:
+                    tipo, prod_id = item_id_str.split("|")
+                    target = pack_quantities if tipo == "PACK" else unit_quantities
+                    target[int(prod_id)] = target.get(int(prod_id), 0) + quantity
+
+            # La reserva del checkout se convierte en venta; si venció, descuento
+            # atómico de todo el carrito en un solo UPDATE condicional
+            try:
+                if not convert_holds(session, payment.get("external_reference"), pack_quantities):
+                    decrement_packs(session, pack_quantities, strict=True)
+            except InsufficientStock:
+                # El pago ya está cobrado: descontamos lo que haya y avisamos
+                print(f"ATENCIÓN: pago {payment_id} aprobado sin stock suficiente. Se descuenta hasta cero.")
+                decrement_packs(session, pack_quantities, strict=False)
+            decrement_units(session, unit_quantities)
+            session.add(ProcessedPayment(payment_id=payment_id, status=status))
+            session.commit()
+            invalidate_products_cache()
+
+    # 4. Registrar compra en compras.db (una sola vez por payment_id)
+    with Session(engine_compras) as compras_session:
+        recorded = compras_session.exec(
+            select(PurchaseRecord.id).where(PurchaseRecord.payment_id == payment_id)
+        ).first()
+        if recorded:
+            return
+        purchase = PurchaseRecord(
+            payment_id=payment_id,
+            payment_method="mp",
+            status=status,
+            total_paid=float(total_paid),
+            items=json.dumps(items),
+            user_data=json.dumps(metadata)
+        )
+        compras_session.add(purchase)
+        compras_session.commit()
+
+    metadata["payment_method"] = "MercadoPago"
+    send_emails(metadata, items, total_paid)
+
+webhook_inbox = WebhookInboxWorker(engine, process_payment_notification)
+
+notification_outbox = OutboxWorker(
+    {"email": deliver_email, "whatsapp": deliver_whatsapp_alert},
+    concurrency=int(os.getenv("OUTBOX_CONCURRENCY", "4")),
+)
+
 # --- WEBHOOK MERCADO PAGO ---
 @app.post("/api/webhook")
-async def webhook_mercado_pago(request: Request, background_tasks: BackgroundTasks):
+async def webhook_mercado_pago(request: Request):
     try:
         # 1. Leer datos del webhook (soporta body JSON v2 y query params legacy)
         payment_id = None
@@ -344,77 +667,22 @@ async def webhook_mercado_pago(request: Request, background_tasks: BackgroundTas
             print(f"Webhook con firma inválida rechazado. Payment ID: {payment_id}")
             raise HTTPException(status_code=401, detail="Firma inválida")
 
-        # 3. Idempotencia: verificar si ya se procesó
-        with Session(engine) as session:
-            existing_payment = session.get(ProcessedPayment, payment_id)
-            if existing_payment:
-                return {"status": "ok"}
-
-        # 4. Obtener info del pago desde MP
-        payment_info = sdk.payment().get(payment_id)
-        payment = payment_info.get("response", {})
-        status = payment.get("status")
-
-        if status == "approved":
-            with Session(engine) as session:
-                new_payment = ProcessedPayment(payment_id=payment_id, status=status)
-                session.add(new_payment)
-                session.commit()
-
-            metadata = payment.get("metadata", {})
-            additional_info = payment.get("additional_info") or {}
-            items = additional_info.get("items", [])
-            total_paid = payment.get("transaction_amount", 0)
-
-            # Descuento de Stock
-            with Session(engine) as session:
-                for item in items:
-                    item_id_str = item.get("id", "")
-                    quantity = int(item.get("quantity", 0))
-
-                    if "|" in item_id_str:
-                        tipo, prod_id = item_id_str.split("|")
-                        product = session.get(Product, int(prod_id))
-                        if product:
-                            if tipo == "PACK" and product.pack_info:
-                                current_pack = dict(product.pack_info)
-                                p_stock = current_pack.get("pack_stock", 0)
-                                current_pack["pack_stock"] = max(0, p_stock - quantity)
-                                product.pack_info = current_pack
-                            # Descuento atómico usando la columna a nivel base de datos
-                            product.stock = func.max(0, Product.stock - quantity)
-                            session.add(product)
-                session.commit()
-                invalidate_products_cache()
-
-            # Registrar compra en compras.db
-            with Session(engine_compras) as compras_session:
-                purchase = PurchaseRecord(
-                    payment_id=payment_id,
-                    payment_method="mp",
-                    status=status,
-                    total_paid=float(total_paid),
-                    items=json.dumps(items),
-                    user_data=json.dumps(metadata)
-                )
-                compras_session.add(purchase)
-                compras_session.commit()
-
-            metadata["payment_method"] = "MercadoPago"
-            # Enviar emails en background para no bloquear la respuesta al webhook
-            background_tasks.add_task(send_emails, metadata, items, total_paid)
+        # 3. Guardar en la bandeja durable y responder de inmediato.
+        # El acceso a SQLite es bloqueante: va al threadpool, no al event loop.
+        await run_in_threadpool(enqueue_notification, engine, payment_id)
+        webhook_inbox.wake()
 
         return {"status": "ok"}
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error en webhook: {e}")
-        return {"status": "error", "detail": str(e)}
+        # Sin guardar en la bandeja no podemos confirmar: MP reintentará
+        raise HTTPException(status_code=500, detail="No se pudo registrar la notificación")
 
 # --- ORDEN DE TRANSFERENCIA ---
 @app.post("/api/create_transfer_order")
 def create_transfer_order(
-    background_tasks: BackgroundTasks,
     cart_data: str = Form(...),    
     file: UploadFile = File(...), 
     session: Session = Depends(get_session)
@@ -422,7 +690,14 @@ def create_transfer_order(
     if get_store_settings().get("isStorePaused", False):
         raise HTTPException(status_code=400, detail="La tienda se encuentra temporalmente pausada.")
 
+    receipt = None
     try:
+        # El comprobante se valida y se copia a disco primero, antes de reservar stock
+        try:
+            receipt = stream_to_disk(file.file, file.filename, MAX_RECEIPT_BYTES, RECEIPT_TYPES, directory=RECEIPTS_DIR)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Comprobante inválido: {e.detail}")
+
         data = json.loads(cart_data)
         items_data = data.get("items", [])
         user_data = data.get("user_data", {})
@@ -455,52 +730,63 @@ def create_transfer_order(
         for v_item in totals["items"]:
             mail_items.append({'quantity': v_item["qty"], 'title': f"{v_item['name']} (Pack)"})
 
-        # Validar tamaño del archivo al leer por fragmentos (max 5MB)
-        MAX_FILE_SIZE = 5 * 1024 * 1024
-        file_content_arr = bytearray()
-        
-        while chunk := file.file.read(1024 * 1024):  # Leer de a 1MB
-            file_content_arr.extend(chunk)
-            if len(file_content_arr) > MAX_FILE_SIZE:
-                raise HTTPException(status_code=400, detail="El comprobante es demasiado grande. El límite es 5MB.")
-        file_content = bytes(file_content_arr)
+        # Reservar el stock hasta que el admin revise el comprobante
+        hold_reference = new_hold_reference("TRHOLD")
+        hold_cart(session, totals, hold_reference, HOLD_TTL_TRANSFER)
 
         # ASENTAR EN LA BASE DE DATOS DE COMPRAS (compras.db)
-        with Session(engine_compras) as compras_session:
-            purchase = PurchaseRecord(
-                payment_id=None,
-                payment_method="transferencia",
-                status="pending_review",
-                total_paid=round(total_a_pagar, 2),
-                items=json.dumps(totals["items"]),  # Guardar los items completos con product_id para luego descontar stock
-                user_data=json.dumps(user_data)
-            )
-            compras_session.add(purchase)
-            compras_session.commit()
-            compras_session.refresh(purchase)
-            transfer_id = f"TR-{purchase.id}"
-            
-            purchase.payment_id = transfer_id
-            compras_session.add(purchase)
-            compras_session.commit()
+        try:
+            with Session(engine_compras) as compras_session:
+                purchase = PurchaseRecord(
+                    hold_reference=hold_reference,
+                    payment_id=None,
+                    payment_method="transferencia",
+                    status="pending_review",
+                    total_paid=round(total_a_pagar, 2),
+                    items=json.dumps(totals["items"]),  # Guardar los items completos con product_id para luego descontar stock
+                    user_data=json.dumps(user_data)
+                )
+                compras_session.add(purchase)
+                compras_session.commit()
+                compras_session.refresh(purchase)
+                transfer_id = f"TR-{purchase.id}"
+
+                purchase.payment_id = transfer_id
+                compras_session.add(purchase)
+                compras_session.commit()
+        except Exception:
+            # Sin compra que aprobar o rechazar, la reserva retendría stock hasta vencer
+            release_cart_hold(hold_reference)
+            raise
+
+        # El comprobante queda en disco (fuera de /static) para adjuntarlo desde el outbox
+        receipt_name = receipt.filename
+        receipt_path = os.path.join(RECEIPTS_DIR, f"{transfer_id}_{receipt_name}")
+        receipt.move_to(receipt_path)
 
         user_data["payment_method"] = "Transferencia Bancaria"
-        background_tasks.add_task(
-            send_transfer_email,
-            user_data, mail_items, round(total_a_pagar, 2), TRANSFER_DISCOUNT_PCT, file_content, file.filename
+        send_transfer_email(
+            user_data, mail_items, round(total_a_pagar, 2), TRANSFER_DISCOUNT_PCT, receipt_path, receipt_name
         )
 
         return {"status": "ok", "message": "Orden recibida", "transfer_id": transfer_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Si la orden falló antes de mover el comprobante, el temporal no debe quedar huérfano
+        if receipt is not None and not receipt.moved:
+            receipt.discard()
     
 @app.post("/api/contact")
-def submit_contact_form(form: ContactForm, background_tasks: BackgroundTasks):
-    background_tasks.add_task(send_contact_email, form)
+def submit_contact_form(form: ContactForm):
+    send_contact_email(form)
     return {"status": "ok", "message": "Mensaje enviado"}
 
 # --- SEGURIDAD: VERIFICAR TOKEN DE ADMIN ---
-def verify_admin(x_admin_token: str = Header(None)):
+async def verify_admin(x_admin_token: str = Header(None)):
+    # async: es solo una comparación, así no ocupa el threadpool en cada endpoint de admin
     admin_pass = os.getenv("ADMIN_PASSWORD")
     if not admin_pass or not x_admin_token:
         raise HTTPException(status_code=401, detail="Acceso no autorizado")
@@ -513,31 +799,92 @@ def verify_admin(x_admin_token: str = Header(None)):
 
 # Subir una o varias imágenes reales al servidor
 @app.post("/api/admin/upload-images")
-def upload_images(files: List[UploadFile] = File(...), authorized: bool = Depends(verify_admin)):
+def upload_images(files: List[UploadFile] = File(...), authorized: bool = Depends(verify_admin), session: Session = Depends(get_session)):
     saved_paths = []
-    upload_dir = "static/products"
-    
+    processed = []
+
+    if len(files) > MAX_IMAGES_PER_UPLOAD:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_IMAGES_PER_UPLOAD} imágenes por subida")
+
     for file in files:
-        # Generamos una ruta segura usando el nombre del archivo original
-        safe_filename = f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}"
-        file_path = os.path.join(upload_dir, safe_filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        # Retornamos la ruta relativa que se concatenará con la url estática del servidor
-        saved_paths.append(f"/static/products/{safe_filename}")
-        
-    return {"paths": saved_paths}
+        # Cada imagen se convierte a variantes WebP con nombre por hash de contenido (ver images.py).
+        # Si el hash ya existe, process_image reutiliza las variantes sin decodificar la imagen.
+        try:
+            upload = stream_to_disk(file.file, file.filename, MAX_IMAGE_BYTES, IMAGE_TYPES)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=f"{file.filename}: {e.detail}")
+        try:
+            metadata = process_image(upload.path, digest=upload.sha256)
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+        finally:
+            upload.discard()
+        media.register(session, upload.sha256, "image", metadata["src"], sum(v["bytes"] for v in metadata["variants"].values()))
+        # "paths" mantiene el formato de siempre: la ruta que se guarda en Product.images
+        saved_paths.append(metadata["src"])
+        processed.append(metadata)
+
+    return {"paths": saved_paths, "images": processed}
 
 
 # --- ADMIN: COMPRAS ---
 
-@app.get("/api/admin/purchases")
-def get_purchases(authorized: bool = Depends(verify_admin)):
-    with Session(engine_compras) as compras_session:
-        # Ordenamos de más reciente a más antigua
-        purchases = compras_session.exec(select(PurchaseRecord)).all()
-        purchases.reverse()
-        return purchases
+PURCHASES_DEFAULT_LIMIT = 50
+PURCHASES_MAX_LIMIT = 500
+
+def encode_purchase_cursor(purchase: PurchaseRecord) -> str:
+    raw = f"{purchase.created_at}|{purchase.id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_purchase_cursor(cursor: str):
+    try:
+        created_at, purchase_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return created_at, int(purchase_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def filter_purchases(query, status: Optional[str], payment_method: Optional[str], date_from: Optional[str], date_to: Optional[str]):
+    # created_at se guarda como "YYYY-MM-DD HH:MM:SS", así que el orden de texto es cronológico
+    if status:
+        query = query.where(PurchaseRecord.status == status)
+    if payment_method:
+        query = query.where(PurchaseRecord.payment_method == payment_method)
+    if date_from:
+        query = query.where(PurchaseRecord.created_at >= date_from)
+    if date_to:
+        # Fecha sola (YYYY-MM-DD) incluye todo ese día
+        query = query.where(PurchaseRecord.created_at <= (f"{date_to} 23:59:59" if len(date_to) == 10 else date_to))
+    return query
+
+@app.get("/api/admin/purchases", response_model=List[PurchaseRecord])
+async def get_purchases(
+    response: Response,
+    status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = PURCHASES_DEFAULT_LIMIT,
+    authorized: bool = Depends(verify_admin)
+):
+    """
+    Compras de más reciente a más antigua, paginadas por (created_at, id).
+    El cursor de la página siguiente viaja en el header X-Next-Cursor.
+    """
+    limit = max(1, min(limit, PURCHASES_MAX_LIMIT))
+    query = filter_purchases(select(PurchaseRecord), status, payment_method, date_from, date_to)
+    if cursor:
+        created_at, purchase_id = decode_purchase_cursor(cursor)
+        query = query.where(tuple_(PurchaseRecord.created_at, PurchaseRecord.id) < tuple_(created_at, purchase_id))
+    query = query.order_by(PurchaseRecord.created_at.desc(), PurchaseRecord.id.desc()).limit(limit + 1)
+
+    async with AsyncSession(async_engine_compras) as compras_session:
+        purchases = (await compras_session.exec(query)).all()
+
+    if len(purchases) > limit:
+        purchases = purchases[:limit]
+        response.headers["X-Next-Cursor"] = encode_purchase_cursor(purchases[-1])
+    return purchases
 
 @app.put("/api/admin/purchases/{purchase_id}/approve")
 def approve_purchase(purchase_id: int, authorized: bool = Depends(verify_admin), session: Session = Depends(get_session)):
@@ -546,34 +893,39 @@ def approve_purchase(purchase_id: int, authorized: bool = Depends(verify_admin),
         if not purchase:
             raise HTTPException(status_code=404, detail="Compra no encontrada")
         
-        if purchase.status != "pending_review":
+        # Reclamar la compra con un UPDATE condicional: dos aprobaciones simultáneas
+        # (incluso en workers distintos) no pueden descontar el stock dos veces
+        claimed = compras_session.exec(
+            update(PurchaseRecord)
+            .where(PurchaseRecord.id == purchase_id)
+            .where(PurchaseRecord.status == "pending_review")
+            .values(status="approved")
+        )
+        compras_session.commit()
+        if claimed.rowcount != 1:
             raise HTTPException(status_code=400, detail="Esta compra ya no está pendiente")
         
-        # Descontar stock ahora sí
+        # Descontar stock ahora sí: todo el carrito en un único UPDATE condicional
         try:
-            items = json.loads(purchase.items)
-            for v_item in items:
-                product = session.get(Product, v_item["product_id"])
-                if product:
-                    current_pack = dict(product.pack_info) if product.pack_info else {}
-                    if current_pack:
-                        current_pack["pack_stock"] = max(0, current_pack.get("pack_stock", 0) - v_item["qty"])
-                        product.pack_info = current_pack
-                    # Descuento atómico usando func de sqlalchemy
-                    product.stock = func.max(0, Product.stock - v_item["qty"])
-                    session.add(product)
+            quantities = {}
+            for v_item in json.loads(purchase.items):
+                quantities[v_item["product_id"]] = quantities.get(v_item["product_id"], 0) + v_item["qty"]
+            # Convertir la reserva en venta; si ya venció, descontar sin tocar reservas ajenas
+            if not convert_holds(session, purchase.hold_reference, quantities):
+                decrement_packs(session, quantities, strict=True, respect_holds=True)
             session.commit()
             invalidate_products_cache()
             
-            # Cambiar estado
-            purchase.status = "approved"
-            compras_session.add(purchase)
-            compras_session.commit()
-            
             return {"message": "Compra aprobada y stock descontado con éxito"}
         except Exception as e:
             session.rollback()
-            compras_session.rollback()
+            # Devolver la compra a revisión si no se pudo descontar
+            compras_session.exec(
+                update(PurchaseRecord).where(PurchaseRecord.id == purchase_id).values(status="pending_review")
+            )
+            compras_session.commit()
+            if isinstance(e, InsufficientStock):
+                raise HTTPException(status_code=409, detail=str(e))
             raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/admin/purchases/{purchase_id}/reject")
@@ -589,106 +941,227 @@ def reject_purchase(purchase_id: int, authorized: bool = Depends(verify_admin)):
         purchase.status = "rejected"
         compras_session.add(purchase)
         compras_session.commit()
+        release_cart_hold(purchase.hold_reference)
         
         return {"message": "Compra rechazada"}
 
+def sqlite_backup_response(file_path: str, download_name: str):
+    """
+    Copia consistente de la base usando la API de backup de SQLite.
+    Con WAL, el archivo .db por sí solo puede no tener las últimas escrituras.
+    """
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"Base de datos {file_path} no encontrada.")
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        with closing(sqlite3.connect(file_path)) as source, closing(sqlite3.connect(tmp_path)) as target:
+            source.backup(target)
+    except Exception as e:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(
+        path=tmp_path, filename=download_name, media_type="application/octet-stream",
+        background=BackgroundTask(os.remove, tmp_path)
+    )
+
 # Descargar Copia de Seguridad de la Base de Productos (tienda.db)
 @app.get("/api/admin/backup/tienda")
 def download_tienda_db(authorized: bool = Depends(verify_admin)):
-    file_path = "tienda.db"
-    if os.path.exists(file_path):
-        return FileResponse(path=file_path, filename="backup_tienda.db", media_type="application/octet-stream")
-    raise HTTPException(status_code=404, detail="Base de datos tienda.db no encontrada.")
+    return sqlite_backup_response(TIENDA_DB_PATH, "backup_tienda.db")
 
 
 
 # Subir e Importar Base de Datos de Productos
 @app.post("/api/admin/upload-tienda-db")
-def upload_tienda_db(file: UploadFile = File(...), authorized: bool = Depends(verify_admin), session: Session = Depends(get_session)):
+def upload_tienda_db(
+    file: UploadFile = File(...),
+    mode: str = "insert",
+    authorized: bool = Depends(verify_admin),
+    session: Session = Depends(get_session)
+):
+    """
+    Importa productos desde otra tienda.db. mode: insert (por defecto, crea todo como nuevo),
+    upsert (actualiza por marca + nombre) o skip (omite los repetidos).
+    """
     if not file.filename.endswith(".db"):
         raise HTTPException(status_code=400, detail="El archivo debe tener extensión .db")
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo inválido. Opciones: {', '.join(IMPORT_MODES)}")
 
+    upload = None
+    conn = None
     try:
-        content = file.file.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".db") as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-
-        conn = sqlite3.connect(tmp_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM product")
-        rows = cursor.fetchall()
-        
-        for row in rows:
-            data = dict(row)
-            # Eliminar ID para crear como nuevo registro (sin pisar los existentes)
-            data.pop("id", None)
-            
-            # Parsear columnas JSON de SQLite a objetos Python
-            if "images" in data and isinstance(data["images"], str):
-                try: data["images"] = json.loads(data["images"])
-                except: data["images"] = []
-            
-            if "additional_info" in data and isinstance(data["additional_info"], str):
-                try: data["additional_info"] = json.loads(data["additional_info"])
-                except: data["additional_info"] = {}
-                
-            if "pack_info" in data and isinstance(data["pack_info"], str):
-                try: data["pack_info"] = json.loads(data["pack_info"])
-                except: data["pack_info"] = None
-
-            # Dividir Marca y Nombre automáticamente si existe el patrón "Marca - Nombre" en el nombre y no tiene marca asignada
-            if data.get("name") and not data.get("marca"):
-                if " - " in data["name"]:
-                    parts = data["name"].split(" - ", 1)
-                    data["marca"] = parts[0].strip()
-                    data["name"] = parts[1].strip()
-
-            new_product = Product(**data)
-            session.add(new_product)
-            
+        # Copiar el archivo subido a disco por bloques, sin cargarlo entero en memoria
+        try:
+            upload = stream_to_disk(file.file, file.filename, MAX_DATABASE_BYTES, DATABASE_TYPES)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+        try:
+            conn = sqlite3.connect(f"file:{upload.path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute("SELECT * FROM product")
+        except sqlite3.DatabaseError as e:
+            raise HTTPException(status_code=400, detail=f"El archivo no es una base de productos válida: {e}")
+
+        importer = ProductImporter(session, mode=mode)
+        row_number = 0
+        while True:
+            rows = cursor.fetchmany(IMPORT_BATCH_SIZE)
+            if not rows:
+                break
+            batch = []
+            for row in rows:
+                row_number += 1
+                batch.append((row_number, dict(row)))
+            importer.add_rows(batch)
+
+        # Una sola transacción para todo el archivo
+        media.recount_references(session)
         session.commit()
         invalidate_products_cache()
-        conn.close()
-        os.remove(tmp_path)
-        
-        return {"ok": True, "message": f"Se han importado {len(rows)} productos exitosamente."}
+
+        summary = importer.summary()
+        message = (
+            f"Se han importado {summary['inserted']} productos exitosamente."
+            f" Actualizados: {summary['updated']}. Omitidos: {summary['skipped']}. Con error: {len(summary['errors'])}."
+        )
+        return {"ok": True, "message": message, **summary}
+    except HTTPException:
+        session.rollback()
+        raise
     except Exception as e:
+        session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if conn is not None:
+            conn.close()
+        if upload is not None:
+            upload.discard()
 
 # Descargar Copia de Seguridad de la Base de Historial de Compras (compras.db)
 @app.get("/api/admin/backup/compras")
 def download_compras_db(authorized: bool = Depends(verify_admin)):
-    file_path = "compras.db"
-    if os.path.exists(file_path):
-        return FileResponse(path=file_path, filename="backup_compras.db", media_type="application/octet-stream")
-    raise HTTPException(status_code=404, detail="Base de datos compras.db no encontrada.")
+    return sqlite_backup_response(COMPRAS_DB_PATH, "backup_compras.db")
+
+CSV_CHUNK_SIZE = 500
+# Las 8 primeras columnas mantienen el orden histórico (planillas que leen por posición);
+# las columnas aplanadas van al final
+CSV_HEADER = [
+    "ID", "Payment ID", "Payment Method", "Status", "Total Paid", "Items", "User Data", "Created At",
+    "Nombre", "Apellido", "Email", "WhatsApp", "Dirección", "CP",
+    "Cantidad Packs", "Detalle Items"
+]
+
+def _load_json(raw, default):
+    try:
+        value = json.loads(raw) if raw else default
+        return value if value is not None else default
+    except Exception:
+        return default
+
+def purchase_csv_row(p: PurchaseRecord) -> list:
+    # Aplanamos user_data e items para que la planilla se pueda filtrar por columna.
+    # Los items de MP traen title/quantity y los de transferencia name/qty.
+    user = _load_json(p.user_data, {})
+    items = _load_json(p.items, [])
+    if not isinstance(user, dict):
+        user = {}
+    if not isinstance(items, list):
+        items = []
+    total_qty = 0
+    details = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        qty = item.get("quantity", item.get("qty", 0))
+        try:
+            total_qty += int(qty)
+        except (TypeError, ValueError):
+            pass
+        details.append(f"{qty}x {item.get('title') or item.get('name') or 'Producto'}")
+    return [
+        p.id, p.payment_id, p.payment_method, p.status, p.total_paid, p.items, p.user_data, p.created_at,
+        user.get("name", ""), user.get("last_name") or user.get("lastName", ""), user.get("email", ""),
+        user.get("whatsapp", ""), user.get("address", ""), user.get("zip_code", ""),
+        total_qty, "; ".join(details)
+    ]
+
+def iter_purchases_csv(status, payment_method, date_from, date_to, use_gzip: bool):
+    """
+    Genera el CSV por bloques: lee CSV_CHUNK_SIZE filas por vez (keyset sobre id)
+    y va emitiendo bytes, así la memoria no depende del tamaño de la tabla.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None  # wbits=31: formato gzip
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel abra bien los acentos
+    writer.writerow(CSV_HEADER)
+    chunk = emit("\ufeff" + buffer.getvalue())
+    if chunk:
+        yield chunk
+
+    last_id = 0
+    while True:
+        query = filter_purchases(select(PurchaseRecord), status, payment_method, date_from, date_to)
+        query = query.where(PurchaseRecord.id > last_id).order_by(PurchaseRecord.id).limit(CSV_CHUNK_SIZE)
+        with Session(engine_compras) as session:
+            purchases = session.exec(query).all()
+        if not purchases:
+            break
+
+        buffer.seek(0)
+        buffer.truncate(0)
+        for p in purchases:
+            writer.writerow(purchase_csv_row(p))
+        last_id = purchases[-1].id
+        chunk = emit(buffer.getvalue())
+        if chunk:
+            yield chunk
+        if len(purchases) < CSV_CHUNK_SIZE:
+            break
+
+    if compressor:
+        yield compressor.flush()
 
 @app.get("/api/admin/backup/compras-csv")
-def download_compras_csv(authorized: bool = Depends(verify_admin)):
-    with Session(engine_compras) as session:
-        purchases = session.exec(select(PurchaseRecord)).all()
-        
-    stream = io.StringIO()
-    writer = csv.writer(stream)
-    writer.writerow(["ID", "Payment ID", "Payment Method", "Status", "Total Paid", "Items", "User Data", "Created At"])
-    
-    for p in purchases:
-        writer.writerow([p.id, p.payment_id, p.payment_method, p.status, p.total_paid, p.items, p.user_data, p.created_at])
-        
-    # Usamos yield para el StreamingResponse
-    def iterfile():
-        yield stream.getvalue().encode("utf-8")
-        
-    response = StreamingResponse(iterfile(), media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=ventas.csv"
+def download_compras_csv(
+    status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    gzip: bool = False,
+    authorized: bool = Depends(verify_admin)
+):
+    filename = "ventas.csv.gz" if gzip else "ventas.csv"
+    response = StreamingResponse(
+        iter_purchases_csv(status, payment_method, date_from, date_to, gzip),
+        media_type="application/gzip" if gzip else "text/csv; charset=utf-8"
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
     return response
 
 # CRUD DE PRODUCTOS
+def normalize_asset_paths(product: Product):
+    # Si el admin reenvía URLs versionadas (/assets/...), se guarda siempre la ruta lógica (/static/...)
+    product.images = [logical_url(path) for path in product.images or []]
+    product.ficha_tecnica = logical_url(product.ficha_tecnica)
+
 @app.post("/api/products", status_code=201)
 def create_product(product: Product, authorized: bool = Depends(verify_admin), session: Session = Depends(get_session)):
+    sync_pack_stock(product)
+    # Un producto nuevo no tiene reservas: el contador lo manejan solo las reservas (stock.py)
+    product.pack_reserved = 0
+    normalize_asset_paths(product)
+    product.image_variants = describe_images(product.images)
+    media.adjust_references(session, [], media.product_paths(product))
     session.add(product)
     session.commit()
     session.refresh(product)
@@ -703,17 +1176,35 @@ def update_product(product_id: int, product_data: Product, authorized: bool = De
 
     # Usamos exclude_none=False y exclude_unset=False para asegurarnos
     # de que campos JSON como pack_info siempre se actualicen en la DB
+    old_paths = media.product_paths(product_db)
+    stored_pack_info = dict(product_db.pack_info or {})
     product_data_dict = product_data.model_dump(exclude_none=False)
     # Nunca permitir cambiar el ID
     product_data_dict.pop("id", None)
+    # pack_stock se ajusta con apply_pack_stock_edit (el frontend edita el JSON). Si el
+    # formulario reenvía el pack_stock con el que se cargó, el cambio se aplica como diferencia.
+    loaded_pack_stock = product_data_dict.pop("pack_stock", None) if "pack_stock" in product_data.model_fields_set else None
+    product_data_dict.pop("pack_stock", None)
+    # image_variants se deriva de images en el servidor
+    product_data_dict.pop("image_variants", None)
+    # pack_reserved lo mueven solo las reservas: un valor del formulario pisaría las vigentes
+    product_data_dict.pop("pack_reserved", None)
 
     for key, value in product_data_dict.items():
         setattr(product_db, key, value)
+    normalize_asset_paths(product_db)
+    product_db.image_variants = describe_images(product_db.images)
+    new_paths = media.product_paths(product_db)
+    media.adjust_references(session, old_paths, new_paths)
 
     session.add(product_db)
+    session.flush()
+    apply_pack_stock_edit(session, product_id, product_db.pack_info, stored_pack_info, loaded_pack_stock)
     session.commit()
     session.refresh(product_db)
     invalidate_products_cache()
+    # Imágenes o fichas reemplazadas que ya no usa ningún producto
+    media.release_unreferenced(session, set(old_paths) - set(new_paths))
     return product_db
 
 @app.delete("/api/products/{product_id}")
@@ -722,62 +1213,86 @@ def delete_product(product_id: int, authorized: bool = Depends(verify_admin), se
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    if product.images:
-        for image_path in product.images:
-            if image_path:
-                filename = os.path.basename(image_path)
-                safe_path = os.path.join("static", "products", filename)
-                if os.path.exists(safe_path):
-                    try:
-                        os.remove(safe_path)
-                    except Exception:
-                        pass
-
+    # Los archivos se borran solo si ningún otro producto los usa (ver media.py)
+    paths = media.product_paths(product)
+    media.adjust_references(session, paths, [])
     session.delete(product)
     session.commit()
     invalidate_products_cache()
+    media.release_unreferenced(session, paths)
     return {"ok": True}
 
+# --- MÉTRICAS (formato de texto de Prometheus, suma de todos los workers) ---
+def notification_queue_depth():
+    return {
+        "webhook_inbox": inbox.pending_count(engine),
+        "outbox": outbox.pending_count(),
+        "smtp_dispatcher": get_dispatcher().pending(),
+    }
+
+@app.get("/api/admin/metrics")
+def get_metrics(authorized: bool = Depends(verify_admin)):
+    body = collect_metrics({"notification_queue_depth": notification_queue_depth})
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/sql-profile")
+def get_sql_profile(limit: int = 20, order_by: str = "total", authorized: bool = Depends(verify_admin)):
+    # Solo tiene datos con SQL_PROFILE=1 (ver profiler.py)
+    if order_by not in ("total", "max", "count", "avg"):
+        raise HTTPException(status_code=400, detail="order_by debe ser total, max, count o avg")
+    return profiler.top_queries(limit=max(1, min(limit, 200)), order_by=order_by)
+
 @app.post("/api/admin/login")
 def admin_login_check(authorized: bool = Depends(verify_admin)):
     return {"status": "ok"}
 
 # --- ENDPOINT UPLOAD FICHA TÉCNICA ---
 @app.post("/api/admin/upload-ficha")
-async def upload_ficha(
+def upload_ficha(
     file: UploadFile = File(...),
-    authorized: bool = Depends(verify_admin)
+    authorized: bool = Depends(verify_admin),
+    session: Session = Depends(get_session)
 ):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF.")
 
-    ext = os.path.splitext(file.filename)[1]
-    new_filename = f"{uuid.uuid4().hex}{ext}"
-    filepath = os.path.join("static", "fichas", new_filename)
-    
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    return {"path": f"/static/fichas/{new_filename}"}
+    fichas_dir = os.path.join("static", "fichas")
+    try:
+        upload = stream_to_disk(file.file, file.filename, MAX_FICHA_BYTES, PDF_TYPES, directory=fichas_dir)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    # Nombre por hash de contenido: subir dos veces la misma ficha no duplica el archivo
+    new_filename = f"{upload.sha256[:32]}.pdf"
+    is_new = upload.move_to(os.path.join(fichas_dir, new_filename))
+    path = f"/static/fichas/{new_filename}"
+    media.register(session, upload.sha256, "ficha", path, upload.size)
+    return {"path": path, "duplicate": not is_new}
+
+# Consultar si un archivo ya está en el servidor antes de subirlo (el admin calcula el SHA-256 localmente)
+@app.get("/api/admin/media/{sha256}")
+def get_media(sha256: str, authorized: bool = Depends(verify_admin), session: Session = Depends(get_session)):
+    found = media.find(session, sha256.lower())
+    if found is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    result = {"sha256": found.sha256, "kind": found.kind, "path": found.path, "size": found.size}
+    if found.kind == "image":
+        result["image"] = describe_images([found.path])[0]
+    return result
 
 # --- STORE SETTINGS (PAUSA DE TIENDA) ---
 STORE_SETTINGS_FILE = "store_settings.json"
+store_settings = SettingsStore(STORE_SETTINGS_FILE)
 
 def get_store_settings():
-    if os.path.exists(STORE_SETTINGS_FILE):
-        try:
-            with open(STORE_SETTINGS_FILE, "r") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {"isStorePaused": False}
+    return store_settings.get()
 
 @app.get("/api/settings")
-def api_get_settings():
+async def api_get_settings():
+    # Configuración en memoria (ver settings_store.py): no necesita el threadpool
     return get_store_settings()
 
 @app.put("/api/admin/settings")
 def api_update_settings(settings: dict, authorized: bool = Depends(verify_admin)):
-    with open(STORE_SETTINGS_FILE, "w") as f:
-        json.dump(settings, f)
+    store_settings.save(settings)
     return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,265 @@
+# media.py
+"""
+Almacén de archivos subidos direccionado por contenido (SHA-256).
+
+- Una imagen o ficha con el mismo contenido se guarda una sola vez: las subidas
+  repetidas reutilizan el archivo existente, y el admin puede consultar
+  GET /api/admin/media/{sha256} antes de subir para no transferirlo de nuevo.
+- MediaObject.ref_count cuenta cuántas veces aparece la ruta en Product.images y
+  Product.ficha_tecnica. Crear, editar y borrar productos ajusta el contador.
+- Borrar un producto solo elimina archivos cuyo contador llegó a cero. Si el
+  archivo se subió hace poco (puede estar en un formulario aún sin guardar), lo
+  deja para el recolector.
+
+Recolección de basura (recalcula los contadores desde los productos y borra
+archivos huérfanos más viejos que el período de gracia):
+    python media.py gc [--dry-run] [--grace-hours 24] [--include-unregistered]
+
+Los archivos sin fila en MediaObject (subidos antes de este módulo, u originales
+que conserva `python images.py backfill` para clientes con la ruta vieja cacheada)
+solo se borran con --include-unregistered.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from models import MediaObject, Product
+from images import PRODUCTS_DIR, image_files, parse_variant_path, variant_filename, PRIMARY_VARIANT
+
+STATIC_DIR = "static"
+STATIC_URL = "/static"
+MEDIA_DIRS = {
+    "image": PRODUCTS_DIR,
+    "ficha": os.path.join(STATIC_DIR, "fichas"),
+}
+GC_GRACE_SECONDS = float(os.getenv("MEDIA_GC_GRACE_HOURS", "24")) * 3600
+
+
+def product_paths(product: Product) -> List[str]:
+    """Rutas de archivos que referencia un producto (con repetición, como se cuentan)."""
+    paths = [p for p in (product.images or []) if p]
+    if product.ficha_tecnica:
+        paths.append(product.ficha_tecnica)
+    return paths
+
+
+def register(session: Session, sha256: str, kind: str, path: str, size: int):
+    """
+    Alta (o renovación) de un archivo recién subido. No toca ref_count: la referencia
+    se suma recién cuando un producto guarda la ruta. Hace commit.
+    """
+    now = time.time()
+    statement = sqlite_insert(MediaObject).values(
+        sha256=sha256, kind=kind, path=path, size=size, ref_count=0, uploaded_at=now
+    ).on_conflict_do_update(index_elements=["sha256"], set_={"uploaded_at": now})
+    session.execute(statement)
+    session.commit()
+
+
+def find(session: Session, sha256: str) -> Optional[MediaObject]:
+    media = session.get(MediaObject, sha256)
+    if media is None or not all(os.path.exists(f) for f in files_for(media.path)):
+        return None
+    return media
+
+
+def adjust_references(session: Session, removed: Iterable[str], added: Iterable[str]):
+    """
+    Suma/resta referencias según la diferencia entre las rutas viejas y nuevas de un producto.
+    Un solo UPDATE con CASE; no hace commit (va en la misma transacción que el producto).
+    """
+    delta = Counter(added)
+    delta.subtract(Counter(removed))
+    delta = {path: n for path, n in delta.items() if n}
+    if not delta:
+        return
+    session.execute(
+        update(MediaObject)
+        .where(MediaObject.path.in_(list(delta)))
+        .values(ref_count=MediaObject.ref_count + case(delta, value=MediaObject.path, else_=0))
+    )
+
+
+def files_for(path: str) -> List[str]:
+    """Archivos en disco de una ruta lógica. Solo dentro de las carpetas de media."""
+    if not path or not path.startswith(STATIC_URL + "/"):
+        return []
+    if parse_variant_path(path):
+        return image_files(path)
+    full_path = os.path.abspath(os.path.join(STATIC_DIR, path[len(STATIC_URL) + 1:]))
+    for directory in MEDIA_DIRS.values():
+        if os.path.dirname(full_path) == os.path.abspath(directory):
+            return [full_path]
+    return []
+
+
+def _remove_files(paths: Iterable[str]) -> int:
+    removed = 0
+    for path in paths:
+        for file_path in files_for(path):
+            try:
+                os.remove(file_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"No se pudo borrar {file_path}: {e}")
+    return removed
+
+
+def release_unreferenced(session: Session, paths: Iterable[str], grace: float = GC_GRACE_SECONDS) -> List[str]:
+    """
+    Después de restar referencias (y de hacer commit), borra los archivos de las rutas que
+    quedaron sin referencias. Lo subido hace menos de `grace` segundos queda para el GC.
+    Devuelve las rutas borradas.
+    """
+    paths = list(set(paths))
+    if not paths:
+        return []
+    cutoff = time.time() - grace
+    orphans = session.exec(
+        select(MediaObject).where(
+            MediaObject.path.in_(paths),
+            MediaObject.ref_count <= 0,
+            MediaObject.uploaded_at < cutoff,
+        )
+    ).all()
+    released = []
+    for media in orphans:
+        # Borrar la fila primero con condición: si otro request volvió a referenciarlo, no se toca
+        result = session.execute(
+            delete(MediaObject).where(MediaObject.sha256 == media.sha256, MediaObject.ref_count <= 0)
+        )
+        session.commit()
+        if result.rowcount:
+            _remove_files([media.path])
+            released.append(media.path)
+    return released
+
+
+def _disk_objects() -> Dict[str, List[str]]:
+    """Ruta lógica -> archivos en disco, agrupando las variantes de cada imagen."""
+    objects: Dict[str, List[str]] = {}
+    for kind, directory in MEDIA_DIRS.items():
+        if not os.path.isdir(directory):
+            continue
+        url_dir = f"{STATIC_URL}/{os.path.relpath(directory, STATIC_DIR)}"
+        for filename in os.listdir(directory):
+            full_path = os.path.join(directory, filename)
+            if filename.startswith(".") or not os.path.isfile(full_path):
+                continue
+            digest = parse_variant_path(filename)
+            if digest is None and kind == "image" and filename.endswith(".json") and len(filename) == 37:
+                digest = filename[:-5]  # Metadatos de variantes: <hash>.json
+            if digest:
+                logical = f"{url_dir}/{variant_filename(digest, PRIMARY_VARIANT)}"
+            else:
+                logical = f"{url_dir}/{filename}"
+            objects.setdefault(logical, []).append(full_path)
+    return objects
+
+
+def recount_references(session: Session, dry_run: bool = False):
+    """
+    Recalcula ref_count de todas las filas desde los productos (p. ej. después de una importación).
+    Devuelve (conteo por ruta, filas corregidas). No hace commit.
+    """
+    counts = Counter()
+    for images, ficha in session.exec(select(Product.images, Product.ficha_tecnica)).all():
+        counts.update(p for p in (images or []) if p)
+        if ficha:
+            counts[ficha] += 1
+
+    recounted = 0
+    for media in session.exec(select(MediaObject)).all():
+        if media.ref_count != counts.get(media.path, 0):
+            recounted += 1
+            if not dry_run:
+                media.ref_count = counts.get(media.path, 0)
+                session.add(media)
+    return counts, recounted
+
+
+def collect_garbage(session: Session, grace: float = GC_GRACE_SECONDS, dry_run: bool = False,
+                    include_unregistered: bool = False) -> Dict:
+    """
+    Recalcula ref_count desde los productos y borra los archivos que ningún producto referencia.
+    También limpia filas sin archivos. Los archivos sin registrar solo se borran con
+    include_unregistered (entre ellos están los originales que conserva el backfill de imágenes).
+    """
+    counts, recounted = recount_references(session, dry_run)
+    summary = {"recounted": recounted, "removed_paths": [], "removed_files": 0, "bytes_freed": 0, "unregistered": 0}
+    media_by_path = {m.path: m for m in session.exec(select(MediaObject)).all()}
+
+    cutoff = time.time() - grace
+    for logical, files in _disk_objects().items():
+        if counts.get(logical):
+            continue
+        media = media_by_path.get(logical)
+        if media is None and not include_unregistered:
+            summary["unregistered"] += 1
+            continue
+        last_upload = media.uploaded_at if media else 0.0
+        newest_file = max(os.path.getmtime(f) for f in files)
+        if max(last_upload, newest_file) >= cutoff:
+            continue
+        summary["removed_paths"].append(logical)
+        summary["removed_files"] += len(files)
+        summary["bytes_freed"] += sum(os.path.getsize(f) for f in files)
+        if not dry_run:
+            if media:
+                session.delete(media)
+            for file_path in files:
+                os.remove(file_path)
+
+    # Filas cuyo archivo ya no existe en disco
+    for path, media in media_by_path.items():
+        if path in summary["removed_paths"] or counts.get(path):
+            continue
+        if not all(os.path.exists(f) for f in files_for(path)) and not dry_run:
+            session.delete(media)
+
+    if not dry_run:
+        session.commit()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="Borrar archivos que ningún producto usa")
+    gc_parser.add_argument("--dry-run", action="store_true")
+    gc_parser.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600)
+    gc_parser.add_argument("--include-unregistered", action="store_true",
+                           help="Borrar también archivos sin registrar (p. ej. originales que conserva el backfill)")
+    args = parser.parse_args(argv)
+
+    if args.command == "gc":
+        from database import engine, create_db_and_tables
+        create_db_and_tables()
+        with Session(engine) as session:
+            summary = collect_garbage(
+                session, grace=args.grace_hours * 3600, dry_run=args.dry_run,
+                include_unregistered=args.include_unregistered,
+            )
+        print(
+            f"Archivos huérfanos: {len(summary['removed_paths'])} ({summary['removed_files']} en disco, "
+            f"{summary['bytes_freed'] / (1024 * 1024):.1f} MB) | Contadores corregidos: {summary['recounted']}"
+            + (" (dry-run, sin cambios)" if args.dry_run else "")
+        )
+        for path in summary["removed_paths"]:
+            print(f"  {path}")
+        if summary["unregistered"]:
+            print(f"Archivos sin registrar conservados: {summary['unregistered']} (borrarlos con --include-unregistered)")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
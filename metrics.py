@@ -0,0 +1,388 @@
+# metrics.py
+"""
+Métricas de la aplicación en formato de texto de Prometheus.
+
+Cada worker de gunicorn acumula sus métricas en memoria y cada pocos segundos
+guarda una foto en METRICS_DIR/<pid>.json. El endpoint de métricas junta las
+fotos de todos los workers vivos, así el scrape da el total sin importar qué
+worker lo atiende. Cada worker borra su foto al terminar, y las de workers que
+murieron sin hacerlo se ignoran y se borran al leer: cuando gunicorn recicla un
+worker los contadores bajan, y Prometheus lo toma como un reinicio (rate() lo maneja).
+
+Qué se mide:
+- http_requests_total / http_request_duration_seconds / http_requests_in_flight por ruta
+- external_call_duration_seconds: Mercado Pago, SMTP y WhatsApp
+- function_duration_seconds: funciones internas marcadas con @metrics.timed()
+- db_queries_total / db_query_duration_seconds por base y ruta, y
+  db_queries_per_request (hooks de SQLAlchemy, ver instrument_engine)
+- cache_requests_total{result="hit|miss"} del catálogo
+- Profundidad de las colas de notificaciones (se calcula al momento del scrape)
+"""
+import os
+import json
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(os.getenv("CACHE_DIR", ".cache"), "metrics"))
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+HELP = {
+    "http_requests_total": ("counter", "Requests HTTP atendidos"),
+    "http_request_duration_seconds": ("histogram", "Latencia de los requests HTTP"),
+    "http_requests_in_flight": ("gauge", "Requests HTTP en curso"),
+    "external_call_duration_seconds": ("histogram", "Duración de llamadas a servicios externos"),
+    "function_duration_seconds": ("histogram", "Duración de funciones internas instrumentadas"),
+    "db_queries_total": ("counter", "Consultas SQL ejecutadas"),
+    "db_query_duration_seconds": ("histogram", "Duración de las consultas SQL"),
+    "db_queries_per_request": ("histogram", "Consultas SQL por request HTTP"),
+    "cache_requests_total": ("counter", "Lecturas de caché"),
+    "notification_queue_depth": ("gauge", "Mensajes pendientes en las colas de notificaciones"),
+}
+
+_LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> _LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class RequestContext:
+    """Datos del request en curso que necesitan los hooks de SQLAlchemy (ruta y conteo de queries)."""
+
+    __slots__ = ("route", "queries", "query_time", "statement_counts")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.queries = 0
+        self.query_time = 0.0
+        self.statement_counts = None  # Lo usa profiler.py (solo con SQL_PROFILE=1)
+
+
+# Se copia al threadpool junto con el resto del contexto, así que los endpoints `def` también lo ven
+current_request: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("current_request", default=None)
+
+
+def route_label(router, scope) -> str:
+    """
+    Plantilla de la ruta (/api/products/{product_id}) que atenderá el request, nunca la URL real:
+    así la cardinalidad de las etiquetas queda acotada. Se resuelve antes del routing con la
+    misma lógica que Starlette para poder etiquetar también el gauge de requests en curso.
+    """
+    from starlette.routing import Match
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None) or "unmatched"
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+    return getattr(partial, "path", None) or "unmatched"
+
+
+def current_route() -> str:
+    ctx = current_request.get()
+    return ctx.route if ctx is not None else "background"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[_LabelKey, float] = {}
+        self._gauges: Dict[_LabelKey, float] = {}
+        self._histograms: Dict[_LabelKey, list] = {}  # [buckets, counts por bucket, suma, total]
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- Registro ---
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name: str, delta: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [list(buckets), [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(hist[0]):
+                if value <= bound:
+                    hist[1][i] += 1
+                    break
+            hist[2] += value
+            hist[3] += 1
+
+    @contextmanager
+    def timer(self, name: str, buckets=LATENCY_BUCKETS, **labels):
+        """Mide un bloque y lo registra con outcome="ok" o "error" según termine."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets=buckets, outcome=outcome, **labels)
+
+    def timed(self, function_name: Optional[str] = None):
+        """Decorador: histograma function_duration_seconds para funciones internas costosas."""
+        def decorator(func):
+            label = function_name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer("function_duration_seconds", function=label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- Fotos por worker ---
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "written_at": time.time(),
+                "counters": [[k[0], list(k[1]), v] for k, v in self._counters.items()],
+                "gauges": [[k[0], list(k[1]), v] for k, v in self._gauges.items()],
+                "histograms": [[k[0], list(k[1]), h[0], list(h[1]), h[2], h[3]] for k, h in self._histograms.items()],
+            }
+
+    def flush(self, directory: str = METRICS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self, interval: float = FLUSH_INTERVAL):
+        if self._flusher and self._flusher.is_alive():
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._run, args=(interval,), name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.remove_snapshot()
+
+    def remove_snapshot(self, directory: str = METRICS_DIR):
+        """Borra la foto de este worker (al apagarse: sus números ya no deben sumarse)."""
+        try:
+            os.remove(os.path.join(directory, f"{os.getpid()}.json"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"No se pudo borrar la foto de métricas: {e}")
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"No se pudieron guardar las métricas: {e}")
+
+
+metrics = MetricsRegistry()
+
+
+# --- Agregación y formato de texto ---
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def load_snapshots(directory: str = METRICS_DIR):
+    snapshots = []
+    if not os.path.isdir(directory):
+        return snapshots
+    for filename in os.listdir(directory):
+        pid = filename.split(".", 1)[0]
+        if not pid.isdigit():
+            continue
+        path = os.path.join(directory, filename)
+        if not _pid_alive(int(pid)):
+            # Worker que murió sin borrar su foto (o su .tmp): no se suma y se limpia
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(snapshots, extra_gauges: Optional[Dict[_LabelKey, float]] = None) -> str:
+    counters: Dict[_LabelKey, float] = {}
+    gauges: Dict[_LabelKey, float] = dict(extra_gauges or {})
+    histograms: Dict[_LabelKey, list] = {}
+
+    for snap in snapshots:
+        if not _pid_alive(snap.get("pid", 0)):
+            continue
+        for name, labels, value in snap.get("counters", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snap.get("gauges", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, buckets, counts, total_sum, total_count in snap.get("histograms", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            hist = histograms.get(key)
+            if hist is None:
+                histograms[key] = [buckets, list(counts), total_sum, total_count]
+            else:
+                hist[1] = [a + b for a, b in zip(hist[1], counts)]
+                hist[2] += total_sum
+                hist[3] += total_count
+
+    lines = []
+    by_name: Dict[str, list] = {}
+    for kind, series in (("counter", counters), ("gauge", gauges), ("histogram", histograms)):
+        for key, value in series.items():
+            by_name.setdefault(key[0], []).append((kind, key[1], value))
+
+    for name in sorted(by_name):
+        entries = by_name[name]
+        kind, help_text = HELP.get(name, (entries[0][0], name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for entry_kind, labels, value in sorted(entries, key=lambda e: e[1]):
+            if entry_kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+            buckets, counts, total_sum, total_count = value
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {total_count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total_sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {total_count}")
+    return "\n".join(lines) + "\n"
+
+
+def collect(gauge_sources: Optional[Dict[str, Callable[[], Dict[str, float]]]] = None) -> str:
+    """
+    Texto de métricas de todos los workers. gauge_sources son gauges que se
+    calculan al momento (p. ej. profundidad de colas en la base, que es compartida).
+    """
+    metrics.flush()
+    extra = {}
+    for name, source in (gauge_sources or {}).items():
+        try:
+            for label_value, value in source().items():
+                extra[_key(name, {"queue": label_value})] = value
+        except Exception as e:
+            print(f"Error calculando la métrica {name}: {e}")
+    return render(load_snapshots(), extra)
+
+
+# --- Integraciones ---
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia, conteo y requests en curso por ruta; abre el contexto del request."""
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_label(self.router, scope)
+        ctx = RequestContext(route)
+        token = current_request.set(ctx)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        metrics.gauge_add("http_requests_in_flight", 1, route=route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.gauge_add("http_requests_in_flight", -1, route=route)
+            metrics.inc("http_requests_total", method=method, route=route, status=status["code"])
+            metrics.observe("http_request_duration_seconds", elapsed, method=method, route=route)
+            if ctx.queries:
+                metrics.observe("db_queries_per_request", ctx.queries, buckets=COUNT_BUCKETS, route=route)
+            current_request.reset(token)
+
+
+def instrument_engine(engine, database: str):
+    """Cuenta y mide cada consulta del engine, atribuyéndola a la ruta del request en curso."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        route = current_route()
+        metrics.inc("db_queries_total", database=database, route=route)
+        metrics.observe("db_query_duration_seconds", elapsed, buckets=QUERY_BUCKETS, database=database, route=route)
+        ctx = current_request.get()
+        if ctx is not None:
+            ctx.queries += 1
+            ctx.query_time += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        # Una consulta que falla no pasa por after_cursor_execute: descartar su marca de inicio
+        conn = exception_context.connection
+        if conn is not None:
+            starts = conn.info.get("metrics_query_start")
+            if starts:
+                starts.pop()
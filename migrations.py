@@ -0,0 +1,284 @@
+# migrations.py
+"""
+Migraciones versionadas del esquema de tienda.db y compras.db.
+
+Cada base tiene una tabla schema_version con una fila por migración aplicada.
+Al arrancar (create_db_and_tables) se compara la última versión registrada con
+la última definida acá: si coinciden no se hace nada más (una sola consulta).
+Si faltan migraciones, el primer worker toma un lock de archivo (fcntl) y las
+aplica en orden; los demás esperan el lock, vuelven a leer la versión y siguen.
+
+Cada migración corre en una transacción (BEGIN IMMEDIATE) junto con su fila en
+schema_version. Los pasos además son idempotentes (add_column y create_table
+revisan si ya existe, los índices usan IF NOT EXISTS): la migración 1 crea las
+tablas que falten con los modelos actuales, así que en una base nueva las
+siguientes no cambian nada, y en una base vieja completan lo que falte.
+
+Para cambiar el esquema: agregar una Migration al final de la lista de su base,
+con el número siguiente. Nunca editar ni reordenar las ya publicadas.
+
+Uso:
+    python migrations.py status
+    python migrations.py migrate
+"""
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import argparse
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import models
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "120"))
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+class MigrationError(Exception):
+    pass
+
+
+# --- Helpers para escribir migraciones ---
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, ddl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN si todavía no existe. Devuelve True si la agregó."""
+    if column_exists(conn, table, column):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return True
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def create_table(conn: sqlite3.Connection, table) -> bool:
+    """
+    Crea una tabla de models.py tal como está hoy, con sus índices. Si la tabla ya
+    existe no la toca (puede ser de una versión vieja: las columnas e índices que le
+    falten los agregan las migraciones siguientes). Devuelve True si la creó.
+    """
+    if table_exists(conn, table.name):
+        return False
+    dialect = sqlite_dialect.dialect()
+    conn.execute(str(CreateTable(table).compile(dialect=dialect)))
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+    return True
+
+
+# --- tienda.db ---
+
+def _tienda_tables(conn):
+    for model in (models.Product, models.ProcessedPayment, models.StockHold,
+                  models.WebhookNotification, models.OutboxMessage, models.MediaObject):
+        create_table(conn, model.__table__)
+
+
+def _tienda_legacy_columns(conn):
+    # Columnas que antes se agregaban con ALTER TABLE en cada arranque
+    add_column(conn, "product", "distincion", "VARCHAR")
+    add_column(conn, "product", "ficha_tecnica", "VARCHAR")
+    # Stock de packs como columna real (antes solo vivía en pack_info JSON)
+    if add_column(conn, "product", "pack_stock", "INTEGER NOT NULL DEFAULT 0"):
+        conn.execute(
+            "UPDATE product SET pack_stock = MAX(0, CAST(COALESCE(json_extract(pack_info, '$.pack_stock'), 0) AS INTEGER))"
+        )
+    add_column(conn, "product", "pack_reserved", "INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "product", "image_variants", "JSON")
+
+
+def _tienda_catalog_indexes(conn):
+    # Índices del stock y de los filtros del listado del catálogo
+    for column in ("pack_stock", "category", "marca", "region"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_product_{column} ON product ({column})")
+
+
+def _tienda_webhook_generation(conn):
+    add_column(conn, "webhooknotification", "generation", "INTEGER NOT NULL DEFAULT 0")
+
+
+TIENDA_MIGRATIONS = [
+    Migration(1, "Tablas base de la tienda", _tienda_tables),
+    Migration(2, "Columnas de producto agregadas antes de las migraciones", _tienda_legacy_columns),
+    Migration(3, "Índices de stock y filtros del catálogo", _tienda_catalog_indexes),
+    Migration(4, "Generación de avisos en la bandeja de webhooks", _tienda_webhook_generation),
+]
+
+
+# --- compras.db ---
+
+def _compras_tables(conn):
+    create_table(conn, models.PurchaseRecord.__table__)
+
+
+def _compras_hold_reference(conn):
+    add_column(conn, "purchaserecord", "hold_reference", "VARCHAR")
+
+
+def _compras_listing_indexes(conn):
+    # Índices del listado paginado de compras
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_purchaserecord_created_id ON purchaserecord (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchaserecord_status_created_id ON purchaserecord (status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchaserecord_method_created_id ON purchaserecord (payment_method, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchaserecord_payment_id ON purchaserecord (payment_id)",
+    ):
+        conn.execute(statement)
+
+
+COMPRAS_MIGRATIONS = [
+    Migration(1, "Tabla de compras", _compras_tables),
+    Migration(2, "Referencia de reserva en compras por transferencia", _compras_hold_reference),
+    Migration(3, "Índices del listado de compras", _compras_listing_indexes),
+]
+
+
+# --- Ejecución ---
+
+SCHEMA_VERSION_DDL = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"
+)
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # isolation_level=None: las transacciones se abren a mano (BEGIN IMMEDIATE) e incluyen el DDL
+    return sqlite3.connect(db_path, timeout=30, isolation_level=None)
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    try:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0  # Base nueva o anterior a las migraciones
+
+
+@contextmanager
+def migration_lock(db_path: str, timeout: float = LOCK_TIMEOUT):
+    """Lock exclusivo entre procesos (workers de gunicorn, CLIs) para migrar una base."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_path = os.path.join(CACHE_DIR, f"{os.path.basename(db_path)}.migrate.lock")
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise MigrationError(f"No se obtuvo el lock de migración de {db_path} en {timeout:.0f}s")
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _check(migrations: List[Migration]):
+    versions = [m.version for m in migrations]
+    if versions != list(range(1, len(versions) + 1)):
+        raise MigrationError(f"Las versiones deben ser 1..N consecutivas, hay {versions}")
+
+
+def migrate(db_path: str, migrations: List[Migration]) -> List[int]:
+    """Aplica las migraciones pendientes de db_path. Devuelve las versiones aplicadas."""
+    _check(migrations)
+    latest = migrations[-1].version if migrations else 0
+
+    # Camino rápido (cada arranque una vez migrado): una sola consulta, sin lock
+    with closing(_connect(db_path)) as conn:
+        if current_version(conn) >= latest:
+            return []
+
+    applied = []
+    with migration_lock(db_path), closing(_connect(db_path)) as conn:
+        conn.execute(SCHEMA_VERSION_DDL)
+        # Otro worker pudo haber migrado mientras esperábamos el lock
+        version = current_version(conn)
+        for migration in migrations:
+            if migration.version <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration.apply(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, datetime('now'))",
+                    (migration.version, migration.description),
+                )
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                raise MigrationError(
+                    f"Falló la migración {migration.version} de {db_path} ({migration.description}): {e}"
+                ) from e
+            print(f"Migración aplicada en {db_path}: {migration.version} - {migration.description}")
+            applied.append(migration.version)
+    return applied
+
+
+def database_migrations(tienda_path: str, compras_path: str) -> Dict[str, Tuple[str, List[Migration]]]:
+    return {
+        "tienda": (tienda_path, TIENDA_MIGRATIONS),
+        "compras": (compras_path, COMPRAS_MIGRATIONS),
+    }
+
+
+def migrate_all(tienda_path: str = "tienda.db", compras_path: str = "compras.db") -> Dict[str, List[int]]:
+    return {
+        name: migrate(path, migrations)
+        for name, (path, migrations) in database_migrations(tienda_path, compras_path).items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="Versión actual y migraciones pendientes de cada base")
+    subparsers.add_parser("migrate", help="Aplicar las migraciones pendientes")
+    args = parser.parse_args(argv)
+
+    from database import DATA_DIR, TIENDA_DB_PATH, COMPRAS_DB_PATH
+
+    if args.command == "status":
+        for name, (path, migrations) in database_migrations(TIENDA_DB_PATH, COMPRAS_DB_PATH).items():
+            with closing(_connect(path)) as conn:
+                version = current_version(conn)
+            pending = [m for m in migrations if m.version > version]
+            print(f"{name} ({path}): versión {version} de {migrations[-1].version}")
+            for m in pending:
+                print(f"  pendiente {m.version}: {m.description}")
+        return 0
+
+    if args.command == "migrate":
+        os.makedirs(DATA_DIR, exist_ok=True)
+        try:
+            applied = migrate_all(TIENDA_DB_PATH, COMPRAS_DB_PATH)
+        except MigrationError as e:
+            print(e)
+            return 1
+        if not any(applied.values()):
+            print("Las bases ya están al día")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 # models.py
 from typing import Optional, List, Dict, Any
-from sqlmodel import Field, SQLModel, Column, JSON
+from sqlmodel import Field, SQLModel, Column, JSON, Index
 from datetime import datetime
 
 class ContactForm(SQLModel):
@@ -30,18 +30,21 @@ class Product(SQLModel, table=True):
     name: str
     description: str
     price: float
-    category: str
+    category: str = Field(index=True)
     long_description: str
     stock: int
     is_active: bool = Field(default=True)
     images: List[str] = Field(sa_column=Column(JSON))  # Soporta una o múltiples rutas de imágenes
+    image_variants: Optional[List[Dict[str, Any]]] = Field(default=None, sa_column=Column(JSON))  # Variantes WebP por imagen (ver images.py)
     additional_info: Dict[str, Any] = Field(sa_column=Column(JSON))
     pack_info: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
-    marca: Optional[str] = None
+    pack_stock: int = Field(default=0, index=True)  # Fuente de verdad del stock de packs (ver stock.py)
+    pack_reserved: int = Field(default=0)  # Packs retenidos por reservas de checkout vigentes
+    marca: Optional[str] = Field(default=None, index=True)
     distincion: Optional[str] = None
     composicion: Optional[str] = None
     cosecha: Optional[str] = None
-    region: Optional[str] = None
+    region: Optional[str] = Field(default=None, index=True)
     elevacion: Optional[str] = None
     presentacion: Optional[str] = None
     alcohol: Optional[str] = None
@@ -55,17 +58,66 @@ class Product(SQLModel, table=True):
     medidas_caja: Optional[str] = None
     ficha_tecnica: Optional[str] = None
 
+# Reserva temporal de stock durante el checkout (tienda.db)
+class StockHold(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    reference: str = Field(index=True)  # external_reference de MP o referencia de la transferencia
+    product_id: int = Field(index=True)
+    qty: int
+    expires_at: float = Field(index=True)
+
+# Archivo subido (imagen o ficha) direccionado por contenido, con conteo de referencias (tienda.db)
+class MediaObject(SQLModel, table=True):
+    sha256: str = Field(primary_key=True)
+    kind: str  # "image" | "ficha"
+    path: str = Field(index=True, unique=True)  # Ruta lógica que guardan los productos (/static/...)
+    size: int = Field(default=0)
+    ref_count: int = Field(default=0)  # Cuántas veces aparece path en Product.images / ficha_tecnica
+    uploaded_at: float = Field(default=0.0)  # Última vez que se subió (protege subidas aún no guardadas en un producto)
+
 class ProcessedPayment(SQLModel, table=True):
     payment_id: str = Field(primary_key=True)
     status: str
 
+# Bandeja de entrada durable de notificaciones de Mercado Pago (tienda.db)
+class WebhookNotification(SQLModel, table=True):
+    payment_id: str = Field(primary_key=True)
+    status: str = Field(default="pending", index=True)  # pending | processing | done | failed
+    attempts: int = Field(default=0)
+    next_attempt_at: float = Field(default=0.0, index=True)
+    locked_until: float = Field(default=0.0)
+    last_error: Optional[str] = None
+    # Se incrementa con cada aviso que llega mientras la fila está en proceso
+    generation: int = Field(default=0)
+    received_at: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+# Bandeja de salida durable de notificaciones: emails y alertas de WhatsApp (tienda.db)
+class OutboxMessage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # "email" | "whatsapp"
+    payload: str  # Almacenado como texto JSON
+    status: str = Field(default="pending", index=True)  # pending | processing | sent | dead
+    attempts: int = Field(default=0)
+    next_attempt_at: float = Field(default=0.0, index=True)
+    locked_until: float = Field(default=0.0)
+    last_error: Optional[str] = None
+    created_at: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
 # Nuevo Modelo para el registro histórico de compras (compras.db)
 class PurchaseRecord(SQLModel, table=True):
+    # Índices compuestos para el listado paginado por (created_at, id) del admin
+    __table_args__ = (
+        Index("ix_purchaserecord_created_id", "created_at", "id"),
+        Index("ix_purchaserecord_status_created_id", "status", "created_at", "id"),
+        Index("ix_purchaserecord_method_created_id", "payment_method", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    payment_id: Optional[str] = None
+    payment_id: Optional[str] = Field(default=None, index=True)
     payment_method: str  # "mp" o "transferencia"
     status: str
     total_paid: float
     items: str  # Almacenado como texto JSON
     user_data: str  # Almacenado como texto JSON
+    hold_reference: Optional[str] = None  # Reserva de stock asociada (transferencias)
     created_at: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
\ No newline at end of file
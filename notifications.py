@@ -1,23 +1,66 @@
 # notifications.py
-import smtplib
 import os
-import json
-import urllib.request
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 from email.mime.base import MIMEBase
 from email import encoders
+from mailer import get_dispatcher
+from whatsapp import get_whatsapp_client, WhatsAppAPIError
+import outbox
 
 load_dotenv()
 
-def send_emails(metadata, items, total_paid):
+# Las funciones send_* arman los mensajes y los guardan en el outbox (ver outbox.py).
+# El envío real lo hacen deliver_email / deliver_whatsapp_alert desde el drenador,
+# con reintentos, así que la latencia de la request no depende de SMTP ni de Meta.
+
+def build_email(spec):
+    """Arma el MIME a partir de la especificación guardada en el outbox."""
     sender_email = os.getenv("MAIL_USERNAME")
-    sender_password = os.getenv("MAIL_PASSWORD")
-    
-    if not sender_email or not sender_password:
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = spec.get("to") or sender_email
+    if spec.get("reply_to"):
+        msg.add_header('Reply-To', spec["reply_to"])
+    msg['Subject'] = spec["subject"]
+    msg.attach(MIMEText(spec["body"], spec.get("subtype", "plain")))
+
+    attachment = spec.get("attachment")
+    if attachment:
+        part = MIMEBase('application', 'octet-stream')
+        with open(attachment["path"], "rb") as f:
+            part.set_payload(f.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f"attachment; filename= {attachment['filename']}")
+        msg.attach(part)
+    return msg
+
+def deliver_email(spec):
+    """Handler del outbox para emails: lanza excepción si el envío falla para que se reintente."""
+    get_dispatcher().send(build_email(spec))
+    print(f"Correo enviado: {spec['subject']}")
+
+def queue_email(to, subject, body, subtype="plain", reply_to=None, attachment=None):
+    outbox.enqueue("email", {
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "subtype": subtype,
+        "reply_to": reply_to,
+        "attachment": attachment,
+    })
+
+def mail_credentials_ok():
+    if not os.getenv("MAIL_USERNAME") or not os.getenv("MAIL_PASSWORD"):
         print("ERROR: Faltan credenciales de correo en .env")
+        return False
+    return True
+
+def send_emails(metadata, items, total_paid):
+    if not mail_credentials_ok():
         return
+    sender_email = os.getenv("MAIL_USERNAME")
 
     # --- CORREO 1: AL CLIENTE ---
     customer_email = metadata.get("email")
@@ -51,11 +94,7 @@ def send_emails(metadata, items, total_paid):
     </html>
     """
 
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = customer_email
-    msg['Subject'] = subject_client
-    msg.attach(MIMEText(body_client, 'html'))
+    queue_email(customer_email, subject_client, body_client, subtype="html")
 
     # --- CORREO 2: AL ADMIN ---
     admin_email = sender_email 
@@ -80,53 +119,19 @@ def send_emails(metadata, items, total_paid):
     Revisar panel de Mercado Pago para confirmar acreditación.
     """
 
-    msg_admin = MIMEMultipart()
-    msg_admin['From'] = sender_email
-    msg_admin['To'] = admin_email
-    msg_admin['Subject'] = subject_admin
-    msg_admin.attach(MIMEText(body_admin, 'plain'))
+    queue_email(admin_email, subject_admin, body_admin)
 
-    # Enviar ambos correos con una sola conexión SMTP
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        
-        try:
-            server.send_message(msg)
-            print(f"Correo enviado al cliente: {customer_email}")
-        except Exception as e:
-            print(f"Error enviando email al cliente: {e}")
-        
-        try:
-            server.send_message(msg_admin)
-            print(f"Alerta enviada al admin.")
-        except Exception as e:
-            print(f"Error enviando alerta admin: {e}")
-        
-        server.quit()
-    except Exception as e:
-        print(f"Error conectando al servidor SMTP: {e}")
-    
-    # Enviar alerta por WhatsApp (fuera del bloque SMTP)
+    # Alerta por WhatsApp como mensaje independiente del outbox
     send_whatsapp_admin_alert(metadata, items, total_paid)
 
 
-def send_transfer_email(user_data, items, total_paid, discount, file_bytes, filename):
-    sender_email = os.getenv("MAIL_USERNAME")
-    sender_password = os.getenv("MAIL_PASSWORD")
-    
-    if not sender_email or not sender_password:
-        print("ERROR: Faltan credenciales de correo en .env")
+def send_transfer_email(user_data, items, total_paid, discount, file_path, filename):
+    if not mail_credentials_ok():
         return
-        
-    try:
-        msg_client = MIMEMultipart()
-        msg_client['From'] = sender_email
-        msg_client['To'] = user_data.get('email')
-        msg_client['Subject'] = "Pedido por Transferencia Recibido - Bodega Valle del Cóndor"
-        
-        body_client = f"""
+    sender_email = os.getenv("MAIL_USERNAME")
+
+    # 1. CORREO AL CLIENTE
+    body_client = f"""
         Hola {user_data.get('name')},
         
         Hemos recibido tu pedido y el comprobante de transferencia.
@@ -137,27 +142,12 @@ def send_transfer_email(user_data, items, total_paid, discount, file_bytes, file
         
         Muchas gracias por tu compra.
         """
-        msg_client.attach(MIMEText(body_client, 'plain'))
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg_client)
-        server.quit()
-        print("Mail cliente enviado.")
-    except Exception as e:
-        print(f"Error mail cliente: {e}")
+    queue_email(user_data.get('email'), "Pedido por Transferencia Recibido - Bodega Valle del Cóndor", body_client)
 
     # 2. CORREO AL ADMIN (CON EL COMPROBANTE ADJUNTO)
-    try:
-        msg_admin = MIMEMultipart()
-        msg_admin['From'] = sender_email
-        msg_admin['To'] = sender_email # Se lo manda a sí mismo
-        msg_admin['Subject'] = f"NUEVA TRANSFERENCIA - {user_data.get('name')} {user_data.get('last_name')}"
-        
-        items_str = "\n".join([f"- {i['quantity']}x {i.get('title', 'Producto')}" for i in items])
-        
-        body_admin = f"""
+    items_str = "\n".join([f"- {i['quantity']}x {i.get('title', 'Producto')}" for i in items])
+    
+    body_admin = f"""
         ¡NUEVA VENTA POR TRANSFERENCIA!
         -------------------------------
         Cliente: {user_data.get('name')} {user_data.get('last_name')}
@@ -176,38 +166,23 @@ def send_transfer_email(user_data, items, total_paid, discount, file_bytes, file
         -------------------------------
         >>> REVISA EL COMPROBANTE ADJUNTO <<<
         """
-        msg_admin.attach(MIMEText(body_admin, 'plain'))
+    # El comprobante ya está en disco: el outbox guarda solo la ruta
+    queue_email(
+        sender_email,  # Se lo manda a sí mismo
+        f"NUEVA TRANSFERENCIA - {user_data.get('name')} {user_data.get('last_name')}",
+        body_admin,
+        attachment={"path": file_path, "filename": filename},
+    )
 
-        # ADJUNTAR EL ARCHIVO
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(file_bytes)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f"attachment; filename= {filename}")
-        msg_admin.attach(part)
-
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg_admin)
-        server.quit()
-        print("Mail admin con comprobante enviado.")
-        
-        # Enviar alerta por WhatsApp
-        send_whatsapp_admin_alert(user_data, items, total_paid)
-        
-    except Exception as e:
-        print(f"Error mail admin: {e}")
+    # Enviar alerta por WhatsApp
+    send_whatsapp_admin_alert(user_data, items, total_paid)
 
 def send_contact_email(contact_data):
-    sender_email = os.getenv("MAIL_USERNAME")
-    sender_password = os.getenv("MAIL_PASSWORD")
-    
-    if not sender_email or not sender_password:
-        print("ERROR: Faltan credenciales de correo en .env")
+    if not mail_credentials_ok():
         return
 
     # Se envía al mismo correo que envía (el del dueño)
-    admin_email = sender_email 
+    admin_email = os.getenv("MAIL_USERNAME")
     
     subject = f"CONSULTA WEB - {contact_data.name}"
     
@@ -223,30 +198,11 @@ def send_contact_email(contact_data):
     Responder a este correo para contactar al cliente.
     """
 
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = admin_email
-        # Esto es un truco: ponemos el email del cliente en "Reply-To"
-        # Así cuando le das "Responder" en Gmail, le respondes al cliente y no a ti mismo
-        msg.add_header('Reply-To', contact_data.email) 
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-        server.quit()
-        print("Mail de contacto enviado.")
-    except Exception as e:
-        print(f"Error mail contacto: {e}")
+    # Esto es un truco: ponemos el email del cliente en "Reply-To"
+    # Así cuando le das "Responder" en Gmail, le respondes al cliente y no a ti mismo
+    queue_email(admin_email, subject, body, reply_to=contact_data.email)
 
-def send_whatsapp_admin_alert(customer_data, items, total_paid):
-    """
-    Envía un mensaje de WhatsApp al administrador usando la API oficial de Meta (Cloud API).
-    Requiere una plantilla aprobada.
-    """
+def whatsapp_config():
     token = os.getenv("WHATSAPP_API_TOKEN", "").strip()
     phone_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "").strip()
     admin_num = os.getenv("ADMIN_WHATSAPP_NUMBER", "").strip()
@@ -254,12 +210,35 @@ def send_whatsapp_admin_alert(customer_data, items, total_paid):
     template_lang = os.getenv("WHATSAPP_TEMPLATE_LANG", "es").strip()
     
     if not all([token, phone_id, admin_num, template_name]):
+        return None
+    return token, phone_id, admin_num, template_name, template_lang
+
+def send_whatsapp_admin_alert(customer_data, items, total_paid):
+    """Encola una alerta de WhatsApp para el administrador (la envía el outbox)."""
+    if whatsapp_config() is None:
         print("Faltan credenciales de WhatsApp en .env. Omitiendo mensaje de WhatsApp.")
         return
-        
+    outbox.enqueue("whatsapp", {
+        "customer_data": customer_data,
+        "items": items,
+        "total_paid": total_paid,
+    })
+
+def deliver_whatsapp_alert(payload):
+    """
+    Envía un mensaje de WhatsApp al administrador usando la API oficial de Meta (Cloud API).
+    Requiere una plantilla aprobada. Lanza excepción si falla para que el outbox reintente.
+    """
+    config = whatsapp_config()
+    if config is None:
+        print("Faltan credenciales de WhatsApp en .env. Omitiendo mensaje de WhatsApp.")
+        return
+    token, phone_id, admin_num, template_name, template_lang = config
+    customer_data = payload["customer_data"]
+    items = payload["items"]
+    total_paid = payload["total_paid"]
+
     try:
-        url = f"https://graph.facebook.com/v20.0/{phone_id}/messages"
-        
         customer_name = f"{customer_data.get('name', '')} {customer_data.get('last_name', '')}".strip()
         
         # Armar un string resumido de los productos (separados por coma)
@@ -277,7 +256,7 @@ def send_whatsapp_admin_alert(customer_data, items, total_paid):
         # {{4}} = Email
         # {{5}} = Dirección
         # {{6}} = Resumen de productos
-        payload = {
+        message = {
             "messaging_product": "whatsapp",
             "to": admin_num,
             "type": "template",
@@ -330,18 +309,12 @@ def send_whatsapp_admin_alert(customer_data, items, total_paid):
                 ]
             }
         }
-        req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST')
-        req.add_header('Authorization', f'Bearer {token}')
-        req.add_header('Content-Type', 'application/json')
-        
-        print(f"Enviando payload a WhatsApp: {json.dumps(payload, indent=2)}")
-        
-        with urllib.request.urlopen(req) as response:
-            res_body = response.read()
-            print(f"Alerta de WhatsApp enviada al admin.")
+        get_whatsapp_client().send_message(phone_id, token, message)
+        print(f"Alerta de WhatsApp enviada al admin ({customer_name or 'Cliente'}, total {total_paid}).")
             
-    except urllib.error.HTTPError as e:
-        error_msg = e.read().decode('utf-8')
-        print(f"Error HTTP {e.code} de WhatsApp. Detalles de Meta: {error_msg}")
+    except WhatsAppAPIError as e:
+        print(f"Error HTTP {e.status_code} de WhatsApp. Detalles de Meta: {e.detail}")
+        raise
     except Exception as e:
-        print(f"Error enviando alerta de WhatsApp al admin: {e}")
\ No newline at end of file
+        print(f"Error enviando alerta de WhatsApp al admin: {e}")
+        raise
\ No newline at end of file
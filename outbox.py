@@ -0,0 +1,195 @@
+# outbox.py
+import json
+import time
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from sqlalchemy import update, or_, and_, func
+from sqlmodel import Session, select
+
+from database import engine
+from models import OutboxMessage
+from whatsapp import WhatsAppAPIError
+
+# Despierta a los drenadores de este proceso apenas se encola algo
+_wake = threading.Event()
+
+
+def enqueue(kind: str, payload: dict) -> int:
+    """Guarda una notificación en el outbox (tienda.db). Se confirma antes de responder la request."""
+    with Session(engine) as session:
+        message = OutboxMessage(kind=kind, payload=json.dumps(payload), next_attempt_at=time.time())
+        session.add(message)
+        session.commit()
+        session.refresh(message)
+    _wake.set()
+    return message.id
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    Errores que no se arreglan reintentando (dirección rechazada, 5xx del SMTP, 4xx de
+    WhatsApp, payload inválido): el mensaje pasa a "dead" en el primer intento.
+    Credenciales inválidas no cuentan: se corrigen en la configuración y el reintento sirve.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    if isinstance(error, WhatsAppAPIError):
+        return 400 <= error.status_code < 500 and error.status_code != 429
+    return isinstance(error, (ValueError, KeyError))
+
+
+def pending_count() -> int:
+    with Session(engine) as session:
+        return session.exec(
+            select(func.count()).select_from(OutboxMessage).where(OutboxMessage.status.in_(["pending", "processing"]))
+        ).one()
+
+
+class OutboxWorker:
+    """
+    Drena el outbox en segundo plano con concurrencia limitada.
+    Cada mensaje se reclama con un UPDATE condicional (seguro con varios workers
+    de gunicorn), se reintenta con backoff exponencial y, tras `max_attempts`
+    fallos (o al primero si es permanente, ver is_permanent_error), queda como
+    "dead" con el último error para revisión manual.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Callable[[dict], None]],
+        concurrency: int = 4,
+        poll_interval: float = 5.0,
+        max_attempts: int = 10,
+        base_backoff: float = 5.0,
+        max_backoff: float = 3600.0,
+        lock_timeout: float = 300.0,
+    ):
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock_timeout = lock_timeout
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = threading.Semaphore(concurrency)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._run, name="outbox-drain", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        _wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor:
+            # Los mensajes en vuelo terminan; los no reclamados siguen en la tabla
+            self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.drain_once() and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                print(f"Error drenando outbox: {e}")
+            _wake.wait(self.poll_interval)
+            _wake.clear()
+
+    def _due_ids(self, limit: int):
+        now = time.time()
+        with Session(engine) as session:
+            return session.exec(
+                select(OutboxMessage.id)
+                .where(or_(
+                    and_(OutboxMessage.status == "pending", OutboxMessage.next_attempt_at <= now),
+                    # Mensajes reclamados por un worker que murió a mitad del envío
+                    and_(OutboxMessage.status == "processing", OutboxMessage.locked_until < now),
+                ))
+                .order_by(OutboxMessage.next_attempt_at)
+                .limit(limit)
+            ).all()
+
+    def _claim(self, message_id: int) -> bool:
+        now = time.time()
+        with Session(engine) as session:
+            result = session.exec(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == message_id)
+                .where(or_(
+                    OutboxMessage.status == "pending",
+                    and_(OutboxMessage.status == "processing", OutboxMessage.locked_until < now),
+                ))
+                .values(status="processing", locked_until=now + self.lock_timeout, attempts=OutboxMessage.attempts + 1)
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def _finish(self, message_id: int, error: Optional[Exception] = None):
+        with Session(engine) as session:
+            message = session.get(OutboxMessage, message_id)
+            if not message:
+                return
+            if error is None:
+                message.status = "sent"
+                message.last_error = None
+            elif is_permanent_error(error):
+                message.status = "dead"
+                message.last_error = str(error)
+                print(f"Outbox: mensaje {message_id} ({message.kind}) descartado, error permanente: {error}")
+            elif message.attempts >= self.max_attempts:
+                message.status = "dead"
+                message.last_error = str(error)
+                print(f"Outbox: mensaje {message_id} ({message.kind}) sin entregar tras {message.attempts} intentos: {error}")
+            else:
+                message.status = "pending"
+                message.last_error = str(error)
+                delay = min(self.base_backoff * (2 ** (message.attempts - 1)), self.max_backoff)
+                message.next_attempt_at = time.time() + delay
+            message.locked_until = 0.0
+            session.add(message)
+            session.commit()
+
+    def _deliver(self, message_id: int):
+        try:
+            with Session(engine) as session:
+                message = session.get(OutboxMessage, message_id)
+                kind, payload = message.kind, json.loads(message.payload)
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"Tipo de notificación desconocido: {kind}")
+            handler(payload)
+            self._finish(message_id)
+        except Exception as e:
+            print(f"Outbox: error enviando mensaje {message_id}: {e}")
+            self._finish(message_id, e)
+        finally:
+            self._slots.release()
+
+    def drain_once(self) -> int:
+        """Reclama y despacha los mensajes vencidos. Devuelve cuántos se reclamaron."""
+        claimed = 0
+        for message_id in self._due_ids(self.concurrency * 2):
+            if self._stop.is_set():
+                break
+            # Respetar el límite de concurrencia antes de reclamar
+            self._slots.acquire()
+            if not self._claim(message_id):
+                self._slots.release()
+                continue
+            claimed += 1
+            self._executor.submit(self._deliver, message_id)
+        return claimed
@@ -0,0 +1,216 @@
+# product_import.py
+import json
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+from pydantic import ValidationError
+from sqlalchemy import func, insert, update
+from sqlmodel import Session, select
+
+from models import Product
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_MODES = ("insert", "upsert", "skip")
+
+# Columnas que se pueden importar (el id nunca se toma del origen)
+PRODUCT_COLUMNS = [name for name in Product.model_fields if name != "id"]
+JSON_COLUMNS = {"images": [], "image_variants": None, "additional_info": {}, "pack_info": None}
+REQUIRED_DEFAULTS = {
+    "description": "",
+    "long_description": "",
+    "category": "",
+    "price": 0.0,
+    "stock": 0,
+    "images": [],
+    "additional_info": {},
+}
+
+
+def dedupe_key(marca: Optional[str], name: Optional[str]) -> Tuple[str, str]:
+    return ((marca or "").strip().lower(), (name or "").strip().lower())
+
+
+def normalize_product_row(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Limpia una fila de origen y la valida contra el modelo Product.
+    Lanza ValueError con un mensaje legible si la fila no es válida.
+    """
+    row = {k: v for k, v in data.items() if k in PRODUCT_COLUMNS}
+
+    # Parsear columnas JSON de SQLite a objetos Python
+    for column, default in JSON_COLUMNS.items():
+        value = row.get(column)
+        if isinstance(value, (str, bytes)):
+            try:
+                row[column] = json.loads(value)
+            except ValueError:
+                row[column] = default
+
+    # Dividir Marca y Nombre automáticamente si existe el patrón "Marca - Nombre" en el nombre y no tiene marca asignada
+    if row.get("name") and not row.get("marca") and " - " in row["name"]:
+        marca, name = row["name"].split(" - ", 1)
+        row["marca"] = marca.strip()
+        row["name"] = name.strip()
+
+    for column, default in REQUIRED_DEFAULTS.items():
+        if row.get(column) is None:
+            row[column] = default
+    if row.get("is_active") is None:
+        row["is_active"] = True
+    if not row.get("name"):
+        raise ValueError("Falta el nombre del producto")
+
+    # pack_stock: columna real, derivada de pack_info si viene allí
+    pack_info = row.get("pack_info")
+    if isinstance(pack_info, dict) and "pack_stock" in pack_info:
+        row["pack_stock"] = pack_info.get("pack_stock")
+    row.setdefault("pack_stock", 0)
+    row["pack_reserved"] = 0
+
+    try:
+        validated = Product.model_validate(row)
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+        raise ValueError(errors)
+
+    result = validated.model_dump(exclude={"id"})
+    result["pack_stock"] = max(0, int(result.get("pack_stock") or 0))
+    return result
+
+
+def provided_columns(data: Dict[str, Any]) -> Set[str]:
+    """Columnas de Product que trae realmente la fila de origen (más las que se derivan de ellas)."""
+    columns = {k for k in data if k in PRODUCT_COLUMNS}
+    pack_info = data.get("pack_info")
+    if isinstance(pack_info, (str, bytes)):
+        try:
+            pack_info = json.loads(pack_info)
+        except ValueError:
+            pack_info = None
+    if isinstance(pack_info, dict) and "pack_stock" in pack_info:
+        columns.add("pack_stock")  # normalize_product_row lo deriva de pack_info
+    if "name" in columns:
+        columns.add("marca")  # Puede salir de dividir "Marca - Nombre"
+    columns.discard("pack_reserved")  # Lo manejan las reservas, nunca el origen
+    return columns
+
+
+class ProductImporter:
+    """
+    Importa productos por lotes dentro de la transacción de `session`.
+
+    - insert: siempre crea productos nuevos.
+    - upsert: actualiza el producto existente con la misma marca + nombre, o lo crea.
+    - skip:   omite los que ya existen con la misma marca + nombre.
+
+    En upsert solo se actualizan las columnas que trae el origen (una base vieja sin
+    image_variants o pack_stock no pisa esos valores con defaults). update_columns
+    restringe más: por ejemplo la planilla solo trae los campos mapeados. Una entrada
+    "pack_info.pack_price" actualiza esa clave del JSON y conserva las demás.
+
+    Los INSERT/UPDATE se hacen con executemany por lote. Los errores por fila se
+    acumulan en `errors` en lugar de abortar toda la importación.
+    """
+
+    def __init__(self, session: Session, mode: str = "insert", update_columns: Optional[Iterable[str]] = None):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Modo de importación inválido: {mode}")
+        self.session = session
+        self.mode = mode
+        self.update_columns: Optional[Set[str]] = None
+        self.json_keys: Dict[str, Set[str]] = {}
+        if update_columns is not None:
+            self.update_columns = set()
+            for column in update_columns:
+                column, _, key = column.partition(".")
+                if key:
+                    self.json_keys.setdefault(column, set()).add(key)
+                else:
+                    self.update_columns.add(column)
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors: List[Dict[str, Any]] = []
+        self._existing: Dict[Tuple[str, str], int] = {}
+        if mode != "insert":
+            # Índice marca+nombre -> id cargado una sola vez
+            rows = session.exec(select(Product.id, Product.marca, Product.name)).all()
+            self._existing = {dedupe_key(marca, name): pid for pid, marca, name in rows}
+
+    def add_rows(self, rows: List[Tuple[int, Dict[str, Any]]]):
+        """Procesa un lote de (número_de_fila, datos)."""
+        to_insert, to_update = [], []
+        for row_number, data in rows:
+            try:
+                product = normalize_product_row(data)
+            except Exception as e:
+                self.errors.append({"row": row_number, "error": str(e)})
+                continue
+
+            if self.mode == "insert":
+                to_insert.append(product)
+                continue
+
+            key = dedupe_key(product.get("marca"), product.get("name"))
+            existing_id = self._existing.get(key)
+            if existing_id is None:
+                to_insert.append(product)
+                # Reservamos la clave para deduplicar también dentro del mismo archivo
+                self._existing[key] = -1
+            elif self.mode == "skip" or existing_id == -1:
+                self.skipped += 1
+            else:
+                columns = provided_columns(data)
+                if self.update_columns is not None:
+                    columns &= self.update_columns
+                values = {"id": existing_id, **{c: product[c] for c in columns}}
+                for column, keys in self.json_keys.items():
+                    if isinstance(product.get(column), dict):
+                        values[column] = {k: v for k, v in product[column].items() if k in keys}
+                to_update.append(values)
+
+        if to_insert:
+            self.session.execute(insert(Product), to_insert)
+            self.inserted += len(to_insert)
+        if to_update:
+            self._update(to_update)
+            self.updated += len(to_update)
+
+    def _update(self, rows: List[Dict[str, Any]]):
+        if self.json_keys:
+            # Las claves parciales de un JSON se combinan con el valor actual de cada producto
+            columns = [getattr(Product, c) for c in self.json_keys]
+            current = {
+                row[0]: row[1:]
+                for row in self.session.exec(
+                    select(Product.id, *columns).where(Product.id.in_([r["id"] for r in rows]))
+                ).all()
+            }
+            for row in rows:
+                for i, column in enumerate(self.json_keys):
+                    if column in row:
+                        row[column] = {**(current.get(row["id"], [None] * len(columns))[i] or {}), **row[column]}
+
+        # UPDATE masivo por clave primaria (executemany), un lote por cada combinación de columnas
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            if len(group[0]) > 1:
+                self.session.execute(update(Product), group)
+
+        # Un pack_info sin pack_stock no cambia el stock: el espejo del JSON se rehace desde la columna
+        mirror_ids = [r["id"] for r in rows if "pack_info" in r and "pack_stock" not in r]
+        if mirror_ids:
+            self.session.execute(
+                update(Product)
+                .where(Product.id.in_(mirror_ids))
+                .values(pack_info=func.json_set(Product.pack_info, "$.pack_stock", Product.pack_stock))
+                .execution_options(synchronize_session=False)
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "errors": self.errors,
+        }
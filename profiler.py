@@ -0,0 +1,306 @@
+# profiler.py
+"""
+Perfilador de SQL opcional (apagado por defecto).
+
+Con SQL_PROFILE=1 se engancha a los eventos de SQLAlchemy de cada engine y registra,
+por sentencia normalizada (los IN (?, ?, ...) se colapsan):
+- cantidad de ejecuciones, tiempo total y máximo
+- forma de los parámetros (tipos, no valores: no se guardan datos de clientes)
+- rutas de FastAPI que la dispararon (la ruta sale del contexto de metrics.py)
+
+Además:
+- Consultas más lentas que SQL_SLOW_MS van a un log JSON (una línea por evento) en
+  SQL_SLOW_LOG (default .cache/slow_queries.jsonl).
+- Si una misma sentencia se repite SQL_N_PLUS_ONE_THRESHOLD veces dentro de un request
+  (el típico session.get por ítem dentro de un bucle), se marca como N+1 y se loguea.
+
+Cada worker guarda su resumen en SQL_PROFILE_DIR/<pid>.json (como metrics.py) y
+GET /api/admin/sql-profile junta los de los workers vivos: top-N desde el arranque.
+
+Los hooks solo acumulan en memoria: el resumen y el log se escriben desde un hilo
+(profiler.start()), porque con el engine async los hooks corren en el event loop.
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+from metrics import current_request, current_route, load_snapshots
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+ENABLED = os.getenv("SQL_PROFILE", "0").lower() in ("1", "true", "yes")
+SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+SLOW_LOG = os.getenv("SQL_SLOW_LOG", os.path.join(CACHE_DIR, "slow_queries.jsonl"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+PROFILE_DIR = os.getenv("SQL_PROFILE_DIR", os.path.join(CACHE_DIR, "sql_profile"))
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Topes para que el perfilador no crezca sin límite en un worker de larga vida
+MAX_STATEMENTS = 2000
+MAX_SHAPES = 5
+MAX_STATEMENT_CHARS = 2000
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"(VALUES\s*)(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+
+
+def normalize_statement(statement: str) -> str:
+    """Una sola forma por consulta: sin saltos de línea y con los IN (?, ?, ...) y VALUES múltiples colapsados."""
+    statement = _WHITESPACE_RE.sub(" ", statement).strip()
+    statement = _VALUES_RE.sub(r"\1\2, ...", statement)
+    return _IN_LIST_RE.sub("IN (?, ...)", statement)[:MAX_STATEMENT_CHARS]
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Tipos de los parámetros, p. ej. "(int, str, int×12)". Nunca los valores."""
+    if executemany:
+        rows = list(parameters or [])
+        return f"{len(rows)}× {parameter_shape(rows[0]) if rows else '()'}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    groups = []
+    for value in parameters or ():
+        name = type(value).__name__
+        if groups and groups[-1][0] == name:
+            groups[-1][1] += 1
+        else:
+            groups.append([name, 1])
+    return "(" + ", ".join(name if n == 1 else f"{name}×{n}" for name, n in groups) + ")"
+
+
+class QueryProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._stats: Dict[tuple, dict] = {}
+        self._n_plus_one: Dict[tuple, dict] = {}
+        self._pending_log: List[str] = []
+        self.dropped = 0
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    # --- Registro ---
+
+    def record(self, database: str, statement: str, parameters, executemany: bool, elapsed: float):
+        route = current_route()
+        normalized = normalize_statement(statement)
+        shape = parameter_shape(parameters, executemany)
+        key = (database, normalized)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    self.dropped += 1
+                    entry = None
+                else:
+                    entry = self._stats[key] = {
+                        "count": 0, "total": 0.0, "max": 0.0, "slow": 0, "shapes": [], "routes": Counter(),
+                    }
+            if entry is not None:
+                entry["count"] += 1
+                entry["total"] += elapsed
+                entry["max"] = max(entry["max"], elapsed)
+                entry["routes"][route] += 1
+                if shape not in entry["shapes"] and len(entry["shapes"]) < MAX_SHAPES:
+                    entry["shapes"].append(shape)
+                if elapsed * 1000 >= SLOW_MS:
+                    entry["slow"] += 1
+
+        if elapsed * 1000 >= SLOW_MS:
+            self._log({
+                "event": "slow_query", "database": database, "route": route,
+                "duration_ms": round(elapsed * 1000, 3), "statement": normalized, "params": shape,
+            })
+
+        ctx = current_request.get()
+        if ctx is not None:
+            if ctx.statement_counts is None:
+                ctx.statement_counts = Counter()
+            ctx.statement_counts[key] += 1
+            # Se avisa una sola vez por request, al cruzar el umbral
+            if ctx.statement_counts[key] == N_PLUS_ONE_THRESHOLD:
+                self._flag_n_plus_one(database, normalized, route)
+
+    def _flag_n_plus_one(self, database: str, normalized: str, route: str):
+        key = (database, normalized, route)
+        with self._lock:
+            entry = self._n_plus_one.setdefault(key, {"requests": 0, "last_seen": 0.0})
+            entry["requests"] += 1
+            entry["last_seen"] = time.time()
+        self._log({
+            "event": "n_plus_one", "database": database, "route": route,
+            "repeats": N_PLUS_ONE_THRESHOLD, "statement": normalized,
+        })
+
+    def _log(self, record: dict):
+        # Solo se encola: el archivo lo escribe el hilo de flush (write_log)
+        record = {"ts": round(time.time(), 3), "pid": os.getpid(), **record}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._log_lock:
+            self._pending_log.append(line)
+
+    def write_log(self, path: str = SLOW_LOG):
+        with self._log_lock:
+            lines, self._pending_log = self._pending_log, []
+        if not lines:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Modo append: las líneas de distintos workers no se pisan
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    # --- Fotos por worker ---
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self.started_at,
+                "dropped": self.dropped,
+                "statements": [
+                    {"database": db, "statement": stmt, "count": e["count"], "total": e["total"], "max": e["max"],
+                     "slow": e["slow"], "shapes": list(e["shapes"]), "routes": dict(e["routes"])}
+                    for (db, stmt), e in self._stats.items()
+                ],
+                "n_plus_one": [
+                    {"database": db, "statement": stmt, "route": route, **e}
+                    for (db, stmt, route), e in self._n_plus_one.items()
+                ],
+            }
+
+    def flush(self, directory: str = PROFILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self, interval: float = FLUSH_INTERVAL):
+        if self._flusher and self._flusher.is_alive():
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._run, args=(interval,), name="sql-profile-flush", daemon=True)
+        self._flusher.start()
+
+    def stop(self, directory: str = PROFILE_DIR):
+        """Detiene el hilo, escribe el log pendiente y borra la foto de este worker (como metrics.stop)."""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        try:
+            self.write_log()
+        except OSError as e:
+            logger.warning("No se pudo escribir el log de consultas lentas: %s", e)
+        try:
+            os.remove(os.path.join(directory, f"{os.getpid()}.json"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("No se pudo borrar la foto del perfil de SQL: %s", e)
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+                self.write_log()
+            except OSError as e:
+                logger.warning("No se pudo guardar el perfil de SQL: %s", e)
+
+
+profiler = QueryProfiler()
+
+
+def profile_engine(engine, database: str):
+    """Engancha el perfilador al engine. No hace nada si SQL_PROFILE no está activo."""
+    if not ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiler_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("profiler_query_start")
+        if not starts:
+            return
+        profiler.record(database, statement, parameters, executemany, time.perf_counter() - starts.pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None:
+            starts = conn.info.get("profiler_query_start")
+            if starts:
+                starts.pop()
+
+
+def top_queries(limit: int = 20, order_by: str = "total", directory: str = PROFILE_DIR) -> dict:
+    """Las `limit` consultas más pesadas de todos los workers (order_by: total | max | count | avg)."""
+    if ENABLED:
+        profiler.flush(directory)
+    merged: Dict[tuple, dict] = {}
+    n_plus_one: Dict[tuple, dict] = {}
+    # Solo workers vivos ("desde el arranque" de los procesos actuales); las fotos de
+    # workers muertos se borran al leer, igual que en metrics.py
+    snapshots = load_snapshots(directory)
+    for snap in snapshots:
+        for s in snap.get("statements", []):
+            key = (s["database"], s["statement"])
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {**s, "routes": Counter(s["routes"]), "shapes": list(s["shapes"])}
+                continue
+            entry["count"] += s["count"]
+            entry["total"] += s["total"]
+            entry["max"] = max(entry["max"], s["max"])
+            entry["slow"] += s["slow"]
+            entry["routes"].update(s["routes"])
+            entry["shapes"].extend(x for x in s["shapes"] if x not in entry["shapes"])
+        for n in snap.get("n_plus_one", []):
+            key = (n["database"], n["statement"], n["route"])
+            entry = n_plus_one.setdefault(key, {**n, "requests": 0, "last_seen": 0.0})
+            entry["requests"] += n["requests"]
+            entry["last_seen"] = max(entry["last_seen"], n["last_seen"])
+
+    sort_keys = {
+        "total": lambda e: e["total"],
+        "max": lambda e: e["max"],
+        "count": lambda e: e["count"],
+        "avg": lambda e: e["total"] / e["count"] if e["count"] else 0,
+    }
+    ranked = sorted(merged.values(), key=sort_keys.get(order_by, sort_keys["total"]), reverse=True)[:limit]
+    return {
+        "enabled": ENABLED,
+        "slow_ms": SLOW_MS,
+        "workers": len(snapshots),
+        "since": min((s["started_at"] for s in snapshots), default=None),
+        "dropped_statements": sum(s.get("dropped", 0) for s in snapshots),
+        "queries": [
+            {
+                "database": e["database"],
+                "statement": e["statement"],
+                "count": e["count"],
+                "total_ms": round(e["total"] * 1000, 3),
+                "avg_ms": round(e["total"] * 1000 / e["count"], 3) if e["count"] else 0,
+                "max_ms": round(e["max"] * 1000, 3),
+                "slow": e["slow"],
+                "params": e["shapes"][:MAX_SHAPES],
+                "routes": dict(e["routes"].most_common(10)),
+            }
+            for e in ranked
+        ],
+        "n_plus_one": sorted(n_plus_one.values(), key=lambda e: e["requests"], reverse=True),
+    }
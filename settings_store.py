@@ -0,0 +1,80 @@
+# settings_store.py
+import os
+import json
+import time
+import tempfile
+import threading
+
+from cache import SharedVersion
+
+DEFAULT_SETTINGS = {"isStorePaused": False}
+
+
+class SettingsStore:
+    """
+    Configuración de la tienda cargada una sola vez y mantenida en memoria.
+    Las escrituras desde la API incrementan una versión compartida (mmap), por lo
+    que todos los workers recargan al instante. Además se revisa el mtime del
+    archivo cada `check_interval` segundos por si alguien lo edita a mano.
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = SharedVersion("settings")
+        self._lock = threading.Lock()
+        self._data = dict(DEFAULT_SETTINGS)
+        self._loaded_version = -1
+        self._mtime = None
+        self._next_check = 0.0
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload(self):
+        with self._lock:
+            version = self.version.get()
+            mtime = self._file_mtime()
+            data = dict(DEFAULT_SETTINGS)
+            if mtime is not None:
+                try:
+                    with open(self.path, "r") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    # Archivo inválido: mantenemos lo último que se leyó bien
+                    print(f"Error leyendo {self.path}: {e}")
+                    data = self._data
+            self._data = data
+            self._loaded_version = version
+            self._mtime = mtime
+            self._next_check = time.monotonic() + self.check_interval
+
+    def get(self) -> dict:
+        # Camino rápido: solo una lectura de memoria compartida
+        if self._loaded_version != self.version.get():
+            self._reload()
+        elif time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.check_interval
+            if self._file_mtime() != self._mtime:
+                self._reload()
+        return self._data
+
+    def save(self, settings: dict):
+        # Escritura atómica: archivo temporal en el mismo directorio + os.replace
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".settings-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(settings, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.version.bump()
+        self._reload()
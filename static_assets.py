@@ -0,0 +1,260 @@
+# static_assets.py
+"""
+URLs inmutables para los archivos de /static.
+
+Cada archivo se publica además bajo un nombre que incluye el hash de su contenido:
+
+    /static/fichas/ab12cd.pdf   ->   /assets/fichas/ab12cd.3f9a1c0b7e2d4a65.pdf
+
+Como el nombre cambia si cambia el contenido, esas URLs se sirven con
+Cache-Control: immutable y un año de max-age (navegador y proxy no revalidan).
+La base de datos sigue guardando la ruta lógica (/static/...); la API traduce a
+la ruta con hash al responder y vuelve a la lógica al recibir datos del admin.
+
+Los tipos comprimibles se sirven con una versión gzip (y brotli si está el
+paquete instalado) generada una sola vez por hash. Los PDF aceptan Range.
+
+Pre-generar manifiesto y variantes comprimidas (opcional, si no se hace al vuelo):
+    python static_assets.py build
+"""
+import os
+import re
+import sys
+import copy
+import gzip
+import json
+import hashlib
+import argparse
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Dependencia opcional
+    brotli = None
+
+STATIC_DIR = "static"
+STATIC_URL = "/static"
+ASSETS_URL = "/assets"
+ASSETS_CACHE_DIR = os.path.join(os.getenv("CACHE_DIR", ".cache"), "assets")
+MANIFEST_FILENAME = "asset-manifest.json"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+DIGEST_LENGTH = 16
+# Extensiones que vale la pena comprimir (las imágenes WebP/PNG/JPG ya vienen comprimidas)
+COMPRESSIBLE_EXTENSIONS = {".pdf", ".svg", ".css", ".js", ".json", ".txt", ".html", ".xml", ".csv"}
+# Solo se guarda la variante comprimida si ahorra al menos un 10%
+MIN_COMPRESSION_RATIO = 0.9
+
+_HASHED_NAME_RE = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$" % DIGEST_LENGTH)
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def hashed_name(logical_path: str, digest: str) -> str:
+    stem, ext = os.path.splitext(logical_path)
+    return f"{stem}.{digest}{ext}"
+
+
+class AssetManifest:
+    """
+    Mapa ruta lógica -> hash de contenido, por worker.
+    Cada entrada se valida contra (mtime, tamaño) del archivo, así que un archivo
+    reemplazado se vuelve a hashear sin coordinación entre workers. El manifiesto
+    en disco (python static_assets.py build) solo sirve para arrancar sin hashear.
+    """
+
+    def __init__(self, root: str = STATIC_DIR, cache_dir: str = ASSETS_CACHE_DIR):
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir
+        self._entries: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+        self._load_manifest()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, MANIFEST_FILENAME)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self._entries = {path: tuple(entry) for path, entry in saved.get("files", {}).items()}
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def path_for(self, logical_path: str) -> Optional[str]:
+        full_path = os.path.abspath(os.path.join(self.root, logical_path))
+        # Nunca salir de la carpeta static (../)
+        if not full_path.startswith(self.root + os.sep):
+            return None
+        return full_path
+
+    def digest(self, logical_path: str) -> Optional[str]:
+        """Hash actual del archivo (None si no existe)."""
+        full_path = self.path_for(logical_path)
+        if full_path is None:
+            return None
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        entry = self._entries.get(logical_path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        digest = file_digest(full_path)
+        with self._lock:
+            self._entries[logical_path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def url(self, static_url: Optional[str]) -> Optional[str]:
+        """Traduce /static/x/y.ext a /assets/x/y.<hash>.ext. Lo que no sea un archivo local queda igual."""
+        if not static_url or not static_url.startswith(STATIC_URL + "/"):
+            return static_url
+        logical_path = static_url[len(STATIC_URL) + 1:]
+        digest = self.digest(logical_path)
+        if digest is None:
+            return static_url
+        return f"{ASSETS_URL}/{hashed_name(logical_path, digest)}"
+
+    def compressed_variant(self, full_path: str, digest: str, encoding: str) -> Optional[str]:
+        """
+        Ruta de la versión precomprimida ("gzip" o "br"), generándola la primera vez.
+        Devuelve None si el tipo no se comprime o si no vale la pena.
+        """
+        if os.path.splitext(full_path)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return None
+        if encoding == "br" and brotli is None:
+            return None
+        suffix = ".br" if encoding == "br" else ".gz"
+        target = os.path.join(self.cache_dir, digest + suffix)
+        skip_marker = target + ".skip"
+        if os.path.exists(target):
+            return target
+        if os.path.exists(skip_marker):
+            return None
+
+        with open(full_path, "rb") as f:
+            raw = f.read()
+        if encoding == "br":
+            packed = brotli.compress(raw, quality=11)
+        else:
+            packed = gzip.compress(raw, compresslevel=9, mtime=0)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if len(packed) > len(raw) * MIN_COMPRESSION_RATIO:
+            open(skip_marker, "wb").close()
+            return None
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(packed)
+        os.replace(tmp_path, target)
+        return target
+
+    def representation(self, full_path: str, digest: str, accept_encoding: str = "",
+                       ranged: bool = False) -> Tuple[str, Optional[str]]:
+        """
+        (archivo a servir, codificación o None) según Accept-Encoding. Con Range se sirve
+        siempre la representación sin comprimir (FileResponse resuelve los rangos).
+        """
+        if not ranged:
+            for encoding in ("br", "gzip"):
+                if encoding not in (accept_encoding or ""):
+                    continue
+                variant_path = self.compressed_variant(full_path, digest, encoding)
+                if variant_path:
+                    return variant_path, encoding
+        return full_path, None
+
+    def build(self) -> Dict[str, str]:
+        """Hashea todo /static, genera las variantes comprimidas y guarda el manifiesto."""
+        mapping = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                logical_path = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                digest = self.digest(logical_path)
+                if digest is None:
+                    continue
+                mapping[logical_path] = hashed_name(logical_path, digest)
+                for encoding in ("gzip", "br"):
+                    self.compressed_variant(full_path, digest, encoding)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": {p: list(e) for p, e in self._entries.items() if p in mapping}, "assets": mapping}, f)
+        os.replace(tmp_path, self.manifest_path)
+        return mapping
+
+
+def asset_etag(digest: str, encoding: Optional[str] = None) -> str:
+    """ETag de una representación: cada codificación tiene el suyo (son bytes distintos)."""
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara If-None-Match con el ETag enviado (comparación débil, como pide RFC 9110 para GET)."""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def parse_asset_path(asset_path: str) -> Optional[Tuple[str, str]]:
+    """x/y.<hash>.ext -> (ruta lógica x/y.ext, hash pedido). None si no tiene hash."""
+    directory, filename = os.path.split(asset_path)
+    match = _HASHED_NAME_RE.match(filename)
+    if not match:
+        return None
+    filename = match.group("stem") + (match.group("ext") or "")
+    return (f"{directory}/{filename}" if directory else filename), match.group("digest")
+
+
+def logical_url(url: Optional[str]) -> Optional[str]:
+    """Inverso de AssetManifest.url: /assets/x/y.<hash>.ext -> /static/x/y.ext."""
+    if not url or not url.startswith(ASSETS_URL + "/"):
+        return url
+    parsed = parse_asset_path(url[len(ASSETS_URL) + 1:])
+    return f"{STATIC_URL}/{parsed[0]}" if parsed else url
+
+
+def rewrite_product_urls(record: dict, to_url) -> dict:
+    """Aplica to_url a todas las rutas de archivos de un producto serializado (images, ficha, variantes)."""
+    record = copy.deepcopy(record)
+    if record.get("images"):
+        record["images"] = [to_url(path) for path in record["images"]]
+    if record.get("image"):
+        record["image"] = to_url(record["image"])
+    if record.get("ficha_tecnica"):
+        record["ficha_tecnica"] = to_url(record["ficha_tecnica"])
+    for entry in record.get("image_variants") or []:
+        entry["src"] = to_url(entry.get("src"))
+        for variant in (entry.get("variants") or {}).values():
+            old_url = variant.get("url")
+            variant["url"] = to_url(old_url)
+            if entry.get("srcset") and old_url:
+                entry["srcset"] = entry["srcset"].replace(f"{old_url} ", f"{variant['url']} ")
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Generar manifiesto y variantes comprimidas")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        mapping = AssetManifest().build()
+        print(f"Manifiesto generado: {len(mapping)} archivos")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
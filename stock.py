@@ -0,0 +1,261 @@
+# stock.py
+import time
+import uuid
+import threading
+from typing import Dict, Optional
+from sqlalchemy import update, delete, case, func
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from models import Product, StockHold
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def sync_pack_stock(product: Product):
+    """
+    La columna pack_stock es la fuente de verdad; pack_info["pack_stock"] queda
+    como espejo para el frontend. Al crear/editar desde el admin se toma el valor del JSON.
+    """
+    if product.pack_info and "pack_stock" in product.pack_info:
+        try:
+            product.pack_stock = max(0, int(product.pack_info.get("pack_stock") or 0))
+        except (TypeError, ValueError):
+            product.pack_stock = 0
+    elif product.pack_stock is None:
+        product.pack_stock = 0
+
+
+def _pack_stock_value(pack_info) -> Optional[int]:
+    if not pack_info or "pack_stock" not in pack_info:
+        return None
+    try:
+        return max(0, int(pack_info.get("pack_stock") or 0))
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_pack_stock_edit(session: Session, product_id: int, submitted_pack_info, stored_pack_info,
+                          loaded_pack_stock: Optional[int] = None):
+    """
+    Aplica el stock de packs que manda el admin sin deshacer ventas hechas mientras
+    el formulario estaba abierto:
+
+    - Si el formulario trae el pack_stock con el que se cargó, se aplica la diferencia
+      (pack_stock_editado - pack_stock_cargado) sobre la columna, en el mismo UPDATE.
+    - Si no, solo se toma el valor editado cuando difiere del espejo guardado en
+      pack_info (el admin lo cambió); si es igual la columna no se toca.
+
+    Siempre reescribe el espejo pack_info["pack_stock"] desde la columna. Llamar después
+    de hacer flush del pack_info del formulario. No hace commit.
+    """
+    submitted = _pack_stock_value(submitted_pack_info)
+    new_pack_stock = Product.pack_stock
+    if submitted is not None:
+        if loaded_pack_stock is not None:
+            delta = submitted - int(loaded_pack_stock)
+            if delta:
+                new_pack_stock = func.max(0, Product.pack_stock + delta)
+        elif submitted != _pack_stock_value(stored_pack_info):
+            new_pack_stock = submitted
+    session.exec(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(
+            pack_stock=new_pack_stock,
+            pack_info=func.json_set(Product.pack_info, "$.pack_stock", new_pack_stock),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _qty_case(quantities: Dict[int, int], product=Product):
+    return case(quantities, value=product.id, else_=0)
+
+
+def _cart_fits(quantities: Dict[int, int], respect_holds: bool):
+    """
+    Condición del WHERE que vale solo si todos los productos del carrito alcanzan.
+    Es una subconsulta no correlacionada (sobre un alias de product): SQLite la evalúa
+    una vez, antes de modificar filas, así que el UPDATE cambia todas o ninguna.
+    """
+    p = aliased(Product)
+    available = p.pack_stock - p.pack_reserved if respect_holds else p.pack_stock
+    fitting = (
+        select(func.count())
+        .select_from(p)
+        .where(p.id.in_(list(quantities)), available >= _qty_case(quantities, p))
+        .scalar_subquery()
+    )
+    return fitting == len(quantities)
+
+
+def decrement_packs(session: Session, quantities: Dict[int, int], strict: bool = True, respect_holds: bool = False) -> int:
+    """
+    Descuenta packs de todo un carrito con un único UPDATE condicional:
+
+        UPDATE product SET pack_stock = pack_stock - CASE id WHEN ... END, ...
+        WHERE id IN (...) AND (SELECT COUNT(*) ... WHERE pack_stock >= CASE id WHEN ... END) = N
+
+    Con strict=True, si algún producto no alcanza, no se descuenta nada y se lanza
+    InsufficientStock (el UPDATE es atómico, no hay read-modify-write en Python).
+    Ante el faltante no se hace rollback: lo que el llamador ya hizo en la transacción
+    (p. ej. liberar reservas en convert_holds) sigue pendiente de su commit o rollback.
+    Con strict=False (pago ya cobrado) se descuenta lo que haya, sin bajar de cero.
+    Con respect_holds=True además no se toca stock retenido por reservas de otros.
+    No hace commit: el llamador decide la transacción.
+    """
+    quantities = {int(k): int(v) for k, v in quantities.items() if int(v) > 0}
+    if not quantities:
+        return 0
+
+    qty = _qty_case(quantities)
+    if strict:
+        new_pack_stock = Product.pack_stock - qty
+    else:
+        new_pack_stock = func.max(0, Product.pack_stock - qty)
+
+    statement = (
+        update(Product)
+        .where(Product.id.in_(list(quantities)))
+        .values(
+            pack_stock=new_pack_stock,
+            stock=func.max(0, Product.stock - qty),
+            # Espejo en el JSON dentro de la misma sentencia
+            pack_info=func.json_set(Product.pack_info, "$.pack_stock", new_pack_stock),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if strict:
+        statement = statement.where(_cart_fits(quantities, respect_holds))
+
+    result = session.exec(statement)
+    if strict and result.rowcount != len(quantities):
+        raise InsufficientStock("Stock insuficiente para uno o más productos del carrito.")
+    return result.rowcount
+
+
+def decrement_units(session: Session, quantities: Dict[int, int]) -> int:
+    """Descuenta unidades sueltas (columna stock) sin tocar los packs."""
+    quantities = {int(k): int(v) for k, v in quantities.items() if int(v) > 0}
+    if not quantities:
+        return 0
+    result = session.exec(
+        update(Product)
+        .where(Product.id.in_(list(quantities)))
+        .values(stock=func.max(0, Product.stock - _qty_case(quantities)))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+# --- RESERVAS DE STOCK (HOLDS) ---
+# El contador pack_reserved vive en la fila del producto, así que chequear
+# disponibilidad (pack_stock - pack_reserved) cuesta lo mismo con 1 o 1000 reservas
+# activas y es consistente entre todos los workers.
+
+def new_hold_reference(prefix: str = "HOLD") -> str:
+    return f"{prefix}-{uuid.uuid4().hex}"
+
+
+def place_holds(session: Session, reference: str, quantities: Dict[int, int], ttl: float):
+    """
+    Retiene stock para un carrito con un único UPDATE condicional sobre pack_reserved.
+    Todo o nada: si algún producto no tiene disponible suficiente, no retiene nada y
+    lanza InsufficientStock. No hace commit ni rollback.
+    """
+    quantities = {int(k): int(v) for k, v in quantities.items() if int(v) > 0}
+    if not quantities:
+        return
+    qty = _qty_case(quantities)
+    result = session.exec(
+        update(Product)
+        .where(Product.id.in_(list(quantities)))
+        .where(_cart_fits(quantities, respect_holds=True))
+        .values(pack_reserved=Product.pack_reserved + qty)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        raise InsufficientStock("Stock insuficiente para uno o más productos del carrito.")
+
+    expires_at = time.time() + ttl
+    for product_id, q in quantities.items():
+        session.add(StockHold(reference=reference, product_id=product_id, qty=q, expires_at=expires_at))
+
+
+def _release(session: Session, condition) -> Dict[int, int]:
+    # DELETE ... RETURNING: solo quien borra la fila devuelve su cantidad,
+    # así el barrido y una conversión simultánea no liberan dos veces
+    rows = session.exec(delete(StockHold).where(condition).returning(StockHold.product_id, StockHold.qty)).all()
+    released: Dict[int, int] = {}
+    for product_id, q in rows:
+        released[product_id] = released.get(product_id, 0) + q
+    if released:
+        session.exec(
+            update(Product)
+            .where(Product.id.in_(list(released)))
+            .values(pack_reserved=func.max(0, Product.pack_reserved - _qty_case(released)))
+            .execution_options(synchronize_session=False)
+        )
+    return released
+
+
+def release_holds(session: Session, reference: str) -> Dict[int, int]:
+    """Libera las reservas de una referencia (pago rechazado, error, etc.). No hace commit."""
+    return _release(session, StockHold.reference == reference)
+
+
+def convert_holds(session: Session, reference: Optional[str], quantities: Dict[int, int]) -> bool:
+    """
+    Convierte reservas en venta: libera el stock retenido y lo descuenta en la misma
+    transacción. Devuelve False si no había reservas vigentes (vencieron o nunca
+    existieron); en ese caso el llamador decide cómo descontar.
+    """
+    if not reference:
+        return False
+    released = release_holds(session, reference)
+    if not released:
+        return False
+    # El stock estaba retenido para esta referencia: alcanza aunque haya otras reservas
+    decrement_packs(session, quantities, strict=True)
+    return True
+
+
+def sweep_expired_holds(engine, now: Optional[float] = None) -> Dict[int, int]:
+    with Session(engine) as session:
+        released = _release(session, StockHold.expires_at <= (now or time.time()))
+        session.commit()
+    return released
+
+
+class HoldSweeper:
+    """Hilo que libera periódicamente las reservas vencidas."""
+
+    def __init__(self, engine, interval: float = 30.0):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hold-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                released = sweep_expired_holds(self.engine)
+                if released:
+                    print(f"Reservas vencidas liberadas: {released}")
+            except Exception as e:
+                print(f"Error liberando reservas vencidas: {e}")
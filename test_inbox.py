@@ -0,0 +1,39 @@
+import pytest
+from sqlmodel import Session, SQLModel
+
+from database import make_sqlite_engine
+from models import WebhookNotification
+from inbox import WebhookInboxWorker, enqueue_notification
+
+
+@pytest.fixture
+def inbox_engine(tmp_path):
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'inbox.db'}")
+    SQLModel.metadata.create_all(engine, tables=[WebhookNotification.__table__])
+    yield engine
+    engine.dispose()
+
+
+def test_notification_during_processing_is_requeued(inbox_engine):
+    calls = []
+
+    def handler(payment_id):
+        calls.append(payment_id)
+        if len(calls) == 1:
+            # MP avisa de nuevo (ej. pending -> approved) mientras se procesa el primer aviso
+            enqueue_notification(inbox_engine, payment_id)
+
+    worker = WebhookInboxWorker(inbox_engine, handler)
+    enqueue_notification(inbox_engine, "123")
+
+    assert worker.process_due() == 1
+    with Session(inbox_engine) as session:
+        notification = session.get(WebhookNotification, "123")
+        assert notification.status == "pending"
+        assert notification.attempts == 0
+
+    # El segundo aviso se procesa y recién ahí la notificación se cierra
+    assert worker.process_due() == 1
+    assert calls == ["123", "123"]
+    with Session(inbox_engine) as session:
+        assert session.get(WebhookNotification, "123").status == "done"
@@ -0,0 +1,123 @@
+import time
+import socket
+import smtplib
+import pytest
+from email.mime.text import MIMEText
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+
+from mailer import SMTPDispatcher
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_message(i):
+    msg = MIMEText(f"Mensaje {i}")
+    msg["From"] = "tienda@example.com"
+    msg["To"] = f"cliente{i}@example.com"
+    msg["Subject"] = f"Prueba {i}"
+    return msg
+
+
+def test_dispatcher_reuses_single_connection(smtp_server):
+    controller, handler = smtp_server
+    dispatcher = SMTPDispatcher(
+        host=controller.hostname, port=controller.port,
+        username="", password="", use_starttls=False,
+    )
+    try:
+        futures = [dispatcher.submit(make_message(i)) for i in range(10)]
+        for f in futures:
+            f.result(timeout=10)
+    finally:
+        dispatcher.stop()
+
+    assert len(handler.messages) == 10
+    # Todos los mensajes viajaron por la misma sesión SMTP
+    assert len(handler.sessions) == 1
+
+
+def test_dispatcher_reconnects_after_server_restart():
+    handler = RecordingHandler()
+    port = free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    dispatcher = SMTPDispatcher(
+        host="127.0.0.1", port=port, username="", password="", use_starttls=False,
+    )
+    try:
+        dispatcher.send(make_message(1))
+        # Reiniciamos el servidor: la conexión persistente queda rota
+        controller.stop()
+        time.sleep(0.1)
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        dispatcher.send(make_message(2))
+    finally:
+        dispatcher.stop()
+        controller.stop()
+
+    assert len(handler.messages) == 2
+    assert len(handler.sessions) == 2
+
+
+class RefusingHandler(RecordingHandler):
+    def __init__(self, refused):
+        super().__init__()
+        self.refused = refused
+        self.rcpt_attempts = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.sessions.add(id(session))
+        if address == self.refused:
+            self.rcpt_attempts += 1
+            return "550 No existe el usuario"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+
+def test_refused_recipient_fails_without_reconnecting():
+    handler = RefusingHandler("cliente1@example.com")
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    dispatcher = SMTPDispatcher(
+        host=controller.hostname, port=controller.port,
+        username="", password="", use_starttls=False,
+    )
+    try:
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            dispatcher.send(make_message(1))
+        dispatcher.send(make_message(2))
+    finally:
+        dispatcher.stop()
+        controller.stop()
+
+    # El rechazo no se reintenta y la conexión sigue sirviendo para el mensaje siguiente
+    assert handler.rcpt_attempts == 1
+    assert len(handler.messages) == 1
+    assert len(handler.sessions) == 1
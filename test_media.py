@@ -0,0 +1,51 @@
+import os
+import time
+import pytest
+from sqlmodel import Session, SQLModel
+
+from database import make_sqlite_engine
+from models import MediaObject, Product
+from media import collect_garbage
+
+DIGEST = "0123456789abcdef0123456789abcdef"
+
+
+@pytest.fixture
+def media_session(tmp_path, monkeypatch):
+    # Las carpetas de media son relativas al cwd (static/products, static/fichas)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/products")
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'media.db'}")
+    SQLModel.metadata.create_all(engine, tables=[Product.__table__, MediaObject.__table__])
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def write_old_file(path):
+    with open(path, "wb") as f:
+        f.write(b"x")
+    old = time.time() - 7 * 24 * 3600
+    os.utime(path, (old, old))
+
+
+def test_gc_keeps_original_kept_by_backfill(media_session):
+    # Estado después de `images.py backfill`: el producto apunta a la variante y el PNG original queda en disco
+    detail = f"/static/products/{DIGEST}-detail.webp"
+    media_session.add(Product(
+        name="Vino", description="", price=100.0, category="Tinto", long_description="",
+        stock=1, images=[detail], additional_info={}, pack_info={},
+    ))
+    media_session.commit()
+    write_old_file(f"static/products/{DIGEST}-detail.webp")
+    write_old_file("static/products/foto-vieja.png")
+
+    summary = collect_garbage(media_session, grace=0)
+    assert summary["removed_paths"] == []
+    assert summary["unregistered"] == 1
+    assert os.path.exists("static/products/foto-vieja.png")
+
+    summary = collect_garbage(media_session, grace=0, include_unregistered=True)
+    assert summary["removed_paths"] == ["/static/products/foto-vieja.png"]
+    assert not os.path.exists("static/products/foto-vieja.png")
+    assert os.path.exists(f"static/products/{DIGEST}-detail.webp")
@@ -0,0 +1,36 @@
+import os
+import json
+import subprocess
+import sys
+
+from metrics import MetricsRegistry, load_snapshots, render
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_snapshots_of_dead_workers_are_ignored_and_removed(tmp_path):
+    registry = MetricsRegistry()
+    registry.inc("http_requests_total", route="/api/products")
+    registry.flush(str(tmp_path))
+
+    # Foto de un worker que murió sin borrarla (gunicorn lo recicló, OOM, etc.)
+    pid = dead_pid()
+    dead = registry.snapshot()
+    dead["pid"] = pid
+    (tmp_path / f"{pid}.json").write_text(json.dumps(dead))
+    (tmp_path / f"{pid}.json.tmp").write_text("{")
+
+    snapshots = load_snapshots(str(tmp_path))
+    assert [s["pid"] for s in snapshots] == [os.getpid()]
+    assert sorted(os.listdir(tmp_path)) == [f"{os.getpid()}.json"]
+    assert 'http_requests_total{route="/api/products"} 1' in render(snapshots)
+
+    # render tampoco suma fotos de procesos muertos aunque se las pasen
+    assert "http_requests_total" not in render([dead])
+
+    registry.remove_snapshot(str(tmp_path))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,24 @@
+from static_assets import AssetManifest, asset_etag, etag_matches
+
+
+def test_conditional_request_matches_compressed_etag(tmp_path):
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "estilos.css").write_text("body { color: black; }\n" * 200)
+    manifest = AssetManifest(root=str(tmp_path / "static"), cache_dir=str(tmp_path / "cache"))
+    digest = manifest.digest("estilos.css")
+    full_path = manifest.path_for("estilos.css")
+
+    file_path, encoding = manifest.representation(full_path, digest, "gzip, deflate")
+    assert encoding == "gzip" and file_path.endswith(".gz")
+    sent = asset_etag(digest, encoding)
+    assert sent == f'"{digest}-gzip"'
+
+    # El navegador revalida con el ETag que recibió de la variante comprimida
+    assert etag_matches(sent, sent)
+    assert etag_matches(f'"otro", W/{sent}', sent)
+    # El ETag de otra representación no sirve para un 304
+    assert not etag_matches(f'"{digest}"', sent)
+    assert not etag_matches(sent, asset_etag(digest))
+
+    # Con Range siempre se sirve el archivo sin comprimir
+    assert manifest.representation(full_path, digest, "gzip", ranged=True) == (full_path, None)
@@ -0,0 +1,200 @@
+import time
+import threading
+import pytest
+from sqlmodel import Session, SQLModel, select
+
+from database import make_sqlite_engine
+from models import Product, StockHold
+from stock import (
+    decrement_packs, place_holds, release_holds, convert_holds, sweep_expired_holds, apply_pack_stock_edit,
+    InsufficientStock,
+)
+
+
+@pytest.fixture
+def stock_engine(tmp_path):
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'stock.db'}")
+    SQLModel.metadata.create_all(engine, tables=[Product.__table__, StockHold.__table__])
+    with Session(engine) as session:
+        for i, pack_stock in enumerate([40, 40, 1000]):
+            session.add(Product(
+                name=f"Vino {i}", description="", price=100.0, category="Tinto", long_description="",
+                stock=pack_stock, images=[], additional_info={},
+                pack_info={"pack_name": f"Caja {i}", "pack_price": 100.0, "pack_stock": pack_stock},
+                pack_stock=pack_stock,
+            ))
+        session.commit()
+    yield engine
+    engine.dispose()
+
+
+def approve_concurrently(engine, carts, threads=16):
+    """Dispara aprobaciones en paralelo, cada una con su propia sesión, y cuenta resultados."""
+    results = {"ok": 0, "rejected": 0, "errors": []}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+    pending = list(carts)
+
+    def worker():
+        start.wait()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                cart = pending.pop()
+            try:
+                with Session(engine) as session:
+                    decrement_packs(session, cart, strict=True)
+                    session.commit()
+                outcome = "ok"
+            except InsufficientStock:
+                outcome = "rejected"
+            except Exception as e:
+                with lock:
+                    results["errors"].append(e)
+                continue
+            with lock:
+                results[outcome] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+def pack_stocks(engine):
+    with Session(engine) as session:
+        return {p.id: (p.pack_stock, p.pack_info["pack_stock"]) for p in session.exec(select(Product))}
+
+
+def test_concurrent_approvals_never_oversell(stock_engine):
+    # 30 carritos de 3 cajas de cada uno de los productos 1 y 2: solo alcanzan 13
+    carts = [{1: 3, 2: 3} for _ in range(30)]
+    results = approve_concurrently(stock_engine, carts)
+
+    assert results["errors"] == []
+    assert results["ok"] == 13
+    assert results["rejected"] == 17
+    stocks = pack_stocks(stock_engine)
+    assert stocks[1] == (1, 1)
+    assert stocks[2] == (1, 1)
+
+
+def test_concurrent_decrements_are_not_lost(stock_engine):
+    carts = [{3: 1} for _ in range(200)]
+    results = approve_concurrently(stock_engine, carts)
+
+    assert results["errors"] == []
+    assert results["ok"] == 200
+    # Sin lost updates: 1000 - 200, y el espejo en pack_info coincide
+    assert pack_stocks(stock_engine)[3] == (800, 800)
+
+
+def test_cart_is_all_or_nothing(stock_engine):
+    with Session(stock_engine) as session:
+        with pytest.raises(InsufficientStock):
+            decrement_packs(session, {1: 5, 2: 41}, strict=True)
+        # Sin rollback interno: aunque el llamador haga commit, no se descontó nada
+        session.commit()
+    assert pack_stocks(stock_engine)[1] == (40, 40)
+
+
+
+def reserved(engine):
+    with Session(engine) as session:
+        products = {p.id: p.pack_reserved for p in session.exec(select(Product))}
+        holds = session.exec(select(StockHold)).all()
+        return products, len(holds)
+
+
+def test_place_and_release_holds(stock_engine):
+    with Session(stock_engine) as session:
+        place_holds(session, "HOLD-1", {1: 30, 2: 5}, ttl=60)
+        session.commit()
+    assert reserved(stock_engine) == ({1: 30, 2: 5, 3: 0}, 2)
+
+    # El disponible descuenta lo retenido: 40 - 30 no alcanza para 20, y no se retiene nada
+    with Session(stock_engine) as session:
+        with pytest.raises(InsufficientStock):
+            place_holds(session, "HOLD-2", {1: 20, 2: 1}, ttl=60)
+        session.commit()
+    assert reserved(stock_engine) == ({1: 30, 2: 5, 3: 0}, 2)
+
+    with Session(stock_engine) as session:
+        assert release_holds(session, "HOLD-1") == {1: 30, 2: 5}
+        session.commit()
+    assert reserved(stock_engine) == ({1: 0, 2: 0, 3: 0}, 0)
+
+
+def test_convert_holds_into_sale(stock_engine):
+    with Session(stock_engine) as session:
+        place_holds(session, "HOLD-1", {1: 10}, ttl=60)
+        session.commit()
+    with Session(stock_engine) as session:
+        assert convert_holds(session, "HOLD-1", {1: 10})
+        session.commit()
+    assert reserved(stock_engine) == ({1: 0, 2: 0, 3: 0}, 0)
+    assert pack_stocks(stock_engine)[1] == (30, 30)
+
+    # Sin reservas vigentes el llamador decide cómo descontar
+    with Session(stock_engine) as session:
+        assert not convert_holds(session, "HOLD-1", {1: 10})
+        assert not convert_holds(session, None, {1: 10})
+
+
+def test_sweep_releases_only_expired_holds(stock_engine):
+    with Session(stock_engine) as session:
+        place_holds(session, "VIEJA", {1: 4}, ttl=10)
+        place_holds(session, "NUEVA", {2: 6}, ttl=1000)
+        session.commit()
+    assert sweep_expired_holds(stock_engine, now=time.time() + 100) == {1: 4}
+    assert reserved(stock_engine) == ({1: 0, 2: 6, 3: 0}, 1)
+
+
+def test_failed_conversion_keeps_hold_release(stock_engine):
+    with Session(stock_engine) as session:
+        place_holds(session, "HOLD-1", {1: 10}, ttl=60)
+        session.commit()
+    # El stock bajó por debajo de lo retenido (p. ej. corrección manual desde el admin)
+    with Session(stock_engine) as session:
+        session.get(Product, 1).pack_stock = 5
+        session.commit()
+
+    # Como en el webhook: si la conversión no alcanza, se descuenta lo que haya
+    with Session(stock_engine) as session:
+        with pytest.raises(InsufficientStock):
+            convert_holds(session, "HOLD-1", {1: 10})
+        decrement_packs(session, {1: 10}, strict=False)
+        session.commit()
+
+    assert reserved(stock_engine) == ({1: 0, 2: 0, 3: 0}, 0)
+    assert pack_stocks(stock_engine)[1] == (0, 0)
+
+
+def test_admin_edit_does_not_undo_sales(stock_engine):
+    # El admin abrió el formulario con 40 y mientras tanto se vendieron 2
+    with Session(stock_engine) as session:
+        decrement_packs(session, {1: 2})
+        session.commit()
+
+    # Guarda sin tocar el stock: quedan los 38
+    with Session(stock_engine) as session:
+        apply_pack_stock_edit(session, 1, {"pack_stock": 40}, {"pack_stock": 38}, loaded_pack_stock=40)
+        session.commit()
+    assert pack_stocks(stock_engine)[1] == (38, 38)
+
+    # Suma 10 sobre lo que vio: se aplica como diferencia
+    with Session(stock_engine) as session:
+        apply_pack_stock_edit(session, 1, {"pack_stock": 50}, {"pack_stock": 38}, loaded_pack_stock=40)
+        session.commit()
+    assert pack_stocks(stock_engine)[1] == (48, 48)
+
+    # Sin el valor cargado: solo cuenta si difiere del espejo guardado
+    with Session(stock_engine) as session:
+        apply_pack_stock_edit(session, 1, {"pack_stock": 48}, {"pack_stock": 48})
+        apply_pack_stock_edit(session, 2, {"pack_stock": 5}, {"pack_stock": 40})
+        session.commit()
+    assert pack_stocks(stock_engine)[1] == (48, 48)
+    assert pack_stocks(stock_engine)[2] == (5, 5)
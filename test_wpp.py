@@ -1,4 +1,4 @@
-from notifications import send_whatsapp_admin_alert
+from notifications import deliver_whatsapp_alert
 
 customer_data = {
     "name": "Test",
@@ -14,4 +14,4 @@ items = [
 total_paid = 15000
 
 print("Probando envío de WhatsApp desde el servidor...")
-send_whatsapp_admin_alert(customer_data, items, total_paid)
+deliver_whatsapp_alert({"customer_data": customer_data, "items": items, "total_paid": total_paid})
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Los módulos de la app viven en la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlmodel import SQLModel
+
+ADMIN_TOKEN = "admin-tests"
+
+
+@pytest.fixture
+def app_main(tmp_path, monkeypatch):
+    """
+    Módulo main con la base de compras en tmp_path.
+    Las variables de entorno tienen que estar antes del import: main valida el token de MP al cargarse.
+    """
+    monkeypatch.setenv("MERCADOPAGO_ACCESS_TOKEN", "TEST-tests")
+    monkeypatch.setenv("ADMIN_PASSWORD", ADMIN_TOKEN)
+    import main
+    from database import make_sqlite_engine, make_async_sqlite_engine
+    from models import PurchaseRecord
+
+    path = tmp_path / "compras.db"
+    engine_compras = make_sqlite_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine_compras, tables=[PurchaseRecord.__table__])
+    async_engine_compras = make_async_sqlite_engine(f"sqlite+aiosqlite:///{path}")
+    monkeypatch.setattr(main, "engine_compras", engine_compras)
+    monkeypatch.setattr(main, "async_engine_compras", async_engine_compras)
+    yield main
+    engine_compras.dispose()
+    async_engine_compras.sync_engine.dispose()
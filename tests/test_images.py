@@ -0,0 +1,45 @@
+import os
+import pytest
+from PIL import Image
+from sqlmodel import Session, SQLModel, select
+
+from database import make_sqlite_engine
+from models import MediaObject, Product
+from images import backfill
+from media import collect_garbage
+
+
+@pytest.fixture
+def media_engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/products")
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'media.db'}")
+    SQLModel.metadata.create_all(engine, tables=[Product.__table__, MediaObject.__table__])
+    yield engine
+    engine.dispose()
+
+
+def test_backfill_registers_variants(media_engine):
+    Image.new("RGB", (800, 1200), (120, 20, 40)).save("static/products/botella.png")
+    with Session(media_engine) as session:
+        session.add(Product(
+            name="Vino", description="", price=100.0, category="Tinto", long_description="",
+            stock=1, images=["/static/products/botella.png"], additional_info={}, pack_info={},
+        ))
+        session.commit()
+
+    summary = backfill(db_engine=media_engine)
+    assert summary["converted"] == 1
+
+    with Session(media_engine) as session:
+        [product] = session.exec(select(Product)).all()
+        [media] = session.exec(select(MediaObject)).all()
+        assert media.path == product.images[0]
+        assert media.kind == "image"
+        assert media.ref_count == 1
+        assert len(media.sha256) == 64
+
+        # El GC ve las variantes como usadas y conserva el original sin registrar
+        summary = collect_garbage(session, grace=0)
+    assert summary["removed_paths"] == []
+    assert os.path.exists("static/products/botella.png")
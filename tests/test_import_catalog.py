@@ -0,0 +1,120 @@
+import pandas as pd
+import pytest
+from sqlmodel import Session, SQLModel, select
+
+import import_catalog
+from database import make_sqlite_engine
+from models import MediaObject, Product
+
+HEADER = [
+    "Marca", "Composición", "Cosecha", "Región", "Elevación", "Presentación", "Alcohol", "Acidez", "pH",
+    "Método de cosecha", "Vinificación", "Notas de cata", "Servicio ideal", "Stock", "Peso caja",
+    "Medidas caja", "Precio",
+]
+
+
+def sheet_row(marca, composicion, stock, price, cosecha=2021):
+    row = dict.fromkeys(HEADER, "")
+    row.update({"Marca": marca, "Composición": composicion, "Cosecha": cosecha, "Stock": stock, "Precio": price})
+    return row
+
+
+@pytest.fixture
+def catalog_engine(tmp_path, monkeypatch):
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'tienda.db'}")
+    monkeypatch.setattr(import_catalog, "engine", engine)
+    monkeypatch.setattr(
+        import_catalog, "create_db_and_tables",
+        lambda: SQLModel.metadata.create_all(engine, tables=[Product.__table__, MediaObject.__table__]),
+    )
+    yield engine
+    engine.dispose()
+
+
+def write_csv(tmp_path, rows):
+    path = tmp_path / "catalogo.csv"
+    pd.DataFrame(rows, columns=HEADER).to_csv(path, index=False)
+    return str(path)
+
+
+def products(engine):
+    with Session(engine) as session:
+        return session.exec(select(Product).order_by(Product.id)).all()
+
+
+def test_transform_chunk_maps_columns_and_row_numbers():
+    df = pd.DataFrame([sheet_row("Bodega Alta", "Malbec", 6.0, 1500), sheet_row("", "", "", ""),
+                       sheet_row("Bodega Baja", "", "x", "")], columns=HEADER)
+    rows = import_catalog.transform_chunk(df, import_catalog.resolve_columns(list(df.columns)))
+
+    # La fila vacía se descarta pero la numeración sigue la de la planilla
+    assert [number for number, _ in rows] == [2, 4]
+    first, second = rows[0][1], rows[1][1]
+    assert (first["name"], first["category"], first["cosecha"]) == ("Bodega Alta - Malbec", "Bodega Alta", "2021")
+    assert (first["stock"], first["pack_stock"], first["price"]) == (6, 6, 1500.0)
+    assert first["pack_info"] == {"pack_name": import_catalog.DEFAULT_PACK_NAME, "pack_price": 1500.0, "pack_stock": 6}
+    assert (second["name"], second["stock"], second["price"]) == ("Bodega Baja", 0, 0.0)
+
+
+def test_missing_columns_are_reported():
+    with pytest.raises(ValueError, match="Precio"):
+        import_catalog.resolve_columns([h for h in HEADER if h != "Precio"])
+
+
+def test_csv_import_in_chunks(tmp_path, catalog_engine):
+    rows = [sheet_row("Bodega Alta", f"Varietal {i}", i, 1000 + i) for i in range(5)]
+    summary = import_catalog.import_catalog(write_csv(tmp_path, rows), chunksize=2)
+
+    assert (summary["inserted"], summary["errors"], summary["dry_run"]) == (5, [], False)
+    assert [p.name for p in products(catalog_engine)] == [f"Bodega Alta - Varietal {i}" for i in range(5)]
+
+
+def test_upsert_keeps_admin_fields(tmp_path, catalog_engine):
+    path = write_csv(tmp_path, [sheet_row("Bodega Alta", "Malbec", 6, 1500)])
+    import_catalog.import_catalog(path)
+    with Session(catalog_engine) as session:
+        product = session.exec(select(Product)).one()
+        product.description = "Cargada desde el admin"
+        product.images = ["/static/products/a.webp"]
+        product.pack_info = {**product.pack_info, "pack_name": "Caja x12"}
+        session.add(product)
+        session.commit()
+
+    path = write_csv(tmp_path, [sheet_row("Bodega Alta", "Malbec", 8, 1800)])
+    summary = import_catalog.import_catalog(path, mode="upsert")
+
+    assert (summary["inserted"], summary["updated"]) == (0, 1)
+    [product] = products(catalog_engine)
+    assert (product.stock, product.price, product.pack_stock) == (8, 1800.0, 8)
+    assert product.description == "Cargada desde el admin"
+    assert product.images == ["/static/products/a.webp"]
+    assert product.pack_info == {"pack_name": "Caja x12", "pack_price": 1800.0, "pack_stock": 8}
+
+
+def test_dry_run_writes_nothing(tmp_path, catalog_engine):
+    summary = import_catalog.import_catalog(write_csv(tmp_path, [sheet_row("Bodega Alta", "Malbec", 6, 1500)]), dry_run=True)
+
+    assert (summary["inserted"], summary["dry_run"]) == (1, True)
+    assert products(catalog_engine) == []
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError, match="Formato no soportado"):
+        next(import_catalog.read_chunks(str(tmp_path / "catalogo.ods"), 10))
+
+
+def test_xlsx_rows_keep_sheet_numbers(tmp_path):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    sheet.append(list(sheet_row("Bodega Alta", "Malbec", 6, 1500).values()))
+    sheet.append([None] * len(HEADER))
+    sheet.append(list(sheet_row("Bodega Alta", "Syrah", 3, 1200).values()))
+    path = tmp_path / "data-vinos.xlsx"
+    workbook.save(path)
+
+    chunks = list(import_catalog.read_chunks(str(path), chunksize=1))
+    mapping = import_catalog.resolve_columns(list(chunks[0].columns))
+    rows = [row for df in chunks for row in import_catalog.transform_chunk(df, mapping)]
+    assert [(number, data["name"]) for number, data in rows] == [(2, "Bodega Alta - Malbec"), (4, "Bodega Alta - Syrah")]
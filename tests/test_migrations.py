@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+import migrations
+import models
+from migrations import Migration, MigrationError, current_version, migrate, migrate_all, migration_lock
+
+# Columnas que antes agregaba el arranque con ALTER TABLE (migración 2)
+ADDED_COLUMNS = ("distincion", "ficha_tecnica", "pack_stock", "pack_reserved", "image_variants")
+
+
+@pytest.fixture(autouse=True)
+def lock_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrations, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+def versions(db_path):
+    with closing(sqlite3.connect(db_path)) as conn:
+        return [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+
+
+def counting_migrations(calls):
+    def step(conn):
+        calls.append(1)
+        conn.execute("CREATE TABLE IF NOT EXISTS demo (id INTEGER PRIMARY KEY)")
+    return [Migration(1, "Tabla demo", step)]
+
+
+def test_fresh_databases_migrate_once(tmp_path, monkeypatch):
+    tienda, compras = str(tmp_path / "tienda.db"), str(tmp_path / "compras.db")
+    applied = migrate_all(tienda, compras)
+
+    assert applied == {
+        "tienda": [m.version for m in migrations.TIENDA_MIGRATIONS],
+        "compras": [m.version for m in migrations.COMPRAS_MIGRATIONS],
+    }
+    assert versions(tienda) == applied["tienda"]
+
+    # Ya al día: ni siquiera se toma el lock
+    def no_lock(*args, **kwargs):
+        raise AssertionError("no debería tomar el lock")
+    monkeypatch.setattr(migrations, "migration_lock", no_lock)
+    assert migrate_all(tienda, compras) == {"tienda": [], "compras": []}
+
+
+def test_legacy_database_gets_pack_stock_column(tmp_path):
+    tienda = str(tmp_path / "tienda.db")
+    with closing(sqlite3.connect(tienda)) as conn:
+        # Tabla de antes de las migraciones: el stock de packs solo vivía en el JSON
+        columns = [c.name for c in models.Product.__table__.columns if c.name not in ("id", *ADDED_COLUMNS)]
+        conn.execute(f"CREATE TABLE product (id INTEGER PRIMARY KEY, {', '.join(columns)})")
+        conn.execute("INSERT INTO product (id, name, pack_info) VALUES (1, 'Malbec', '{\"pack_stock\": 7}')")
+        conn.execute("INSERT INTO product (id, name, pack_info) VALUES (2, 'Syrah', NULL)")
+        conn.commit()
+
+    migrate(tienda, migrations.TIENDA_MIGRATIONS)
+
+    with closing(sqlite3.connect(tienda)) as conn:
+        rows = conn.execute("SELECT id, pack_stock, pack_reserved FROM product ORDER BY id").fetchall()
+    assert rows == [(1, 7, 0), (2, 0, 0)]
+
+
+def test_failed_migration_is_rolled_back(tmp_path):
+    db_path = str(tmp_path / "demo.db")
+    calls = []
+
+    def broken(conn):
+        conn.execute("CREATE TABLE other (id INTEGER PRIMARY KEY)")
+        raise RuntimeError("falla")
+
+    with pytest.raises(MigrationError, match="Falló la migración 2"):
+        migrate(db_path, counting_migrations(calls) + [Migration(2, "Rota", broken)])
+    assert versions(db_path) == [1]
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'other'").fetchone() is None
+
+    # Al corregirla se aplica solo la pendiente
+    assert migrate(db_path, counting_migrations(calls) + [Migration(2, "Corregida", lambda conn: None)]) == [2]
+    assert calls == [1]
+
+
+def test_versions_must_be_consecutive(tmp_path):
+    with pytest.raises(MigrationError):
+        migrate(str(tmp_path / "demo.db"), [Migration(1, "a", lambda c: None), Migration(3, "b", lambda c: None)])
+
+
+def test_waiting_worker_rereads_version(tmp_path):
+    db_path = str(tmp_path / "demo.db")
+    calls, result = [], {}
+    worker = threading.Thread(target=lambda: result.setdefault("applied", migrate(db_path, counting_migrations(calls))))
+
+    with migration_lock(db_path):
+        worker.start()
+        time.sleep(0.3)
+        assert worker.is_alive()  # Esperando el lock
+        # Mientras tanto otro worker termina de migrar
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.execute(migrations.SCHEMA_VERSION_DDL)
+            conn.execute("INSERT INTO schema_version VALUES (1, 'Tabla demo', datetime('now'))")
+            conn.commit()
+            assert current_version(conn) == 1
+    worker.join(5)
+
+    assert result["applied"] == []
+    assert calls == []
+
+
+def test_lock_timeout_raises(tmp_path):
+    db_path = str(tmp_path / "demo.db")
+    with migration_lock(db_path):
+        with pytest.raises(MigrationError, match="lock de migración"):
+            with migration_lock(db_path, timeout=0.2):
+                pass
+    # Liberado, se puede volver a tomar
+    with migration_lock(db_path, timeout=0.2):
+        pass
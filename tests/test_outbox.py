@@ -0,0 +1,60 @@
+import json
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlmodel import Session, SQLModel
+
+import outbox
+from database import make_sqlite_engine
+from models import OutboxMessage
+from outbox import OutboxWorker
+from whatsapp import WhatsAppAPIError
+
+
+@pytest.fixture
+def outbox_engine(tmp_path, monkeypatch):
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    SQLModel.metadata.create_all(engine, tables=[OutboxMessage.__table__])
+    # El outbox usa el engine de tienda.db del módulo: en los tests, una base temporal
+    monkeypatch.setattr(outbox, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def deliver_with(engine, error):
+    def handler(payload):
+        raise error
+
+    message_id = outbox.enqueue("email", {"to": "cliente@example.com"})
+    worker = OutboxWorker({"email": handler})
+    worker._executor = ThreadPoolExecutor(max_workers=1)
+    assert worker.drain_once() == 1
+    worker._executor.shutdown(wait=True)
+    with Session(engine) as session:
+        return session.get(OutboxMessage, message_id)
+
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPRecipientsRefused({"cliente@example.com": (550, b"No existe el usuario")}),
+    smtplib.SMTPSenderRefused(553, b"Remitente no permitido", "tienda@example.com"),
+    smtplib.SMTPDataError(554, b"Mensaje rechazado"),
+    WhatsAppAPIError(400, json.dumps({"error": "plantilla inexistente"})),
+])
+def test_permanent_errors_are_dead_lettered_at_once(outbox_engine, error):
+    message = deliver_with(outbox_engine, error)
+    assert message.status == "dead"
+    assert message.attempts == 1
+
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPServerDisconnected("Conexión cerrada"),
+    smtplib.SMTPRecipientsRefused({"cliente@example.com": (450, b"Buzon ocupado")}),
+    smtplib.SMTPAuthenticationError(535, b"Credenciales invalidas"),
+    WhatsAppAPIError(503, "Servicio no disponible"),
+])
+def test_transient_errors_are_retried(outbox_engine, error):
+    message = deliver_with(outbox_engine, error)
+    assert message.status == "pending"
+    assert message.attempts == 1
+    assert message.next_attempt_at > 0
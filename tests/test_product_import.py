@@ -0,0 +1,113 @@
+import json
+import pytest
+from sqlmodel import Session, SQLModel, select
+
+from database import make_sqlite_engine
+from models import Product
+from product_import import ProductImporter
+
+
+@pytest.fixture
+def import_engine(tmp_path):
+    engine = make_sqlite_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    SQLModel.metadata.create_all(engine, tables=[Product.__table__])
+    with Session(engine) as session:
+        session.add(Product(
+            name="Malbec Reserva", marca="Bodega Alta", description="Original", price=100.0, category="Tinto",
+            long_description="", stock=12, images=["/static/products/a.webp"], additional_info={},
+            pack_info={"pack_name": "Caja x6", "pack_price": 600.0, "pack_stock": 12}, pack_stock=12, pack_reserved=3,
+        ))
+        session.commit()
+    yield engine
+    engine.dispose()
+
+
+def source_row(**overrides):
+    row = {"name": "Malbec Reserva", "marca": "Bodega Alta", "price": 120.0, "category": "Tinto"}
+    row.update(overrides)
+    return row
+
+
+def products(engine):
+    with Session(engine) as session:
+        return session.exec(select(Product).order_by(Product.id)).all()
+
+
+def run_import(engine, rows, mode, **kwargs):
+    with Session(engine) as session:
+        importer = ProductImporter(session, mode=mode, **kwargs)
+        importer.add_rows(list(enumerate(rows, start=2)))
+        session.commit()
+    return importer.summary()
+
+
+def test_upsert_pack_info_without_pack_stock_keeps_stock(import_engine):
+    # Origen con pack_info (como texto JSON de SQLite) pero sin pack_stock
+    row = source_row(pack_info=json.dumps({"pack_name": "Caja x12", "pack_price": 1200.0}))
+    summary = run_import(import_engine, [row], "upsert")
+
+    assert summary["updated"] == 1
+    [product] = products(import_engine)
+    assert product.pack_stock == 12
+    assert product.pack_reserved == 3
+    assert product.pack_info == {"pack_name": "Caja x12", "pack_price": 1200.0, "pack_stock": 12}
+    # Columnas que el origen no trae quedan como estaban
+    assert product.images == ["/static/products/a.webp"]
+    assert product.description == "Original"
+
+
+def test_insert_always_creates(import_engine):
+    summary = run_import(import_engine, [source_row(), source_row(name="Cabernet")], "insert")
+
+    assert (summary["inserted"], summary["updated"], summary["skipped"]) == (2, 0, 0)
+    assert [p.name for p in products(import_engine)] == ["Malbec Reserva", "Malbec Reserva", "Cabernet"]
+
+
+def test_upsert_updates_existing_and_inserts_new(import_engine):
+    # La clave marca + nombre no distingue mayúsculas ni espacios
+    rows = [source_row(name=" malbec reserva ", marca="BODEGA ALTA", price=150.0), source_row(name="Cabernet")]
+    summary = run_import(import_engine, rows, "upsert")
+
+    assert (summary["inserted"], summary["updated"], summary["skipped"]) == (1, 1, 0)
+    existing, new = products(import_engine)
+    assert existing.price == 150.0
+    assert existing.stock == 12
+    assert existing.pack_reserved == 3
+    assert (new.name, new.marca, new.pack_reserved) == ("Cabernet", "Bodega Alta", 0)
+
+
+def test_upsert_update_columns_limits_changes(import_engine):
+    row = source_row(price=150.0, description="Nueva", pack_info={"pack_price": 900.0, "pack_name": "Otra"})
+    run_import(import_engine, [row], "upsert", update_columns=["price", "pack_info.pack_price"])
+
+    [product] = products(import_engine)
+    assert product.price == 150.0
+    assert product.description == "Original"
+    assert product.pack_info == {"pack_name": "Caja x6", "pack_price": 900.0, "pack_stock": 12}
+
+
+def test_skip_keeps_existing_and_dedupes_within_file(import_engine):
+    rows = [source_row(price=999.0), source_row(name="Bodega Alta - Cabernet", marca=None), source_row(name="Cabernet")]
+    summary = run_import(import_engine, rows, "skip")
+
+    # "Marca - Nombre" se divide antes de deduplicar: la tercera fila repite la segunda
+    assert (summary["inserted"], summary["updated"], summary["skipped"]) == (1, 0, 2)
+    existing, new = products(import_engine)
+    assert existing.price == 100.0
+    assert (new.marca, new.name) == ("Bodega Alta", "Cabernet")
+
+
+def test_invalid_rows_are_reported_without_aborting(import_engine):
+    rows = [source_row(name=""), source_row(name="Cabernet", price="caro"), source_row(name="Syrah")]
+    summary = run_import(import_engine, rows, "insert")
+
+    assert summary["inserted"] == 1
+    assert [error["row"] for error in summary["errors"]] == [2, 3]
+    assert summary["errors"][0]["error"] == "Falta el nombre del producto"
+    assert summary["errors"][1]["error"].startswith("price:")
+    assert [p.name for p in products(import_engine)] == ["Malbec Reserva", "Syrah"]
+
+
+def test_invalid_mode_is_rejected(import_engine):
+    with Session(import_engine) as session, pytest.raises(ValueError):
+        ProductImporter(session, mode="replace")
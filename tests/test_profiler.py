@@ -0,0 +1,45 @@
+import os
+import json
+import subprocess
+import sys
+
+import profiler
+from profiler import QueryProfiler, top_queries
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_record_does_no_io_until_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "SLOW_MS", 0)  # Toda consulta cuenta como lenta
+    qp = QueryProfiler()
+    qp.record("tienda", "SELECT * FROM product WHERE id IN (?, ?, ?)", (1, 2, 3), False, 0.01)
+    # El hook solo acumula en memoria: ni foto ni log todavía
+    assert os.listdir(tmp_path) == []
+
+    log_path = tmp_path / "slow.jsonl"
+    qp.write_log(str(log_path))
+    [line] = log_path.read_text().splitlines()
+    assert json.loads(line)["statement"] == "SELECT * FROM product WHERE id IN (?, ...)"
+
+
+def test_top_queries_ignores_and_removes_dead_workers(tmp_path):
+    qp = QueryProfiler()
+    qp.record("tienda", "SELECT * FROM product", (), False, 0.002)
+    qp.flush(str(tmp_path))
+
+    pid = dead_pid()
+    dead = qp.snapshot()
+    dead["pid"] = pid
+    (tmp_path / f"{pid}.json").write_text(json.dumps(dead))
+
+    result = top_queries(directory=str(tmp_path))
+    assert result["workers"] == 1
+    assert [q["count"] for q in result["queries"]] == [1]
+    assert sorted(os.listdir(tmp_path)) == [f"{os.getpid()}.json"]
+
+    qp.stop(str(tmp_path))
+    assert os.listdir(tmp_path) == []
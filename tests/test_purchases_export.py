@@ -0,0 +1,75 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from models import PurchaseRecord
+from conftest import ADMIN_TOKEN
+
+
+def add_purchases(engine, count):
+    with Session(engine) as session:
+        for i in range(1, count + 1):
+            session.add(PurchaseRecord(
+                payment_id=f"pay-{i}",
+                payment_method="mp" if i % 2 else "transferencia",
+                status="approved",
+                total_paid=100.0 * i,
+                items=json.dumps([{"title": "Malbec", "quantity": i}]),
+                user_data=json.dumps({"name": "Ana", "last_name": "Pérez", "email": f"ana{i}@example.com"}),
+                created_at=f"2024-05-{i:02d} 10:00:00",
+            ))
+        session.commit()
+
+
+def read_csv(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+
+
+@pytest.mark.parametrize("use_gzip", [False, True])
+def test_csv_export_streams_in_chunks(app_main, monkeypatch, use_gzip):
+    monkeypatch.setattr(app_main, "CSV_CHUNK_SIZE", 2)
+    add_purchases(app_main.engine_compras, 5)
+
+    chunks = list(app_main.iter_purchases_csv(None, None, None, None, use_gzip))
+    data = b"".join(chunks)
+    if use_gzip:
+        data = gzip.decompress(data)
+    else:
+        # Encabezado + 3 bloques de filas (2, 2 y 1)
+        assert len(chunks) == 4
+
+    rows = read_csv(data)
+    assert rows[0] == app_main.CSV_HEADER
+    assert [row[0] for row in rows[1:]] == ["1", "2", "3", "4", "5"]
+
+
+def test_csv_keeps_original_column_order(app_main):
+    add_purchases(app_main.engine_compras, 1)
+    header, row = read_csv(b"".join(app_main.iter_purchases_csv(None, None, None, None, False)))
+
+    # Las planillas viejas leen las 8 primeras columnas por posición
+    assert header[:8] == ["ID", "Payment ID", "Payment Method", "Status", "Total Paid", "Items", "User Data", "Created At"]
+    assert row[:4] == ["1", "pay-1", "mp", "approved"]
+    assert row[7] == "2024-05-01 10:00:00"
+    assert dict(zip(header[8:], row[8:]))["Apellido"] == "Pérez"
+    assert dict(zip(header[8:], row[8:]))["Detalle Items"] == "1x Malbec"
+
+
+def test_csv_endpoint_filters_and_gzip(app_main):
+    add_purchases(app_main.engine_compras, 4)
+    client = TestClient(app_main.app)
+
+    response = client.get(
+        "/api/admin/backup/compras-csv",
+        params={"payment_method": "transferencia", "gzip": "true"},
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith("ventas.csv.gz")
+    rows = read_csv(gzip.decompress(response.content))
+    assert [row[0] for row in rows[1:]] == ["2", "4"]
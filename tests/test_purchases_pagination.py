@@ -0,0 +1,66 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from models import PurchaseRecord
+from conftest import ADMIN_TOKEN
+
+
+@pytest.fixture
+def client(app_main):
+    # Varias compras en el mismo segundo: el id desempata el orden de la página
+    created = ["2024-05-01 10:00:00", "2024-05-01 10:00:00", "2024-05-01 10:00:00", "2024-05-02 09:00:00", "2024-05-03 18:30:00"]
+    with Session(app_main.engine_compras) as session:
+        for i, created_at in enumerate(created, start=1):
+            session.add(PurchaseRecord(
+                payment_id=f"pay-{i}",
+                payment_method="mp" if i % 2 else "transferencia",
+                status="pending" if i == 3 else "approved",
+                total_paid=100.0,
+                items=json.dumps([]),
+                user_data=json.dumps({}),
+                created_at=created_at,
+            ))
+        session.commit()
+    return TestClient(app_main.app, headers={"X-Admin-Token": ADMIN_TOKEN})
+
+
+def fetch_all(client, **params):
+    pages, cursor = [], None
+    while True:
+        response = client.get("/api/admin/purchases", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append([p["id"] for p in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_cursor_walks_every_purchase_once(client):
+    assert fetch_all(client, limit=2) == [[5, 4], [3, 2], [1]]
+
+
+def test_last_full_page_has_no_cursor(client):
+    response = client.get("/api/admin/purchases", params={"limit": 5})
+    assert [p["id"] for p in response.json()] == [5, 4, 3, 2, 1]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_filters_apply_on_every_page(client):
+    assert fetch_all(client, limit=1, payment_method="mp", status="approved") == [[5], [1]]
+    assert fetch_all(client, date_from="2024-05-02", date_to="2024-05-02") == [[4]]
+    # Una fecha sola en date_to incluye todo ese día
+    assert fetch_all(client, date_to="2024-05-01") == [[3, 2, 1]]
+
+
+def test_cursor_round_trip(app_main):
+    purchase = PurchaseRecord(id=7, payment_method="mp", status="approved", total_paid=1.0,
+                              items="[]", user_data="{}", created_at="2024-05-01 10:00:00")
+    assert app_main.decode_purchase_cursor(app_main.encode_purchase_cursor(purchase)) == ("2024-05-01 10:00:00", 7)
+
+
+def test_invalid_cursor_is_rejected(client):
+    response = client.get("/api/admin/purchases", params={"cursor": "no-es-un-cursor"})
+    assert response.status_code == 400
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import uploads
+from uploads import MB, UploadRejected, UploadSizeLimitMiddleware, sniff_content_type, stream_to_disk
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+PDF = b"%PDF-1.7\n" + b"x" * 32
+
+
+@pytest.mark.parametrize("head, expected", [
+    (PNG, "image/png"),
+    (b"\xff\xd8\xff\xe0" + b"\x00" * 8, "image/jpeg"),
+    (b"RIFF\x10\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"GIF89a\x01\x00", "image/gif"),
+    (PDF, "application/pdf"),
+    (b"\r\n" * 10 + PDF, "application/pdf"),  # Basura antes de la cabecera del PDF
+    (b"SQLite format 3\x00" + b"\x00" * 8, "application/vnd.sqlite3"),
+    (b"<html><script>", None),
+    (b"RIFF\x10\x00\x00\x00WAVEfmt ", None),
+])
+def test_sniff_content_type(head, expected):
+    assert sniff_content_type(head) == expected
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if name.startswith(".upload-")]
+
+
+def test_stream_to_disk_hashes_and_moves(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 8)
+    data = PNG * 3
+    stored = stream_to_disk(io.BytesIO(data), "../../foto.png", MB, uploads.IMAGE_TYPES, str(tmp_path))
+
+    assert (stored.size, stored.content_type, stored.extension) == (len(data), "image/png", ".png")
+    assert stored.sha256 == hashlib.sha256(data).hexdigest()
+    assert stored.filename == "foto.png"
+
+    destination = str(tmp_path / "products" / f"{stored.sha256}.png")
+    assert stored.move_to(destination)
+    with open(destination, "rb") as f:
+        assert f.read() == data
+    # Una subida repetida no pisa el archivo: se descarta el temporal
+    again = stream_to_disk(io.BytesIO(data), "foto.png", MB, uploads.IMAGE_TYPES, str(tmp_path))
+    assert not again.move_to(destination)
+    assert leftovers(tmp_path) == []
+
+
+def test_type_is_sniffed_not_taken_from_filename(tmp_path):
+    with pytest.raises(UploadRejected) as rejected:
+        stream_to_disk(io.BytesIO(b"<html>" + b"x" * 32), "foto.png", MB, uploads.IMAGE_TYPES, str(tmp_path))
+    assert rejected.value.status_code == 415
+    assert "GIF, JPG, PNG, WEBP" in rejected.value.detail
+    with pytest.raises(UploadRejected) as rejected:
+        stream_to_disk(io.BytesIO(PDF), "ficha.png", MB, uploads.IMAGE_TYPES, str(tmp_path))
+    assert rejected.value.status_code == 415
+    assert leftovers(tmp_path) == []
+
+
+def test_oversized_upload_is_rejected_while_streaming(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 16)
+    with pytest.raises(UploadRejected) as rejected:
+        stream_to_disk(io.BytesIO(PNG + b"\x00" * 100), "foto.png", 64, uploads.IMAGE_TYPES, str(tmp_path))
+    assert rejected.value.status_code == 413
+    assert leftovers(tmp_path) == []
+
+
+def test_empty_upload_is_rejected(tmp_path):
+    with pytest.raises(UploadRejected) as rejected:
+        stream_to_disk(io.BytesIO(b""), "foto.png", MB, uploads.IMAGE_TYPES, str(tmp_path))
+    assert rejected.value.status_code == 400
+    assert leftovers(tmp_path) == []
+
+
+@pytest.fixture
+def limited_client():
+    async def upload(request):
+        return PlainTextResponse(str(len(await request.body())))
+
+    app = Starlette(routes=[Route("/upload", upload, methods=["POST"]), Route("/other", upload, methods=["POST"])])
+    return TestClient(UploadSizeLimitMiddleware(app, {"/upload": MB}))
+
+
+def test_middleware_rejects_by_content_length(limited_client):
+    too_big = b"x" * (MB + UploadSizeLimitMiddleware.MULTIPART_OVERHEAD + 1)
+
+    response = limited_client.post("/upload", content=too_big)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "El archivo supera el límite de 1MB"}
+    # Las rutas sin límite y los cuerpos dentro del margen pasan
+    assert limited_client.post("/other", content=too_big).status_code == 200
+    assert limited_client.post("/upload", content=b"x" * MB).status_code == 200
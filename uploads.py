@@ -0,0 +1,176 @@
+# uploads.py
+"""
+Recepción de archivos subidos (imágenes, fichas PDF, comprobantes, bases .db).
+
+Todos los endpoints de subida pasan por stream_to_disk: copia por bloques a un
+archivo temporal con tope de tamaño, detecta el tipo real por los primeros bytes
+(no por la extensión ni el Content-Type del cliente) y calcula el SHA-256
+mientras copia. La memoria usada es un bloque, sin importar el tamaño del archivo.
+
+Son funciones bloqueantes: los endpoints que las usan son `def` (FastAPI las
+ejecuta en el threadpool) o las llaman con run_in_threadpool.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from typing import Dict, Iterable, Optional
+
+CHUNK_SIZE = 1024 * 1024
+
+MB = 1024 * 1024
+MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_MB", "15")) * MB
+MAX_FICHA_BYTES = int(os.getenv("UPLOAD_MAX_FICHA_MB", "20")) * MB
+MAX_RECEIPT_BYTES = int(os.getenv("UPLOAD_MAX_RECEIPT_MB", "5")) * MB
+MAX_DATABASE_BYTES = int(os.getenv("UPLOAD_MAX_DB_MB", "200")) * MB
+
+IMAGE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
+PDF_TYPES = {"application/pdf"}
+RECEIPT_TYPES = IMAGE_TYPES | PDF_TYPES
+DATABASE_TYPES = {"application/vnd.sqlite3"}
+
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "application/pdf": ".pdf",
+    "application/vnd.sqlite3": ".db",
+}
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Tipo MIME según la firma del archivo (magic bytes)."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    # Algunos generadores de PDF dejan bytes antes de la cabecera: se busca en el primer KB
+    if b"%PDF-" in head[:1024]:
+        return "application/pdf"
+    if head.startswith(b"SQLite format 3\x00"):
+        return "application/vnd.sqlite3"
+    return None
+
+
+def _describe(types: Iterable[str]) -> str:
+    return ", ".join(sorted(EXTENSIONS.get(t, t).lstrip(".").upper() for t in types))
+
+
+class StoredUpload:
+    """Archivo ya recibido en un temporal. Hay que llamar a move_to() o discard()."""
+
+    def __init__(self, path: str, size: int, sha256: str, content_type: str, filename: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+        self.filename = filename
+        self.moved = False
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS.get(self.content_type, "")
+
+    def move_to(self, destination: str) -> bool:
+        """
+        Mueve el temporal a destination. Si ya existe un archivo con ese nombre
+        (subida repetida con nombre por hash) se descarta el temporal y devuelve False.
+        """
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        if os.path.exists(destination):
+            self.discard()
+            return False
+        os.replace(self.path, destination)
+        self.path = destination
+        self.moved = True
+        return True
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def stream_to_disk(
+    source,
+    filename: Optional[str],
+    max_bytes: int,
+    allowed_types: Iterable[str],
+    directory: Optional[str] = None,
+) -> StoredUpload:
+    """
+    Copia source (un archivo abierto, p. ej. UploadFile.file) a un temporal en directory.
+    Lanza UploadRejected (413 si supera max_bytes, 415 si el tipo no está permitido).
+    """
+    allowed_types = set(allowed_types)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=directory)
+    sha = hashlib.sha256()
+    size = 0
+    content_type = None
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_content_type(chunk)
+                    if content_type not in allowed_types:
+                        raise UploadRejected(415, f"Tipo de archivo no permitido. Se aceptan: {_describe(allowed_types)}")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(413, f"El archivo supera el límite de {max_bytes // MB}MB")
+                sha.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadRejected(400, "El archivo está vacío")
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return StoredUpload(tmp_path, size, sha.hexdigest(), content_type, os.path.basename(filename or "archivo"))
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rechaza con 413 las subidas cuyo Content-Length supera el límite de su ruta,
+    antes de que Starlette lea y guarde el cuerpo multipart.
+    (stream_to_disk vuelve a controlar el tamaño real: el header puede faltar o mentir.)
+    """
+
+    # Margen para los campos del formulario y los separadores multipart
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"])
+            if limit is not None:
+                content_length = dict(scope["headers"]).get(b"content-length")
+                if content_length and content_length.isdigit() and int(content_length) > limit + self.MULTIPART_OVERHEAD:
+                    body = json.dumps({"detail": f"El archivo supera el límite de {limit // MB}MB"}).encode("utf-8")
+                    await send({
+                        "type": "http.response.start",
+                        "status": 413,
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+        await self.app(scope, receive, send)
@@ -0,0 +1,117 @@
+# whatsapp.py
+import os
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class WhatsAppAPIError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Error HTTP {status_code} de WhatsApp: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class WhatsAppClient:
+    """
+    Cliente HTTP para la WhatsApp Cloud API con conexiones keep-alive reutilizables,
+    timeouts explícitos, concurrencia acotada y reintentos ante 429/5xx que
+    respetan Retry-After. La URL base se puede cambiar (WHATSAPP_API_BASE_URL)
+    para apuntar a un mock local en tests.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: int = 3,
+        max_retry_wait: float = 30.0,
+    ):
+        self.base_url = (base_url or os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com/v20.0")).rstrip("/")
+        self.timeout = (
+            connect_timeout or float(os.getenv("WHATSAPP_CONNECT_TIMEOUT", "5")),
+            read_timeout or float(os.getenv("WHATSAPP_READ_TIMEOUT", "15")),
+        )
+        max_concurrency = max_concurrency or int(os.getenv("WHATSAPP_MAX_CONCURRENCY", "2"))
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retry_after(self, response: requests.Response, attempt: int) -> float:
+        header = response.headers.get("Retry-After")
+        wait = None
+        if header:
+            try:
+                wait = float(header)
+            except ValueError:
+                try:
+                    wait = parsedate_to_datetime(header).timestamp() - time.time()
+                except Exception:
+                    wait = None
+        if wait is None:
+            wait = 2 ** attempt
+        return max(0.0, min(wait, self.max_retry_wait))
+
+    def send_message(self, phone_id: str, token: str, payload: dict) -> dict:
+        url = f"{self.base_url}/{phone_id}/messages"
+        headers = {"Authorization": f"Bearer {token}"}
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                try:
+                    with metrics.timer("external_call_duration_seconds", service="whatsapp", operation="messages"):
+                        response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.max_retries:
+                        raise
+                    response = None
+            if response is None:
+                time.sleep(min(2 ** attempt, self.max_retry_wait))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                time.sleep(self._retry_after(response, attempt))
+                continue
+            if response.status_code >= 400:
+                raise WhatsAppAPIError(response.status_code, response.text[:500])
+            return response.json() if response.content else {}
+        raise RuntimeError("WhatsApp: reintentos agotados")
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[WhatsAppClient] = None
+_client_lock = threading.Lock()
+
+
+def get_whatsapp_client() -> WhatsAppClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = WhatsAppClient()
+        return _client
+
+
+def set_whatsapp_client(client: Optional[WhatsAppClient]):
+    """Permite reemplazar el cliente (por ejemplo en tests, apuntando a un mock local)."""
+    global _client
+    with _client_lock:
+        if _client is not None and _client is not client:
+            _client.close()
+        _client = client